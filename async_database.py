@@ -0,0 +1,90 @@
+# async_database.py
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from database import get_manager
+from storage_backend import _env_int
+
+class AsyncMongoDBManager:
+    """
+    Asyncio front for the storage backend returned by get_manager().
+    Each call runs the synchronous operation on a dedicated thread pool
+    that shares the process-wide pooled client (or per-thread SQLite
+    connections), so independent queries can be awaited concurrently
+    (e.g. with gather()).
+    """
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or _env_int('PASSWORD_MANAGER_ASYNC_DB_WORKERS', 8)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        """Return this process's executor, recreating it after a fork"""
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix="mongo-async"
+                )
+                self._pid = os.getpid()
+            return self._executor
+
+    async def run(self, func, *args, **kwargs):
+        """Run a blocking callable on the database thread pool"""
+        # Carry the Streamlit script context so st.error() from the manager still renders,
+        # and the contextvars (e.g. the metrics section) so commands are attributed correctly
+        ctx = get_script_run_ctx()
+        context = contextvars.copy_context()
+
+        def call():
+            if ctx is not None:
+                add_script_run_ctx(threading.current_thread(), ctx)
+            return context.run(func, *args, **kwargs)
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), call)
+
+    async def call(self, method_name, *args, **kwargs):
+        """Await any storage backend method by name"""
+        manager = await self.run(get_manager)
+        return await self.run(getattr(manager, method_name), *args, **kwargs)
+
+    def shutdown(self, wait=True):
+        """Stop the worker threads"""
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=wait)
+            self._executor = None
+            self._pid = None
+
+async def gather(*aws):
+    """Await several database calls concurrently, results in argument order"""
+    return await asyncio.gather(*aws)
+
+def run_blocking(coro):
+    """
+    Run a coroutine to completion from synchronous code such as a
+    Streamlit script, e.g. run_blocking(gather(a, b, c)).
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    # Already inside an event loop: drive the coroutine on a helper thread
+    with ThreadPoolExecutor(max_workers=1) as helper:
+        return helper.submit(asyncio.run, coro).result()
+
+def gather_blocking(*aws):
+    """Synchronous shortcut for run_blocking(gather(*aws))"""
+    return run_blocking(gather(*aws))
+
+# Global async MongoDB manager instance
+async_mongo_manager = AsyncMongoDBManager()
+
+def get_async_manager():
+    """Return the process-wide async MongoDB manager"""
+    return async_mongo_manager
@@ -0,0 +1,68 @@
+# cipher_suites.py
+import os
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+# Envelope format tag (first stored byte) for AEAD ciphertexts:
+#   0x02 | suite id (1 byte) | nonce | ciphertext + tag
+# The two header bytes are authenticated as associated data.
+FORMAT_AEAD = 0x02
+# Same layout, sealed with the owner's data key instead of the master key
+FORMAT_USER_KEY = 0x03
+
+def derive_key(master_key, info, length=32):
+    """Derive an independent per-suite key from the raw master key"""
+    return HKDF(algorithm=hashes.SHA256(), length=length, salt=None, info=info).derive(master_key)
+
+class CipherSuite:
+    """
+    One AEAD algorithm bound to one key. Subclasses set name, suite_id
+    (stored in every envelope, so never reuse one) and the AEAD class.
+    With derive=False the key is used as-is (per-user data keys).
+    """
+    name = None
+    suite_id = None
+    aead_class = None
+    nonce_size = 12
+
+    def __init__(self, key, derive=True, format_tag=FORMAT_AEAD):
+        if derive:
+            key = derive_key(key, f"password-manager/{self.name}".encode())
+        self.aead = self.aead_class(key)
+        self.header = bytes([format_tag, self.suite_id])
+
+    def seal(self, plaintext):
+        """Encrypt bytes into a complete envelope"""
+        nonce = os.urandom(self.nonce_size)
+        return self.header + nonce + self.aead.encrypt(nonce, plaintext, self.header)
+
+    def open(self, envelope):
+        """Decrypt an envelope sealed by this suite; raises InvalidTag on a wrong key"""
+        nonce = envelope[2:2 + self.nonce_size]
+        return self.aead.decrypt(nonce, envelope[2 + self.nonce_size:], self.header)
+
+class AESGCMSuite(CipherSuite):
+    name = "aes-256-gcm"
+    suite_id = 1
+    aead_class = AESGCM
+
+class ChaCha20Poly1305Suite(CipherSuite):
+    name = "chacha20-poly1305"
+    suite_id = 2
+    aead_class = ChaCha20Poly1305
+
+# Registry of available suites, by configuration name and by envelope id
+CIPHER_SUITES = {}
+CIPHER_SUITES_BY_ID = {}
+
+def register_cipher_suite(suite_class):
+    """Make a CipherSuite subclass available for encryption and decryption"""
+    if suite_class.suite_id in CIPHER_SUITES_BY_ID:
+        raise ValueError(f"Cipher suite id {suite_class.suite_id} already registered")
+    CIPHER_SUITES[suite_class.name] = suite_class
+    CIPHER_SUITES_BY_ID[suite_class.suite_id] = suite_class
+    return suite_class
+
+register_cipher_suite(AESGCMSuite)
+register_cipher_suite(ChaCha20Poly1305Suite)
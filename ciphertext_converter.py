@@ -0,0 +1,96 @@
+# ciphertext_converter.py
+import os
+import threading
+import time
+from encryption import encryption_manager
+from storage_backend import _env_int
+
+class CiphertextFormatConverter:
+    """
+    Background job that rewrites legacy base64 Fernet tokens into the
+    binary storage format, one batch at a time in primary-key order.
+    Tokens are only repacked (never decrypted), and each row is swapped
+    only if it still holds the old token, so live edits are never lost.
+    """
+    def __init__(self, batch_size=None, pause=None):
+        self.batch_size = batch_size or max(1, _env_int('PASSWORD_MANAGER_CIPHERTEXT_CONVERT_BATCH', 500))
+        # Pause between batches so the converter never monopolizes the database
+        self.pause = pause if pause is not None else _env_int('PASSWORD_MANAGER_CIPHERTEXT_CONVERT_PAUSE_MS', 100) / 1000
+        self.converted = 0
+        self.skipped = 0
+        self.done = False
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def run(self, manager=None):
+        """Convert every remaining legacy row; returns the number converted"""
+        if manager is None:
+            # Imported lazily: database imports this module
+            from database import get_manager
+            manager = get_manager()
+        converted = 0
+        after = None
+        while True:
+            batch = manager.get_ciphertext_batch(self.batch_size, after=after, text_only=True)
+            if not batch:
+                break
+            after = batch[-1]["_id"]
+            replacements = []
+            for entry in batch:
+                packed = encryption_manager.to_binary_format(entry["password"])
+                if packed is None:
+                    self.skipped += 1
+                else:
+                    replacements.append((entry["_id"], entry["password"], packed))
+            changed = manager.replace_ciphertexts(replacements)
+            converted += changed
+            self.converted += changed
+            if len(batch) < self.batch_size:
+                break
+            if self.pause:
+                time.sleep(self.pause)
+        self.done = True
+        return converted
+
+    def start(self):
+        """Run the conversion once in a daemon thread (no-op if running or done)"""
+        if self.done or encryption_manager.storage_format != "binary":
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="ciphertext-converter", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        try:
+            self.run()
+        except Exception as e:
+            # Left not done, so the next start() resumes from the first legacy row
+            self.last_error = str(e)
+            print(f"ciphertext conversion failed: {e}")
+
+    def status(self):
+        """Progress snapshot for diagnostics pages"""
+        return {
+            "converted": self.converted,
+            "skipped": self.skipped,
+            "done": self.done,
+            "running": self._thread is not None and self._pid == os.getpid() and self._thread.is_alive(),
+            "last_error": self.last_error,
+        }
+
+    def _reset_after_fork(self):
+        """The converter thread does not survive fork()"""
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+# Global ciphertext format converter
+ciphertext_converter = CiphertextFormatConverter()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=ciphertext_converter._reset_after_fork)
@@ -0,0 +1,151 @@
+# circuit_breaker.py
+import random
+import threading
+import time
+from pymongo import monitoring
+
+# Failure types that mean "the server is unreachable or too slow", as
+# reported by pymongo in CommandFailedEvent.failure['errtype']
+_UNAVAILABLE_ERRORS = {
+    "AutoReconnect", "ConnectionFailure", "NetworkTimeout", "NotPrimaryError",
+    "ServerSelectionTimeoutError", "ExecutionTimeout", "WTimeoutError",
+}
+_MAX_TIME_EXPIRED = 50  # Server error code for maxTimeMS exceeded
+
+class CircuitBreaker:
+    """
+    Fail-fast guard for a remote dependency.
+
+    closed    -> calls go through; consecutive failures are counted
+    open      -> calls are refused immediately; a background thread probes
+                 the dependency with exponential backoff (plus jitter)
+    half_open -> a probe is in flight; calls are still refused
+    A successful probe closes the breaker again.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, probe=None, failure_threshold=3, base_delay=0.5, max_delay=30.0):
+        self.name = name
+        self.probe = probe
+        self.failure_threshold = max(1, failure_threshold)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.last_error = None
+        self.next_retry_in = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def allow(self):
+        """True when calls may go to the dependency"""
+        return self.state == self.CLOSED
+
+    def is_open(self):
+        return self.state != self.CLOSED
+
+    def record_success(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                self.failures = 0
+
+    def record_failure(self, error=None):
+        """Count a failure; trips the breaker at the threshold"""
+        with self._lock:
+            self.last_error = str(error) if error else self.last_error
+            if self.state != self.CLOSED:
+                return
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self._open()
+
+    def trip(self, error=None):
+        """Open the breaker immediately (e.g. connection refused)"""
+        with self._lock:
+            self.last_error = str(error) if error else self.last_error
+            if self.state == self.CLOSED:
+                self._open()
+
+    def _open(self):
+        # Caller holds self._lock
+        self.state = self.OPEN
+        self.opened_at = time.time()
+        if self.probe is not None and (self._thread is None or not self._thread.is_alive()):
+            self._thread = threading.Thread(
+                target=self._reconnect_loop, name=f"{self.name}-reconnect", daemon=True
+            )
+            self._thread.start()
+
+    def _reconnect_loop(self):
+        delay = self.base_delay
+        while True:
+            # Full jitter keeps several processes from probing in lockstep
+            self.next_retry_in = delay
+            time.sleep(random.uniform(delay / 2, delay))
+            with self._lock:
+                self.state = self.HALF_OPEN
+            try:
+                recovered = bool(self.probe())
+            except Exception as e:
+                self.last_error = str(e)
+                recovered = False
+            with self._lock:
+                if recovered:
+                    self.state = self.CLOSED
+                    self.failures = 0
+                    self.opened_at = None
+                    self.next_retry_in = None
+                    return
+                self.state = self.OPEN
+            delay = min(delay * 2, self.max_delay)
+
+    def reset_after_fork(self):
+        """The reconnect thread does not survive fork(); start closed"""
+        self._lock = threading.Lock()
+        self._thread = None
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+
+    def status(self):
+        """Snapshot for diagnostics pages"""
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "open_for_seconds": round(time.time() - self.opened_at, 1) if self.opened_at else 0,
+            "next_retry_in_seconds": self.next_retry_in if self.is_open() else None,
+            "last_error": self.last_error,
+        }
+
+class BreakerListener(monitoring.CommandListener, monitoring.ServerHeartbeatListener):
+    """
+    Feeds a CircuitBreaker from pymongo events: network errors and
+    deadline overruns count as failures, successful commands reset the
+    count, and failed server heartbeats count as failures too.
+    """
+    def __init__(self, breaker):
+        self.breaker = breaker
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self.breaker.record_success()
+
+    def failed(self, event):
+        failure = event.failure or {}
+        if failure.get("errtype") in _UNAVAILABLE_ERRORS or failure.get("code") == _MAX_TIME_EXPIRED:
+            self.breaker.record_failure(failure.get("errmsg"))
+
+    # ServerHeartbeatListener
+    def started_heartbeat(self, event):
+        pass
+
+    def succeeded_heartbeat(self, event):
+        pass
+
+    def failed_heartbeat(self, event):
+        self.breaker.record_failure(event.reply)
@@ -1,10 +1,17 @@
 # crud_operations.py
-from database import mongo_manager
-from datetime import datetime
+from database import get_manager
+from login_tracker import last_login_tracker
+from password_hashing import HashingOverloaded
+from preauth import preauth_tickets
+from rate_limiter import rate_limiter, client_key, is_identified, LOGIN_POLICY, CLIENT_POLICY, OTP_POLICY
 import streamlit as st
 import time
 import re
 from encryption import encryption_manager
+from storage_backend import _env_int
+
+# How long a session trusts its cached user profile (other sessions may change it)
+PROFILE_CACHE_SECONDS = _env_int('PASSWORD_MANAGER_PROFILE_CACHE_SECONDS', 300)
 
 # Validation pattern
 SERVICE_NAME_PATTERN = re.compile(r'^[a-zA-Z0-9_\- ]+$')
@@ -12,12 +19,22 @@ SERVICE_NAME_PATTERN = re.compile(r'^[a-zA-Z0-9_\- ]+$')
 def is_valid_service_name(service):
     return bool(SERVICE_NAME_PATTERN.match(service)) and len(service.strip()) > 0
 
+def format_timestamp(entry):
+    """Format the last-modified time of a stored entry for display"""
+    timestamp = entry.get('updated_at', entry.get('created_at'))
+    return timestamp.strftime("%Y-%m-%d %H:%M:%S") if timestamp else 'N/A'
+
 def _ensure_db_connection():
     """Helper to ensure database connection before operation."""
-    if not mongo_manager.is_connected():
-        if not mongo_manager.init_database():
+    manager = get_manager()
+    if not manager.is_connected():
+        breaker = getattr(manager, 'breaker', None)
+        if breaker is not None and breaker.is_open():
+            # Circuit open: fail fast instead of waiting on a dead server
+            st.error("Database temporarily unavailable. Reconnecting in the background, please try again shortly.")
+        else:
             st.error("Failed to connect to database.")
-            return False
+        return False
     return True
 
 def register_user(username, password):
@@ -32,7 +49,7 @@ def register_user(username, password):
         return False
         
     # Create user
-    return mongo_manager.create_user(username, password)
+    return get_manager().create_user(username, password)
 
 def verify_user_credentials(username, password):
     """
@@ -44,7 +61,132 @@ def verify_user_credentials(username, password):
     if not _ensure_db_connection():
         return False
         
-    return mongo_manager.verify_user(username, password)
+    try:
+        return get_manager().verify_user(username, password)
+    except HashingOverloaded as e:
+        st.warning(f"⏳ {e}")
+        return False
+
+def _profile_cache():
+    if 'user_profiles' not in st.session_state:
+        st.session_state.user_profiles = {}
+    return st.session_state.user_profiles
+
+def get_user_profile(username, refresh=False):
+    """
+    The user's profile (username, 2FA flag and secret, is_admin, created_at,
+    last_login; never the password hash), read at most once per session
+    and PROFILE_CACHE_SECONDS. Call invalidate_user_profile() after
+    changing any of those fields.
+    """
+    cache = _profile_cache()
+    cached = cache.get(username)
+    if cached and not refresh and time.time() - cached[1] < PROFILE_CACHE_SECONDS:
+        return cached[0]
+    if not _ensure_db_connection():
+        return None
+    profile = get_manager().get_user_profile(username)
+    if profile is not None:
+        cache[username] = (profile, time.time())
+    return profile
+
+def invalidate_user_profile(username=None):
+    """Drop one user's cached profile (or all of them) from this session"""
+    cache = _profile_cache()
+    if username is None:
+        cache.clear()
+    else:
+        cache.pop(username, None)
+
+def verify_login(username, password):
+    """
+    Verify credentials and read the 2FA flag with one users read; the
+    profile is cached for the 2FA step. Returns (verified,
+    two_factor_enabled); the flag is False when verification fails.
+    verified is None when the hashing pool is saturated and the login
+    was shed (not a failed attempt).
+    """
+    if not username or not password:
+        return False, False
+        
+    if not _ensure_db_connection():
+        return False, False
+        
+    try:
+        profile = get_manager().authenticate(username, password)
+    except HashingOverloaded as e:
+        st.warning(f"⏳ {e}")
+        return None, False
+    if profile is None:
+        return False, False
+    _profile_cache()[username] = (profile, time.time())
+    return True, bool(profile.get('two_factor_enabled'))
+
+def _mirror_lockout(status):
+    """Copy a server-side lock into session state for the lock screen"""
+    st.session_state.account_locked = True
+    st.session_state.lock_time = status.lock_deadline
+
+def login_lockout(username=None):
+    """
+    Active login lock for this client, or for this user from this client
+    when username is given; None if not locked. Counters are shared by
+    every tab and process (rate_limiter), not kept per session, unless the
+    client address is unknown: then they are scoped to this session.
+    """
+    client = client_key()
+    checks = [(LOGIN_POLICY, username, client)] if username else []
+    if is_identified(client):
+        checks.append((CLIENT_POLICY, client))
+    for policy, *parts in checks:
+        status = rate_limiter.check(policy, *parts)
+        if status.locked:
+            _mirror_lockout(status)
+            return status
+    return None
+
+def record_login_failure(username):
+    """
+    Count a wrong password for the user and the client. Returns the
+    user's LimitStatus, or the client's if only that one locked.
+    """
+    client = client_key()
+    status = rate_limiter.hit(LOGIN_POLICY, username, client)
+    st.session_state.login_attempts = status.failures
+    if is_identified(client):
+        client_status = rate_limiter.hit(CLIENT_POLICY, client)
+        if client_status.locked and not status.locked:
+            status = client_status
+    if status.locked:
+        _mirror_lockout(status)
+    return status
+
+def clear_login_failures(username):
+    """Reset the user's failed-password counter after a correct password"""
+    rate_limiter.reset(LOGIN_POLICY, username, client_key())
+    st.session_state.login_attempts = 0
+
+def otp_lockout(username):
+    """Active 2FA lock for this user from this client, or None"""
+    status = rate_limiter.check(OTP_POLICY, username, client_key())
+    st.session_state.otp_attempts = status.failures
+    if status.locked:
+        _mirror_lockout(status)
+        return status
+    return None
+
+def record_otp_failure(username):
+    """Count a wrong 2FA code; returns the LimitStatus"""
+    status = rate_limiter.hit(OTP_POLICY, username, client_key())
+    st.session_state.otp_attempts = status.failures
+    if status.locked:
+        _mirror_lockout(status)
+    return status
+
+def clear_otp_failures(username):
+    """Reset the user's wrong-code counter after a valid code"""
+    rate_limiter.reset(OTP_POLICY, username, client_key())
+    st.session_state.otp_attempts = 0
 
 def service_exists(username, service):
     """
@@ -55,12 +197,7 @@ def service_exists(username, service):
             return False
                 
         # Check if service exists
-        existing_entry = mongo_manager.db.passwords.find_one({
-            "username": username,
-            "service": service
-        })
-        
-        return existing_entry is not None
+        return get_manager().get_password_entry(username, service) is not None
     except Exception as e:
         st.error(f"Error checking service existence: {str(e)}")
         return False
@@ -83,16 +220,11 @@ def save_password(service, service_username, password):
         st.error("Error: No user logged in")
         return False
         
-    # Check if service already exists
-    if service_exists(current_user, service):
-        st.error(f"Error: Service '{service}' already exists. Use update instead.")
-        return False
-        
     if not _ensure_db_connection():
         return False
         
-    # Save the password
-    return mongo_manager.save_password(current_user, service, service_username, password)
+    # Insert the password; the unique (username, service) index rejects duplicates
+    return get_manager().create_password(current_user, service, service_username, password) is not None
 
 def get_password(service):
     """
@@ -111,41 +243,62 @@ def get_password(service):
         if not _ensure_db_connection():
             return None
                 
-        # Use the new decryption method
-        decrypted_password = mongo_manager.get_decrypted_password(current_user, service)
-        
-        if decrypted_password:
-            # Get the full entry for timestamp info
-            entry = mongo_manager.db.passwords.find_one({
-                "username": current_user,
-                "service": service
-            })
+        # Single lookup, then decrypt only this entry
+        entry = get_manager().get_password_entry(current_user, service)
+        if not entry or 'password' not in entry:
+            return None
             
+        decrypted_password = encryption_manager.decrypt_password(entry['password'], current_user)
+        if decrypted_password:
             return {
                 'service': service,
                 'username': entry.get('service_username'),
                 'password': decrypted_password,  # Decrypted password
-                'timestamp': entry.get('updated_at', entry.get('created_at')).strftime("%Y-%m-%d %H:%M:%S")
+                'timestamp': format_timestamp(entry)
             }
         return None
     except Exception as e:
         st.error(f"Error retrieving password: {str(e)}")
         return None
 
+def begin_2fa_login(username):
+    """
+    Hold a password-verified login until the 2FA code is entered.
+    Keeps a signed pre-auth ticket in session state, never the password.
+    """
+    st.session_state.temp_username = username
+    st.session_state.preauth_ticket = preauth_tickets.issue(username)
+    st.session_state.login_step = '2fa_verification'
+
+def has_pending_2fa_login():
+    """True while the session holds an unexpired, unused pre-auth ticket"""
+    username = st.session_state.get('temp_username')
+    ticket = st.session_state.get('preauth_ticket')
+    return bool(username and ticket and preauth_tickets.is_valid(ticket, username))
+
+def redeem_2fa_ticket(username):
+    """
+    Consume the session's pre-auth ticket after a valid TOTP code.
+    Replaces a second password check; False if the ticket is missing,
+    expired, already used or issued for another user.
+    """
+    ticket = st.session_state.get('preauth_ticket')
+    st.session_state.preauth_ticket = None
+    return bool(ticket) and preauth_tickets.redeem(ticket, username)
+
+def clear_2fa_login():
+    """Drop a pending 2FA login (back to login, navigation away, failure)"""
+    st.session_state.temp_username = None
+    st.session_state.preauth_ticket = None
+    st.session_state.login_step = None
+
 def complete_login(username):
     """
     Complete the login process after successful authentication
     This function should be called after both password and 2FA verification
     """
-    # Update last login time in database
-    if mongo_manager.is_connected():
-        try:
-            mongo_manager.db.users.update_one(
-                {"username": username},
-                {"$set": {"last_login": datetime.now()}}
-            )
-        except Exception as e:
-            st.error(f"Error updating login time: {str(e)}")
+    # Buffer the last login time; flushed to the database in the background
+    last_login_tracker.record(username)
     
     # Set session state variables
     st.session_state.authenticated = True
@@ -159,20 +312,72 @@ def complete_login(username):
     
     # Clear temporary credentials
     st.session_state.temp_username = None
-    st.session_state.temp_password = None
+    st.session_state.preauth_ticket = None
     st.session_state.otp_attempts = 0
-    st.session_state.otp_lock_time = None
     
     # Reset password cache
     if 'passwords_loaded' in st.session_state:
         st.session_state.passwords_loaded = False
     if 'passwords' in st.session_state:
         st.session_state.passwords = []
+    st.session_state.services_count = None
+    st.session_state.services_cursor = {}
     
     st.success("Login successful! Redirecting...")
     time.sleep(1)
     st.rerun()
 
+def _metadata_record(entry):
+    """Build a listing record (no password) from a stored entry"""
+    return {
+        'service': entry.get('service'),
+        'username': entry.get('service_username'),
+        'updated_at': entry.get('updated_at', entry.get('created_at'))
+    }
+
+def list_password_metadata():
+    """
+    List the current user's services without decrypting anything.
+    Each record holds the service, its username and the raw update time;
+    use get_password() to decrypt a single entry on demand.
+    """
+    current_user = st.session_state.get('current_user')
+    if not current_user:
+        st.error("Error: No user logged in")
+        return []
+        
+    if not _ensure_db_connection():
+        return []
+        
+    return [_metadata_record(entry) for entry in get_manager().get_user_password_metadata(current_user)]
+
+def list_password_page(limit, after=None, before=None, from_end=False):
+    """
+    Fetch one page of the current user's services (metadata only).
+    See MongoDBManager.get_password_page for the cursor arguments.
+    """
+    current_user = st.session_state.get('current_user')
+    if not current_user:
+        st.error("Error: No user logged in")
+        return []
+        
+    if not _ensure_db_connection():
+        return []
+        
+    entries = get_manager().get_password_page(current_user, limit, after, before, from_end)
+    return [_metadata_record(entry) for entry in entries]
+
+def count_passwords():
+    """Count the current user's saved services"""
+    current_user = st.session_state.get('current_user')
+    if not current_user:
+        return 0
+        
+    if not _ensure_db_connection():
+        return 0
+        
+    return get_manager().count_user_passwords(current_user)
+
 def get_all_passwords():
     """
     Retrieve all passwords for the current user
@@ -186,16 +391,20 @@ def get_all_passwords():
         if not _ensure_db_connection():
             return []
                 
-        entries = mongo_manager.get_user_passwords(current_user)
+        entries = get_manager().get_user_passwords(current_user)
+        # Passwords stored in DB are encrypted; decrypt them in parallel chunks
+        decrypted, errors = encryption_manager.decrypt_many(
+            [entry.get('password') for entry in entries], current_user
+        )
+        if errors:
+            st.error(f"Error: {len(errors)} password(s) could not be decrypted")
         passwords = []
-        for entry in entries:
-            # Passwords stored in DB are encrypted, decrypt them here for display
-            decrypted_pwd = encryption_manager.decrypt_password(entry.get('password'))
+        for entry, decrypted_pwd in zip(entries, decrypted):
             passwords.append({
                 'service': entry.get('service'),
                 'username': entry.get('service_username'),
-                'password': decrypted_pwd,  # Decrypted password
-                'timestamp': entry.get('updated_at', entry.get('created_at')).strftime("%Y-%m-%d %H:%M:%S")
+                'password': decrypted_pwd,  # Decrypted password (None if it failed)
+                'timestamp': format_timestamp(entry)
             })
         return passwords
     except Exception as e:
@@ -222,14 +431,12 @@ def update_password(service, new_password):
     if not _ensure_db_connection():
         return False
         
-    # Get the current service username to preserve it
-    current_data = get_password(service) # Use this to get service_username
-    if not current_data:
+    # Update the password in place; the service username is preserved server-side
+    updated = get_manager().update_password(current_user, service, new_password)
+    if not updated:
         st.error(f"No password found for service '{service}'")
         return False
-        
-    # Update the password while preserving the service username
-    return mongo_manager.save_password(current_user, service, current_data['username'], new_password)
+    return True
 
 def delete_password(service):
     """
@@ -247,32 +454,99 @@ def delete_password(service):
     if not _ensure_db_connection():
         return False
             
-    return mongo_manager.delete_password(current_user, service)
+    return get_manager().delete_password(current_user, service)
+
+def save_passwords_bulk(entries):
+    """
+    Save many credentials for the current user at once.
+    `entries` are dicts with service, service_username and password.
+    Invalid or duplicated entries are rejected individually; the rest are
+    encrypted and written in batches. Returns one result per entry, in
+    input order: {'service', 'status', 'error'}.
+    """
+    entries = list(entries)
+    current_user = st.session_state.get('current_user')
+    if not current_user:
+        st.error("Error: No user logged in")
+        return []
+        
+    results = [None] * len(entries)
+    accepted, positions, seen = [], [], set()
+    for index, entry in enumerate(entries):
+        service = entry.get('service') or ''
+        error = None
+        if not is_valid_service_name(service):
+            error = "Service name can only contain letters, numbers, spaces, hyphens, and underscores"
+        elif not (entry.get('password') or '').strip():
+            error = "Password cannot be blank"
+        elif service in seen:
+            error = "Duplicate service in batch"
+        if error:
+            results[index] = {'service': service, 'status': 'error', 'error': error}
+        else:
+            seen.add(service)
+            accepted.append(entry)
+            positions.append(index)
+            
+    if accepted:
+        if not _ensure_db_connection():
+            return []
+        for index, result in zip(positions, get_manager().save_passwords_bulk(current_user, accepted)):
+            results[index] = result
+    return results
+
+def delete_passwords_bulk(services):
+    """
+    Delete many services for the current user at once.
+    Returns one result per service, in input order: {'service', 'status', 'error'}.
+    """
+    services = list(services)
+    current_user = st.session_state.get('current_user')
+    if not current_user:
+        st.error("Error: No user logged in")
+        return []
+        
+    results = [None] * len(services)
+    accepted, positions, seen = [], [], set()
+    for index, service in enumerate(services):
+        if not is_valid_service_name(service or ''):
+            results[index] = {'service': service, 'status': 'error', 'error': "Invalid service name format"}
+        elif service in seen:
+            results[index] = {'service': service, 'status': 'error', 'error': "Duplicate service in batch"}
+        else:
+            seen.add(service)
+            accepted.append(service)
+            positions.append(index)
+            
+    if accepted:
+        if not _ensure_db_connection():
+            return []
+        for index, result in zip(positions, get_manager().delete_passwords_bulk(current_user, accepted)):
+            results[index] = result
+    return results
 
 def get_user_2fa_secret(username):
-    """Retrieves the 2FA secret for a given user."""
-    if not _ensure_db_connection():
-        return None
-    
-    return mongo_manager.get_user_2fa_secret(username)
+    """Retrieves the 2FA secret for a given user (from the cached profile)."""
+    profile = get_user_profile(username)
+    return profile.get('two_factor_secret') if profile else None
 
 def update_user_2fa_secret(username, secret):
     """Updates the 2FA secret for a given user."""
     if not _ensure_db_connection():
         return False
     
-    return mongo_manager.update_user_2fa_secret(username, secret)
+    invalidate_user_profile(username)
+    return get_manager().update_user_2fa_secret(username, secret)
 
 def set_user_2fa_enabled(username, enabled: bool):
     """Sets the 2FA enabled status for a given user."""
     if not _ensure_db_connection():
         return False
     
-    return mongo_manager.set_user_2fa_enabled(username, enabled)
+    invalidate_user_profile(username)
+    return get_manager().set_user_2fa_enabled(username, enabled)
 
 def is_2fa_enabled(username):
-    """Checks if 2FA is enabled for a given user."""
-    if not _ensure_db_connection():
-        return False
-    
-    return mongo_manager.is_2fa_enabled(username)
\ No newline at end of file
+    """Checks if 2FA is enabled for a given user (from the cached profile)."""
+    profile = get_user_profile(username)
+    return bool(profile.get('two_factor_enabled')) if profile else False
\ No newline at end of file
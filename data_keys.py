@@ -0,0 +1,205 @@
+# data_keys.py
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from cipher_suites import CIPHER_SUITES_BY_ID, FORMAT_USER_KEY
+
+DATA_KEY_SIZE = 32  # Bytes; AES-256-GCM and ChaCha20-Poly1305 both use 256-bit keys
+
+def _env_int(name, default):
+    # Local copy: storage_backend imports encryption, which imports this module
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+def _zeroize(buffer):
+    """Overwrite a key buffer in place (best effort; Python may hold other copies)"""
+    for position in range(len(buffer)):
+        buffer[position] = 0
+
+class _CachedKey:
+    __slots__ = ("key", "suites", "expires_at", "pins", "evicted")
+
+    def __init__(self, key, ttl):
+        self.key = key  # bytearray, so it can be zeroized
+        self.suites = {}  # suite_id -> CipherSuite bound to this key
+        self.expires_at = time.monotonic() + ttl
+        self.pins = 0  # Threads currently encrypting/decrypting with it
+        self.evicted = False
+
+class DataKeyManager:
+    """
+    Per-user data-encryption keys (DEKs).
+
+    Each user gets a random DEK, stored on the user record wrapped
+    (encrypted) by the master key. Passwords are sealed with the user's DEK
+    (envelope tag FORMAT_USER_KEY), so rotating the master key only rewraps
+    one key per user. Unwrapped DEKs live in a bounded LRU cache with a TTL
+    and are zeroized when evicted (deferred while a thread is using one).
+    """
+    def __init__(self, wrapper, max_size=None, ttl=None):
+        # Object with encrypt_bytes/decrypt_bytes/rotate_ciphertext under the master key
+        self.wrapper = wrapper
+        self.max_size = max_size or max(1, _env_int('PASSWORD_MANAGER_DEK_CACHE_SIZE', 1024))
+        self.ttl = ttl or max(1, _env_int('PASSWORD_MANAGER_DEK_CACHE_TTL_SECONDS', 300))
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _backend():
+        # Imported lazily: database imports encryption, which imports this module
+        from database import get_manager
+        return get_manager()
+
+    # --- cache ---
+    @staticmethod
+    def _discard(entry):
+        """Zeroize an evicted key now, or when its last user unpins it (lock held)"""
+        entry.evicted = True
+        if entry.pins == 0:
+            _zeroize(entry.key)
+
+    def _cached(self, username):
+        """Pinned cache entry for username, or None"""
+        with self._lock:
+            entry = self._cache.get(username)
+            if entry is None:
+                return None
+            if entry.expires_at <= time.monotonic():
+                del self._cache[username]
+                self._discard(entry)
+                return None
+            self._cache.move_to_end(username)
+            entry.pins += 1
+            return entry
+
+    def _remember(self, username, key):
+        """Cache a freshly unwrapped key; returns its pinned entry"""
+        entry = _CachedKey(key, self.ttl)
+        entry.pins = 1
+        with self._lock:
+            previous = self._cache.pop(username, None)
+            if previous is not None:
+                self._discard(previous)
+            self._cache[username] = entry
+            while len(self._cache) > self.max_size:
+                _, evicted = self._cache.popitem(last=False)
+                self._discard(evicted)
+        return entry
+
+    def _unpin(self, entry):
+        with self._lock:
+            entry.pins -= 1
+            if entry.evicted and entry.pins == 0:
+                _zeroize(entry.key)
+
+    def invalidate(self, username):
+        """Drop (and zeroize) one user's cached DEK"""
+        with self._lock:
+            entry = self._cache.pop(username, None)
+            if entry is not None:
+                self._discard(entry)
+
+    def clear(self):
+        """Drop (and zeroize) every cached DEK"""
+        with self._lock:
+            entries, self._cache = list(self._cache.values()), OrderedDict()
+            for entry in entries:
+                self._discard(entry)
+
+    # --- keys ---
+    def _load(self, username, create):
+        """Unwrap the user's DEK (creating it if asked); returns a pinned cache entry or None"""
+        entry = self._cached(username)
+        if entry is not None:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        backend = self._backend()
+        wrapped = backend.get_user_data_key(username)
+        if wrapped is None:
+            if not create:
+                return None
+            key = bytearray(os.urandom(DATA_KEY_SIZE))
+            # Compare-and-set: if another process created a key first, use that one
+            if not backend.set_user_data_key(username, self.wrapper.encrypt_bytes(bytes(key)), expected=None):
+                _zeroize(key)
+                wrapped = backend.get_user_data_key(username)
+                if wrapped is None:
+                    raise ValueError(f"Could not create a data key for {username}")
+        if wrapped is not None:
+            key = bytearray(self.wrapper.decrypt_bytes(wrapped))
+        return self._remember(username, key)
+
+    @contextmanager
+    def _key_for(self, username, create):
+        """Pin the user's DEK for the duration of one operation"""
+        entry = self._load(username, create)
+        if entry is None:
+            raise ValueError(f"No data key for {username}")
+        try:
+            yield entry
+        finally:
+            self._unpin(entry)
+
+    def warm(self, username, create=False):
+        """Load the user's DEK into the cache; failures surface on first use instead"""
+        try:
+            with self._key_for(username, create):
+                pass
+        except Exception:
+            pass
+
+    def _suite(self, entry, suite_id):
+        suite = entry.suites.get(suite_id)
+        if suite is None:
+            if suite_id not in CIPHER_SUITES_BY_ID:
+                raise ValueError(f"Unknown cipher suite id {suite_id}")
+            suite = CIPHER_SUITES_BY_ID[suite_id](entry.key, derive=False, format_tag=FORMAT_USER_KEY)
+            entry.suites[suite_id] = suite
+        return suite
+
+    def seal(self, username, plaintext, suite_id):
+        """Encrypt bytes with the user's DEK, creating the DEK on first use"""
+        with self._key_for(username, create=True) as entry:
+            return self._suite(entry, suite_id).seal(plaintext)
+
+    def open(self, username, envelope):
+        """Decrypt a FORMAT_USER_KEY envelope with the user's DEK"""
+        with self._key_for(username, create=False) as entry:
+            return self._suite(entry, envelope[1]).open(envelope)
+
+    def rewrap_all(self, backend=None, batch_size=500):
+        """
+        Re-encrypt every wrapped DEK under the current master key (after a
+        master key rotation). Returns the number of keys rewrapped. The DEKs
+        themselves do not change, so cached keys stay valid.
+        """
+        backend = backend or self._backend()
+        rewrapped = 0
+        after = None
+        while True:
+            batch = backend.get_user_data_keys_batch(batch_size, after=after)
+            if not batch:
+                break
+            after = batch[-1]["username"]
+            for record in batch:
+                new_wrapped = self.wrapper.rotate_ciphertext(record["data_key"])
+                if new_wrapped is not None and backend.set_user_data_key(
+                        record["username"], new_wrapped, expected=record["data_key"]):
+                    rewrapped += 1
+            if len(batch) < batch_size:
+                break
+        return rewrapped
+
+    def status(self):
+        """Cache snapshot for diagnostics pages"""
+        with self._lock:
+            size = len(self._cache)
+        return {"cached_keys": size, "max_size": self.max_size, "ttl_seconds": self.ttl,
+                "hits": self.hits, "misses": self.misses}
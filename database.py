@@ -1,43 +1,146 @@
 # database.py
+import os
+import threading
 import pymongo
 from pymongo import MongoClient
-from datetime import datetime
+from pymongo.write_concern import WriteConcern
+from datetime import datetime, timedelta, timezone
 import streamlit as st
-import bcrypt
+from password_hashing import password_hasher, HashingOverloaded
 from encryption import encryption_manager
+from db_instrumentation import command_metrics
+from db_indexes import reconcile_indexes
+from circuit_breaker import CircuitBreaker, BreakerListener
+from ciphertext_converter import ciphertext_converter
+from storage_backend import StorageBackend, PROFILE_FIELDS, _env_int, _env_bool, _chunks, _bulk_results
+
+# Fields returned for listings; never includes the ciphertext
+METADATA_PROJECTION = {"_id": 0, "service": 1, "service_username": 1, "created_at": 1, "updated_at": 1}
+
+class MongoDBManager(StorageBackend):
+    """MongoDB storage backend"""
+    name = "mongodb"
 
-class MongoDBManager:
     def __init__(self):
+        super().__init__()
         # MongoDB connection details
-        self.connection_string = "mongodb://localhost:27017/"
-        self.database_name = "password_manager"
+        self.connection_string = os.environ.get('PASSWORD_MANAGER_MONGO_URI', "mongodb://localhost:27017/")
+        self.database_name = os.environ.get('PASSWORD_MANAGER_MONGO_DB', "password_manager")
+        # Connection pool settings, shared by every Streamlit session in this process
+        self.pool_options = {
+            "maxPoolSize": _env_int('PASSWORD_MANAGER_MONGO_MAX_POOL_SIZE', 50),
+            "minPoolSize": _env_int('PASSWORD_MANAGER_MONGO_MIN_POOL_SIZE', 5),
+            "maxIdleTimeMS": _env_int('PASSWORD_MANAGER_MONGO_MAX_IDLE_MS', 60000),
+            "waitQueueTimeoutMS": _env_int('PASSWORD_MANAGER_MONGO_WAIT_QUEUE_TIMEOUT_MS', 5000),
+            "serverSelectionTimeoutMS": _env_int('PASSWORD_MANAGER_MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000),
+            "connectTimeoutMS": _env_int('PASSWORD_MANAGER_MONGO_CONNECT_TIMEOUT_MS', 5000),
+            "socketTimeoutMS": _env_int('PASSWORD_MANAGER_MONGO_SOCKET_TIMEOUT_MS', 10000),
+        }
+        # Per-operation deadline (ms). The driver turns it into maxTimeMS plus
+        # matching socket/server-selection timeouts; 0 disables it
+        self.operation_timeout_ms = _env_int('PASSWORD_MANAGER_MONGO_OPERATION_TIMEOUT_MS', 3000)
+        # After repeated failures the breaker opens: calls fail immediately and
+        # a background thread reconnects with exponential backoff
+        self.breaker = CircuitBreaker(
+            "mongodb",
+            probe=self._probe,
+            failure_threshold=_env_int('PASSWORD_MANAGER_MONGO_BREAKER_THRESHOLD', 3),
+            base_delay=_env_int('PASSWORD_MANAGER_MONGO_RECONNECT_BASE_MS', 500) / 1000,
+            max_delay=_env_int('PASSWORD_MANAGER_MONGO_RECONNECT_MAX_MS', 30000) / 1000
+        )
+        self._breaker_listener = BreakerListener(self.breaker)
+        # Buffered last_login flushes only need the primary's acknowledgement (0 = fire-and-forget)
+        self.last_login_write_concern = WriteConcern(w=_env_int('PASSWORD_MANAGER_LAST_LOGIN_W', 1))
+        # Ping once on connect so the pool is warm before the first page render
+        self.warm_up = _env_bool('PASSWORD_MANAGER_MONGO_WARM_UP', True)
         self.client = None
         self.db = None
-        self.connected = False  # Track connection status
+        self._pid = None  # Process that owns self.client
+        self._lock = threading.Lock()
         
-    def connect(self):
-        """Establish connection to MongoDB"""
+    def client_options(self):
+        """Keyword arguments for MongoClient: pool settings plus the operation deadline"""
+        options = dict(self.pool_options)
+        if self.operation_timeout_ms > 0:
+            # timeoutMS supersedes the per-socket and wait-queue timeouts
+            options.pop("socketTimeoutMS", None)
+            options.pop("waitQueueTimeoutMS", None)
+            options["timeoutMS"] = self.operation_timeout_ms
+        return options
+
+    def _open_client(self, ping):
+        """Create this process's client; caller holds self._lock"""
+        client = MongoClient(
+            self.connection_string,
+            event_listeners=[command_metrics, self._breaker_listener],
+            **self.client_options()
+        )
         try:
-            self.client = MongoClient(self.connection_string)
-            self.db = self.client[self.database_name]
-            # Test the connection
-            self.client.admin.command('ping')
-            self.connected = True
-            return True
-        except Exception as e:
-            st.error(f"Failed to connect to MongoDB: {str(e)}")
-            self.connected = False
+            if ping:
+                # Test the connection
+                client.admin.command('ping')
+        except Exception:
+            client.close()
+            raise
+        self.client = client
+        self.db = client[self.database_name]
+        self._pid = os.getpid()
+        self.connected = True
+
+    def connect(self):
+        """Establish connection to MongoDB, reusing this process's pooled client"""
+        if not self.breaker.allow():
+            # Circuit open: fail fast while the background thread reconnects
             return False
+        with self._lock:
+            if self.is_connected():
+                return True
+            if self.client is not None and self._pid != os.getpid():
+                # Client was inherited across fork(); its sockets belong to the parent
+                self._reset_after_fork()
+            try:
+                self._open_client(ping=self.warm_up)
+                return True
+            except Exception as e:
+                self.breaker.trip(e)
+                st.error(f"Failed to connect to MongoDB: {str(e)}")
+                self.connected = False
+                return False
+
+    def _probe(self):
+        """Reconnect attempt run by the circuit breaker's background thread"""
+        with self._lock:
+            if self.client is not None and self._pid == os.getpid():
+                self.client.admin.command('ping')
+                self.connected = True
+            else:
+                self._open_client(ping=True)
+        return True
             
     def disconnect(self):
         """Close MongoDB connection"""
-        if self.client:
-            self.client.close()
+        with self._lock:
+            if self.client and self._pid == os.getpid():
+                self.client.close()
+            self.client = None
+            self.db = None
             self.connected = False
+            self.initialized = False
+            self._pid = None
+
+    def _reset_after_fork(self):
+        """Drop a client inherited from the parent process without closing it"""
+        self.client = None
+        self.db = None
+        self.connected = False
+        self.initialized = False
+        self._pid = None
+        self._lock = threading.Lock()
+        self.breaker.reset_after_fork()
             
     def is_connected(self):
-        """Check if database is connected"""
-        return self.connected
+        """Check if database is connected from the current process and reachable"""
+        return self.connected and self._pid == os.getpid() and self.breaker.allow()
             
     def init_database(self):
         """
@@ -46,36 +149,248 @@ class MongoDBManager:
         if not self.is_connected():
             if not self.connect():
                 return False
+
+        if self.initialized:
+            return True
         
-        # Create users collection if it doesn't exist
-        if "users" not in self.db.list_collection_names():
-            self.db.create_collection("users")
-            # Create unique index on username
-            self.db.users.create_index([("username", pymongo.ASCENDING)], unique=True)
-            
-        # Create passwords collection if it doesn't exist
-        if "passwords" not in self.db.list_collection_names():
-            self.db.create_collection("passwords")
-            # Create compound index on username and service
-            self.db.passwords.create_index(
-                [("username", pymongo.ASCENDING), ("service", pymongo.ASCENDING)], 
-                unique=True
-            )
+        # Create any index from the registry that is missing (collections are created implicitly)
+        try:
+            reconcile_indexes(self.db)
+        except Exception as e:
+            st.error(f"Failed to reconcile indexes: {str(e)}")
+            return False
             
+        self.initialized = True
         return True
 
+    def get_user(self, username):
+        """Get a full user record, or None"""
+        if not self.is_connected():
+            if not self.connect():
+                return None
+        try:
+            return self.db.users.find_one({"username": username})
+        except Exception as e:
+            st.error(f"Error retrieving user: {str(e)}")
+            return None
+
+    def get_user_profile(self, username):
+        """Get the user's profile (projected: no hash, no data key), or None"""
+        if not self.is_connected():
+            if not self.connect():
+                return None
+        try:
+            return self.db.users.find_one({"username": username}, {"_id": 0, **{field: 1 for field in PROFILE_FIELDS}})
+        except Exception as e:
+            st.error(f"Error retrieving user: {str(e)}")
+            return None
+
+    def update_user_password(self, username, password):
+        """Replace a user's password hash"""
+        if not self.is_connected():
+            if not self.connect():
+                return False
+        try:
+            hashed_password = password_hasher.hash(password)
+            result = self.db.users.update_one(
+                {"username": username},
+                {"$set": {"password": hashed_password}}
+            )
+            return result.modified_count > 0
+        except Exception as e:
+            st.error(f"Error updating password: {str(e)}")
+            return False
+
+    def replace_password_hash(self, username, old_hash, new_hash):
+        """Compare-and-set a user's password hash"""
+        if not self.is_connected():
+            if not self.connect():
+                raise RuntimeError("MongoDB unavailable")
+        result = self.db.users.update_one(
+            {"username": username, "password": old_hash},
+            {"$set": {"password": new_hash}}
+        )
+        return result.modified_count > 0
+
+    def update_last_login(self, username):
+        """Record a successful login"""
+        if not self.is_connected():
+            if not self.connect():
+                return False
+        try:
+            result = self.db.users.update_one(
+                {"username": username},
+                {"$set": {"last_login": datetime.now()}}
+            )
+            return result.matched_count > 0
+        except Exception as e:
+            st.error(f"Error updating login time: {str(e)}")
+            return False
+
+    def update_last_logins(self, timestamps):
+        """
+        Apply buffered login times in one unordered bulk write at low write
+        concern. $max keeps the newest value when flushes interleave.
+        """
+        if not self.is_connected():
+            if not self.connect():
+                raise RuntimeError("MongoDB unavailable")
+        users = self.db.users.with_options(write_concern=self.last_login_write_concern)
+        users.bulk_write(
+            [pymongo.UpdateOne({"username": username}, {"$max": {"last_login": when}})
+             for username, when in timestamps.items()],
+            ordered=False
+        )
+
+    def list_users(self):
+        """List users (without secrets), newest first"""
+        if not self.is_connected():
+            if not self.connect():
+                return []
+        try:
+            return list(self.db.users.find({}, {
+                "username": 1, 
+                "created_at": 1, 
+                "last_login": 1, 
+                "is_admin": 1,
+                "two_factor_enabled": 1
+            }).sort("created_at", -1))
+        except Exception as e:
+            st.error(f"Error listing users: {str(e)}")
+            return []
+
+    def count_users(self, admin_only=False, logged_in_since=None, logged_in_before=None):
+        """Count users, optionally filtered by admin flag or last login"""
+        if not self.is_connected():
+            if not self.connect():
+                return 0
+        query = {}
+        if admin_only:
+            query["is_admin"] = True
+        if logged_in_since is not None or logged_in_before is not None:
+            query["last_login"] = {}
+            if logged_in_since is not None:
+                query["last_login"]["$gte"] = logged_in_since
+            if logged_in_before is not None:
+                query["last_login"]["$lt"] = logged_in_before
+        try:
+            return self.db.users.count_documents(query)
+        except Exception as e:
+            st.error(f"Error counting users: {str(e)}")
+            return 0
+
     def get_user_2fa_secret(self, username):
         """Get user's 2FA secret"""
         if not self.is_connected():
             if not self.connect():
                 return None
         try:
-            user = self.db.users.find_one({"username": username})
+            user = self.db.users.find_one({"username": username}, {"_id": 0, "two_factor_secret": 1})
             return user.get('two_factor_secret') if user else None
         except Exception as e:
             st.error(f"Error retrieving 2FA secret: {str(e)}")
             return None
 
+    def get_user_data_key(self, username):
+        """Get the user's wrapped data key, or None"""
+        if not self.is_connected():
+            if not self.connect():
+                raise RuntimeError("MongoDB unavailable")
+        user = self.db.users.find_one({"username": username}, {"_id": 0, "data_key": 1})
+        return user.get("data_key") if user else None
+
+    def set_user_data_key(self, username, wrapped_key, expected=None):
+        """Compare-and-set the user's wrapped data key"""
+        if not self.is_connected():
+            if not self.connect():
+                raise RuntimeError("MongoDB unavailable")
+        # {"data_key": None} also matches users without the field
+        result = self.db.users.update_one(
+            {"username": username, "data_key": expected},
+            {"$set": {"data_key": wrapped_key}}
+        )
+        return result.modified_count > 0
+
+    def get_user_data_keys_batch(self, limit, after=None):
+        """Stream wrapped data keys in username order (for master key rotation)"""
+        if not self.is_connected():
+            if not self.connect():
+                raise RuntimeError("MongoDB unavailable")
+        query = {"data_key": {"$exists": True}}
+        if after is not None:
+            query["username"] = {"$gt": after}
+        return list(
+            self.db.users.find(query, {"_id": 0, "username": 1, "data_key": 1})
+            .sort("username", pymongo.ASCENDING)
+            .limit(limit)
+        )
+
+    @staticmethod
+    def _rate_limit_record(doc):
+        """rate_limits document -> record with epoch-second times (stored as UTC)"""
+        def epoch(value):
+            return value.replace(tzinfo=timezone.utc).timestamp() if value is not None else None
+        return {"failures": doc.get("failures", 0), "locked_until": epoch(doc.get("locked_until")),
+                "expires_at": epoch(doc.get("expires_at"))}
+
+    def get_rate_limit(self, key):
+        """Unexpired rate-limit record by _id (the TTL monitor only runs once a minute)"""
+        if not self.is_connected():
+            if not self.connect():
+                raise RuntimeError("MongoDB unavailable")
+        doc = self.db.rate_limits.find_one({"_id": key, "expires_at": {"$gt": datetime.now(timezone.utc)}})
+        return self._rate_limit_record(doc) if doc else None
+
+    def hit_rate_limit(self, key, max_failures, window_seconds, lock_seconds):
+        """Count a failure with one atomic pipeline upsert (same rules as rate_limiter.apply_failure)"""
+        if not self.is_connected():
+            if not self.connect():
+                raise RuntimeError("MongoDB unavailable")
+        now = datetime.now(timezone.utc)
+        lock_end = now + timedelta(seconds=lock_seconds)
+        live = {"$gt": ["$expires_at", now]}  # False for a new or expired-but-not-yet-deleted doc
+        locking = {"$gte": ["$failures", max_failures]}
+        doc = self.db.rate_limits.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {
+                    "failures": {"$cond": [live, {"$add": ["$failures", 1]}, 1]},
+                    "locked_until": {"$cond": [live, "$locked_until", None]},
+                    "expires_at": {"$cond": [live, "$expires_at", now + timedelta(seconds=window_seconds)]},
+                }},
+                {"$set": {
+                    "locked_until": {"$cond": [locking, lock_end, "$locked_until"]},
+                    "expires_at": {"$cond": [locking, lock_end, "$expires_at"]},
+                }},
+            ],
+            upsert=True,
+            return_document=pymongo.ReturnDocument.AFTER
+        )
+        return self._rate_limit_record(doc)
+
+    def clear_rate_limit(self, key):
+        """Delete a rate-limit record"""
+        if not self.is_connected():
+            if not self.connect():
+                raise RuntimeError("MongoDB unavailable")
+        self.db.rate_limits.delete_one({"_id": key})
+
+    def claim_used_code(self, key, ttl_seconds):
+        """Insert-if-absent on _id; an expired leftover (TTL monitor lag) is taken over"""
+        if not self.is_connected():
+            if not self.connect():
+                raise RuntimeError("MongoDB unavailable")
+        now = datetime.now(timezone.utc)
+        try:
+            self.db.used_codes.update_one(
+                {"_id": key, "expires_at": {"$lte": now}},
+                {"$set": {"expires_at": now + timedelta(seconds=ttl_seconds)}},
+                upsert=True
+            )
+            return True
+        except pymongo.errors.DuplicateKeyError:
+            return False  # Live claim exists, so the upsert collided on _id
+
     def update_user_2fa_secret(self, username, secret):
         """Update user's 2FA secret"""
         if not self.is_connected():
@@ -112,13 +427,13 @@ class MongoDBManager:
             if not self.connect():
                 return False
         try:
-            user = self.db.users.find_one({"username": username})
+            user = self.db.users.find_one({"username": username}, {"_id": 0, "two_factor_enabled": 1})
             return user.get('two_factor_enabled', False) if user else False
         except Exception as e:
             st.error(f"Error checking 2FA status: {str(e)}")
             return False
 
-    def create_user(self, username, password):
+    def create_user(self, username, password, is_admin=False):
         """
         Create a new user with hashed password
         """
@@ -128,7 +443,7 @@ class MongoDBManager:
                 
         try:
             # Hash the password
-            hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+            hashed_password = password_hasher.hash(password)
             
             # Insert user into users collection
             result = self.db.users.insert_one({
@@ -138,7 +453,7 @@ class MongoDBManager:
                 "last_login": None,
                 "two_factor_secret": None, 
                 "two_factor_enabled": False,
-                "is_admin": False # Default to non-admin
+                "is_admin": is_admin # Default to non-admin
             })
             
             return result.inserted_id is not None
@@ -149,29 +464,111 @@ class MongoDBManager:
             st.error(f"Failed to create user: {str(e)}")
             return False
             
-    def verify_user(self, username, password):
+    def authenticate(self, username, password):
         """
-        Verify user credentials
+        Verify user credentials; returns the user's profile or None
         """
         if not self.is_connected():
             if not self.connect():
-                return False
+                return None
                 
         try:
-            # Find user by username
-            user = self.db.users.find_one({"username": username})
+            # One read: the profile plus the hash to check
+            user = self.db.users.find_one(
+                {"username": username},
+                {"_id": 0, "password": 1, **{field: 1 for field in PROFILE_FIELDS}}
+            )
             
-            if user and bcrypt.checkpw(password.encode('utf-8'), user['password']):
-                # Update last login time
-                self.db.users.update_one(
-                    {"_id": user["_id"]},
-                    {"$set": {"last_login": datetime.now()}}
-                )
-                return True
-            return False
+            # last_login is recorded by crud_operations.complete_login (write-behind)
+            if not (user and password_hasher.check(password, user['password'])):
+                return None
+            hashed = user.pop('password')
+            if password_hasher.needs_rehash(hashed):
+                self._rehash_password(username, password, hashed)
+            return user
+        except HashingOverloaded:
+            raise  # Not a failed login; callers ask the user to retry
         except Exception as e:
             st.error(f"Error verifying user: {str(e)}")
-            return False
+            return None
+            
+    def get_user_password_metadata(self, username):
+        """
+        Get all entries for a user without their ciphertext, sorted by service
+        """
+        if not self.is_connected():
+            if not self.connect():
+                return []
+                
+        try:
+            entries = self.db.passwords.find(
+                {"username": username},
+                METADATA_PROJECTION
+            ).sort("service", pymongo.ASCENDING)
+            return list(entries)
+        except Exception as e:
+            st.error(f"Error retrieving services: {str(e)}")
+            return []
+
+    def get_password_page(self, username, limit, after=None, before=None, from_end=False):
+        """
+        Keyset-paginate a user's entries (metadata only) on the
+        (username, service) index. Pass the last service of the current
+        page as `after` for the next page, the first one as `before` for
+        the previous page, or from_end=True for the final page.
+        Entries are always returned in ascending service order.
+        """
+        if not self.is_connected():
+            if not self.connect():
+                return []
+                
+        query = {"username": username}
+        if after is not None:
+            query["service"] = {"$gt": after}
+        elif before is not None:
+            query["service"] = {"$lt": before}
+        descending = before is not None or (from_end and after is None)
+        
+        try:
+            entries = list(self.db.passwords.find(
+                query,
+                METADATA_PROJECTION
+            ).sort("service", pymongo.DESCENDING if descending else pymongo.ASCENDING).limit(limit))
+            if descending:
+                entries.reverse()
+            return entries
+        except Exception as e:
+            st.error(f"Error retrieving services: {str(e)}")
+            return []
+
+    def count_user_passwords(self, username):
+        """Count a user's entries (answered from the (username, service) index)"""
+        if not self.is_connected():
+            if not self.connect():
+                return 0
+                
+        try:
+            return self.db.passwords.count_documents({"username": username})
+        except Exception as e:
+            st.error(f"Error counting services: {str(e)}")
+            return 0
+
+    def get_password_entry(self, username, service):
+        """
+        Get a single stored entry (still encrypted) for a user and service
+        """
+        if not self.is_connected():
+            if not self.connect():
+                return None
+                
+        try:
+            return self.db.passwords.find_one({
+                "username": username,
+                "service": service
+            })
+        except Exception as e:
+            st.error(f"Error retrieving password: {str(e)}")
+            return None
             
     def get_user_passwords(self, username):
         """
@@ -188,67 +585,105 @@ class MongoDBManager:
             st.error(f"Error retrieving passwords: {str(e)}")
             return []
             
-    def save_password(self, username, service, service_username, password):
-        """Save or update a password for a user with encryption"""
+    def create_password(self, username, service, service_username, password):
+        """
+        Insert a new encrypted password entry in a single round trip.
+        Relies on the unique (username, service) index to reject duplicates.
+        Returns the stored document, or None on failure.
+        """
         if not self.is_connected():
             if not self.connect():
-                return False
+                return None
                 
         try:
             # Encrypt the password before storing
-            encrypted_password = encryption_manager.encrypt_password(password)
+            encrypted_password = encryption_manager.encrypt_password(password, username)
             if not encrypted_password:
                 st.error("Failed to encrypt password")
-                return False
+                return None
             
-            # Check if password already exists for this service
-            existing = self.db.passwords.find_one({
+            now = datetime.now()
+            document = {
                 "username": username,
-                "service": service
-            })
-            
-            if existing:
-                # Update existing password
-                result = self.db.passwords.update_one(
-                    {"_id": existing["_id"]},
-                    {
-                        "$set": {
-                            "service_username": service_username,
-                            "password": encrypted_password,  # Store encrypted
-                            "updated_at": datetime.now()
-                        }
-                    }
-                )
-                return result.modified_count > 0
-            else:
-                # Insert new password
-                result = self.db.passwords.insert_one({
-                    "username": username,
-                    "service": service,
-                    "service_username": service_username,
-                    "password": encrypted_password,  # Store encrypted
-                    "created_at": datetime.now(),
-                    "updated_at": datetime.now()
-                })
-                return result.inserted_id is not None
-                
+                "service": service,
+                "service_username": service_username,
+                "password": encrypted_password,  # Store encrypted
+                "created_at": now,
+                "updated_at": now
+            }
+            result = self.db.passwords.insert_one(document)
+            return document if result.inserted_id is not None else None
+        except pymongo.errors.DuplicateKeyError:
+            st.error(f"Error: Service '{service}' already exists. Use update instead.")
+            return None
         except Exception as e:
             st.error(f"Error saving password: {str(e)}")
-            return False
+            return None
 
-    def get_decrypted_password(self, username, service):
-        """Retrieve and decrypt a password"""
+    def update_password(self, username, service, password, service_username=None):
+        """
+        Re-encrypt and update an existing entry atomically.
+        service_username is left untouched unless given.
+        Returns the updated document, or None if the entry does not exist.
+        """
         if not self.is_connected():
             if not self.connect():
                 return None
-        entry = self.db.passwords.find_one({
-            "username": username,
-            "service": service
-        })
-        
-        if entry and 'password' in entry:
-            return encryption_manager.decrypt_password(entry['password'])
-        return None
+                
+        try:
+            encrypted_password = encryption_manager.encrypt_password(password, username)
+            if not encrypted_password:
+                st.error("Failed to encrypt password")
+                return None
+            
+            fields = {
+                "password": encrypted_password,  # Store encrypted
+                "updated_at": datetime.now()
+            }
+            if service_username is not None:
+                fields["service_username"] = service_username
+            
+            return self.db.passwords.find_one_and_update(
+                {"username": username, "service": service},
+                {"$set": fields},
+                return_document=pymongo.ReturnDocument.AFTER
+            )
+        except Exception as e:
+            st.error(f"Error updating password: {str(e)}")
+            return None
+
+    def upsert_password(self, username, service, service_username, password):
+        """
+        Create or update an encrypted entry in one atomic server call.
+        Returns the resulting document, or None on failure.
+        """
+        if not self.is_connected():
+            if not self.connect():
+                return None
+                
+        try:
+            encrypted_password = encryption_manager.encrypt_password(password, username)
+            if not encrypted_password:
+                st.error("Failed to encrypt password")
+                return None
+            
+            now = datetime.now()
+            return self.db.passwords.find_one_and_update(
+                {"username": username, "service": service},
+                {
+                    "$set": {
+                        "service_username": service_username,
+                        "password": encrypted_password,  # Store encrypted
+                        "updated_at": now
+                    },
+                    "$setOnInsert": {"created_at": now}
+                },
+                upsert=True,
+                return_document=pymongo.ReturnDocument.AFTER
+            )
+        except Exception as e:
+            st.error(f"Error saving password: {str(e)}")
+            return None
             
     def delete_password(self, username, service):
         """
@@ -268,5 +703,235 @@ class MongoDBManager:
             st.error(f"Error deleting password: {str(e)}")
             return False
 
+    def save_passwords_bulk(self, username, entries):
+        """
+        Upsert many encrypted entries for one user using unordered
+        bulk_write chunks; one round trip per chunk.
+        """
+        results = _bulk_results([entry.get("service") for entry in entries])
+        if not self.is_connected():
+            if not self.connect():
+                for result in results:
+                    result["error"] = "Database unavailable"
+                return results
+                
+        now = datetime.now()
+        for chunk in _chunks(self._encrypt_bulk(username, entries, results), self.bulk_chunk_size):
+            operations = [
+                pymongo.UpdateOne(
+                    {"username": username, "service": entry["service"]},
+                    {
+                        "$set": {
+                            "service_username": entry.get("service_username"),
+                            "password": ciphertext,  # Store encrypted
+                            "updated_at": now
+                        },
+                        "$setOnInsert": {"created_at": now}
+                    },
+                    upsert=True
+                )
+                for _, entry, ciphertext in chunk
+            ]
+            try:
+                upserted = self.db.passwords.bulk_write(operations, ordered=False).upserted_ids
+                failed = {}
+            except pymongo.errors.BulkWriteError as e:
+                upserted = {item["index"]: item["_id"] for item in e.details.get("upserted", [])}
+                failed = {error["index"]: error.get("errmsg") for error in e.details.get("writeErrors", [])}
+            except Exception as e:
+                for index, _, _ in chunk:
+                    results[index]["error"] = str(e)
+                continue
+                
+            for op_index, (index, _, _) in enumerate(chunk):
+                if op_index in failed:
+                    results[index]["error"] = failed[op_index]
+                else:
+                    results[index]["status"] = "created" if op_index in upserted else "updated"
+        return results
+
+    def delete_passwords_bulk(self, username, services):
+        """
+        Delete many services for one user using unordered bulk_write chunks.
+        Each chunk first reads which services exist (index-only) so every
+        item gets an exact result.
+        """
+        results = _bulk_results(services)
+        if not self.is_connected():
+            if not self.connect():
+                for result in results:
+                    result["error"] = "Database unavailable"
+                return results
+                
+        for chunk in _chunks(list(enumerate(services)), self.bulk_chunk_size):
+            try:
+                existing = {
+                    doc["service"] for doc in self.db.passwords.find(
+                        {"username": username, "service": {"$in": [service for _, service in chunk]}},
+                        {"_id": 0, "service": 1}
+                    )
+                }
+                targets = [(index, service) for index, service in chunk if service in existing]
+                failed = {}
+                if targets:
+                    try:
+                        self.db.passwords.bulk_write(
+                            [pymongo.DeleteOne({"username": username, "service": service}) for _, service in targets],
+                            ordered=False
+                        )
+                    except pymongo.errors.BulkWriteError as e:
+                        failed = {error["index"]: error.get("errmsg") for error in e.details.get("writeErrors", [])}
+            except Exception as e:
+                for index, _ in chunk:
+                    results[index]["error"] = str(e)
+                continue
+                
+            for index, service in chunk:
+                if service not in existing:
+                    results[index]["status"] = "not_found"
+            for op_index, (index, _) in enumerate(targets):
+                if op_index in failed:
+                    results[index]["error"] = failed[op_index]
+                else:
+                    results[index]["status"] = "deleted"
+        return results
+
+    def get_all_password_entries(self):
+        """Get every stored entry across all users"""
+        if not self.is_connected():
+            if not self.connect():
+                return []
+        try:
+            return list(self.db.passwords.find({}))
+        except Exception as e:
+            st.error(f"Error retrieving passwords: {str(e)}")
+            return []
+
+    def set_encrypted_password(self, username, service, encrypted_password):
+        """Overwrite an entry's stored ciphertext as-is"""
+        if not self.is_connected():
+            if not self.connect():
+                return False
+        try:
+            result = self.db.passwords.update_one(
+                {"username": username, "service": service},
+                {"$set": {"password": encrypted_password}}
+            )
+            return result.modified_count > 0
+        except Exception as e:
+            st.error(f"Error updating password: {str(e)}")
+            return False
+
+    def has_encrypted_passwords(self):
+        """Check whether any entry already holds a Fernet token"""
+        if not self.is_connected():
+            if not self.connect():
+                return False
+        return self.db.passwords.find_one(
+            {"$or": [
+                {"password": {"$regex": r"^gAAAA[A-Za-z0-9+/]+={0,2}$"}},  # Fernet pattern
+                {"password": {"$type": "binData"}}  # Binary storage format
+            ]},
+            {"_id": 1}
+        ) is not None
+
+    def get_ciphertext_batch(self, limit, after=None, text_only=False):
+        """Stream ciphertexts in _id order for background converters"""
+        if not self.is_connected():
+            if not self.connect():
+                raise RuntimeError("MongoDB unavailable")
+        query = {}
+        if text_only:
+            query["password"] = {"$type": "string", "$regex": "^gAAAAA"}
+        if after is not None:
+            query["_id"] = {"$gt": after}
+        return list(
+            self.db.passwords.find(query, {"_id": 1, "username": 1, "password": 1})
+            .sort("_id", pymongo.ASCENDING)
+            .limit(limit)
+        )
+
+    def replace_ciphertexts(self, replacements):
+        """Compare-and-swap ciphertexts with one unordered bulk write"""
+        if not replacements:
+            return 0
+        if not self.is_connected():
+            if not self.connect():
+                raise RuntimeError("MongoDB unavailable")
+        result = self.db.passwords.bulk_write(
+            [pymongo.UpdateOne({"_id": _id, "password": old}, {"$set": {"password": new}})
+             for _id, old, new in replacements],
+            ordered=False
+        )
+        return result.modified_count
+
+    def count_all_passwords(self):
+        """Count entries across all users"""
+        if not self.is_connected():
+            if not self.connect():
+                return 0
+        try:
+            return self.db.passwords.count_documents({})
+        except Exception as e:
+            st.error(f"Error counting passwords: {str(e)}")
+            return 0
+
+    def storage_size_bytes(self):
+        """Approximate data size of users and passwords together"""
+        if not self.is_connected():
+            if not self.connect():
+                return 0
+        users_size = self.db.command("collstats", "users")['size']
+        passwords_size = self.db.command("collstats", "passwords")['size']
+        return users_size + passwords_size
+
+    def collection_counts(self):
+        """Document counts per collection (from collection metadata)"""
+        if not self.is_connected():
+            if not self.connect():
+                return {}
+        return {
+            "users": self.db.users.estimated_document_count(),
+            "passwords": self.db.passwords.estimated_document_count()
+        }
+
+    def health_check(self):
+        """Return {'users': bool, 'passwords': bool}, True when readable and non-empty"""
+        if not self.is_connected():
+            if not self.connect():
+                return {"users": False, "passwords": False}
+        return {
+            "users": self.db.users.find_one({}, {"_id": 1}) is not None,
+            "passwords": self.db.passwords.find_one({}, {"_id": 1}) is not None
+        }
+
 # Global MongoDB manager instance
-mongo_manager = MongoDBManager()
\ No newline at end of file
+mongo_manager = MongoDBManager()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=mongo_manager._reset_after_fork)
+
+# Storage backend selection: "mongodb" (default) or "sqlite"
+STORAGE_BACKEND = os.environ.get('PASSWORD_MANAGER_STORAGE_BACKEND', 'mongodb').strip().lower()
+
+# Rewrite legacy text ciphertexts into the binary format in the background
+AUTO_CONVERT_CIPHERTEXTS = _env_bool('PASSWORD_MANAGER_CIPHERTEXT_AUTO_CONVERT', True)
+
+def _get_backend():
+    """Return the configured process-wide storage backend instance"""
+    if STORAGE_BACKEND == "sqlite":
+        from sqlite_backend import sqlite_manager
+        return sqlite_manager
+    return mongo_manager
+
+def get_manager():
+    """
+    Return the process-wide storage backend with its connection ready.
+    Connection setup and index checks happen once per process; afterwards
+    this is a cheap flag check, so pages can call it on every rerun.
+    """
+    backend = _get_backend()
+    if not (backend.initialized and backend.is_connected()):
+        if backend.init_database() and AUTO_CONVERT_CIPHERTEXTS:
+            ciphertext_converter.start()
+    return backend
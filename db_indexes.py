@@ -0,0 +1,131 @@
+# db_indexes.py
+from datetime import datetime
+import pymongo
+from pymongo import IndexModel
+
+ASC = pymongo.ASCENDING
+DESC = pymongo.DESCENDING
+
+# Every index the app relies on. reconcile_indexes() creates missing ones;
+# existing identical indexes are left untouched, so it is safe on every start.
+INDEXES = {
+    "users": [
+        IndexModel([("username", ASC)], name="username_1", unique=True),
+        IndexModel([("last_login", DESC)], name="last_login_-1"),   # Admin activity counts
+        IndexModel([("created_at", DESC)], name="created_at_-1"),   # Admin user list sort
+        IndexModel([("is_admin", ASC)], name="is_admin_1"),         # Admin user count
+    ],
+    "passwords": [
+        IndexModel([("username", ASC), ("service", ASC)], name="username_1_service_1", unique=True),
+    ],
+    "rate_limits": [
+        # TTL: the server deletes counters once their window or lock has passed
+        IndexModel([("expires_at", ASC)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "used_codes": [
+        IndexModel([("expires_at", ASC)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+}
+
+_PROBE_USER = "__index_probe__"
+_PROBE_SERVICE = "__index_probe__"
+
+# Query shapes issued by crud_operations / the storage backend and the admin page.
+# allow_collscan marks deliberate whole-collection reads (totals, health check).
+QUERY_SHAPES = [
+    {"name": "user by username", "collection": "users",
+     "filter": {"username": _PROBE_USER}},
+    {"name": "entry by (username, service)", "collection": "passwords",
+     "filter": {"username": _PROBE_USER, "service": _PROBE_SERVICE}},
+    {"name": "vault listing", "collection": "passwords",
+     "filter": {"username": _PROBE_USER}, "sort": [("service", ASC)]},
+    {"name": "vault page (next)", "collection": "passwords",
+     "filter": {"username": _PROBE_USER, "service": {"$gt": _PROBE_SERVICE}},
+     "sort": [("service", ASC)], "limit": 5},
+    {"name": "vault page (previous/last)", "collection": "passwords",
+     "filter": {"username": _PROBE_USER, "service": {"$lt": _PROBE_SERVICE}},
+     "sort": [("service", DESC)], "limit": 5},
+    {"name": "bulk lookup by services", "collection": "passwords",
+     "filter": {"username": _PROBE_USER, "service": {"$in": [_PROBE_SERVICE]}}},
+    {"name": "rate limit by key", "collection": "rate_limits",
+     "filter": {"_id": _PROBE_USER, "expires_at": {"$gt": datetime(2000, 1, 1)}}},
+    {"name": "admin: admin user count", "collection": "users",
+     "filter": {"is_admin": True}},
+    {"name": "admin: recent logins", "collection": "users",
+     "filter": {"last_login": {"$gte": datetime(2000, 1, 1)}}},
+    {"name": "admin: inactive users", "collection": "users",
+     "filter": {"last_login": {"$lt": datetime(2000, 1, 1)}}},
+    {"name": "admin: user list", "collection": "users",
+     "filter": {}, "sort": [("created_at", DESC)]},
+    {"name": "admin: total users", "collection": "users",
+     "filter": {}, "allow_collscan": True},
+    {"name": "admin: total passwords", "collection": "passwords",
+     "filter": {}, "allow_collscan": True},
+]
+
+def reconcile_indexes(db):
+    """
+    Make sure every index in INDEXES exists (matched by key pattern, so
+    indexes created earlier under another name are reused).
+    Returns {collection: [names of indexes created now]}.
+    """
+    created = {}
+    collections = db.list_collection_names()
+    for collection, models in INDEXES.items():
+        existing = db[collection].index_information() if collection in collections else {}
+        existing_keys = {tuple(info["key"]) for info in existing.values()}
+        missing = [model for model in models if tuple(model.document["key"].items()) not in existing_keys]
+        created[collection] = db[collection].create_indexes(missing) if missing else []
+    return created
+
+def _plan_stages(plan):
+    """Flatten the stage names of an explain() plan tree"""
+    stages = []
+    pending = [plan]
+    while pending:
+        node = pending.pop()
+        if not isinstance(node, dict):
+            continue
+        if "stage" in node:
+            stages.append(node["stage"])
+        for key in ("inputStage", "queryPlan"):
+            if key in node:
+                pending.append(node[key])
+        pending.extend(node.get("inputStages", []))
+    return stages
+
+def verify_query_shapes(db):
+    """
+    Run explain() for every registered query shape.
+    Returns one result per shape with the winning plan's stages and
+    whether it falls back to a collection scan.
+    """
+    results = []
+    for shape in QUERY_SHAPES:
+        cursor = db[shape["collection"]].find(shape["filter"])
+        if shape.get("sort"):
+            cursor = cursor.sort(shape["sort"])
+        if shape.get("limit"):
+            cursor = cursor.limit(shape["limit"])
+        try:
+            explain = cursor.explain()
+            stages = _plan_stages(explain.get("queryPlanner", {}).get("winningPlan", {}))
+            collscan = "COLLSCAN" in stages
+            results.append({
+                "name": shape["name"],
+                "collection": shape["collection"],
+                "stages": " > ".join(reversed(stages)),
+                "collscan": collscan,
+                "ok": not collscan or shape.get("allow_collscan", False),
+                "error": None,
+            })
+        except Exception as e:
+            results.append({
+                "name": shape["name"],
+                "collection": shape["collection"],
+                "stages": "",
+                "collscan": False,
+                "ok": False,
+                "error": str(e),
+            })
+    return results
@@ -0,0 +1,223 @@
+# db_instrumentation.py
+import contextvars
+import json
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+import bson
+from pymongo import monitoring
+from storage_backend import _env_bool
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is open-ended
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+# Maximum DB commands expected for one render of each page/section.
+# A rerun that issues more is recorded as a budget violation (likely N+1).
+QUERY_BUDGETS = {
+    "Login": 3,
+    "2FA Verification": 3,
+    "Dashboard": 0,
+    "Generate Password": 0,
+    "Save Password": 1,
+    "Update Password": 1,
+    "Retrieve Password": 1,
+    "View Services": 2,
+    "Delete Password": 1,
+    "2FA Settings": 3,
+    "Admin": 12,
+}
+
+UNATTRIBUTED = "(unattributed)"
+
+# Page/section the current code path is running for, plus its per-run counter
+_current_section = contextvars.ContextVar("db_section", default=None)
+
+def _collection_of(command_name, command):
+    """Best-effort collection name for a command document"""
+    target = command.get(command_name)
+    return target if isinstance(target, str) else None
+
+def _bson_size(document):
+    try:
+        return len(bson.encode(document))
+    except Exception:
+        return 0
+
+class _Stats:
+    """Aggregated numbers for one (section, command, collection) key"""
+    __slots__ = ("count", "failures", "total_ms", "max_ms", "buckets", "bytes_sent", "bytes_received")
+
+    def __init__(self):
+        self.count = 0
+        self.failures = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def observe(self, duration_ms, sent, received, failed):
+        self.count += 1
+        self.failures += int(failed)
+        self.total_ms += duration_ms
+        self.max_ms = max(self.max_ms, duration_ms)
+        self.bytes_sent += sent
+        self.bytes_received += received
+        for position, bound in enumerate(LATENCY_BUCKETS_MS):
+            if duration_ms <= bound:
+                self.buckets[position] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+class CommandMetrics(monitoring.CommandListener):
+    """
+    pymongo command listener that records count, latency histogram and
+    bytes per (section, command name, collection). Sections are set with
+    the section() context manager around a page render.
+
+    Byte counts re-encode every command and reply (whole cursor batches
+    included) to BSON on the listener path, so they are opt-in
+    (count_bytes / PASSWORD_MANAGER_DB_METRICS_BYTES=1); otherwise they
+    stay 0.
+    """
+    def __init__(self, enabled=True, count_bytes=False):
+        self.enabled = enabled
+        self.count_bytes = count_bytes
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._stats = {}
+        self._runs = {}
+        self._violations = []
+        self.started_at = datetime.now()
+
+    # --- pymongo listener callbacks ---
+    def started(self, event):
+        if not self.enabled:
+            return
+        current = _current_section.get()
+        if current is not None:
+            current["commands"] += 1
+        with self._lock:
+            self._in_flight[(event.connection_id, event.request_id)] = (
+                current["name"] if current else UNATTRIBUTED,
+                _collection_of(event.command_name, event.command),
+                _bson_size(event.command) if self.count_bytes else 0
+            )
+
+    def succeeded(self, event):
+        received = _bson_size(event.reply) if self.enabled and self.count_bytes else 0
+        self._finish(event, received, failed=False)
+
+    def failed(self, event):
+        self._finish(event, 0, failed=True)
+
+    def _finish(self, event, received, failed):
+        if not self.enabled:
+            return
+        with self._lock:
+            section, collection, sent = self._in_flight.pop(
+                (event.connection_id, event.request_id), (UNATTRIBUTED, None, 0)
+            )
+            key = (section, event.command_name, collection or "-")
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = _Stats()
+            stats.observe(event.duration_micros / 1000, sent, received, failed)
+
+    # --- attribution ---
+    @contextmanager
+    def section(self, name):
+        """
+        Attribute DB commands issued inside the block to `name` and check
+        the count against QUERY_BUDGETS when the block ends.
+        """
+        current = {"name": name, "commands": 0}
+        token = _current_section.set(current)
+        try:
+            yield current
+        finally:
+            _current_section.reset(token)
+            if self.enabled:
+                self._end_run(name, current["commands"])
+
+    def _end_run(self, name, commands):
+        budget = QUERY_BUDGETS.get(name)
+        over_budget = budget is not None and commands > budget
+        if over_budget:
+            print(f"query budget exceeded: section '{name}' issued {commands} commands (budget {budget})")
+        with self._lock:
+            self._runs[name] = self._runs.get(name, 0) + 1
+            if over_budget:
+                self._violations.append({
+                    "section": name,
+                    "commands": commands,
+                    "budget": budget,
+                    "at": datetime.now().isoformat(timespec="seconds")
+                })
+                del self._violations[:-100]  # Keep the most recent ones
+
+    # --- reporting ---
+    def rows(self):
+        """One flat record per (section, command, collection), busiest first"""
+        with self._lock:
+            items = list(self._stats.items())
+            runs = dict(self._runs)
+        rows = []
+        for (section, command, collection), stats in items:
+            rows.append({
+                "section": section,
+                "command": command,
+                "collection": collection,
+                "count": stats.count,
+                "per_run": round(stats.count / runs[section], 2) if runs.get(section) else None,
+                "failures": stats.failures,
+                "avg_ms": round(stats.total_ms / stats.count, 2) if stats.count else 0.0,
+                "max_ms": round(stats.max_ms, 2),
+                "bytes_sent": stats.bytes_sent,
+                "bytes_received": stats.bytes_received,
+                "latency_buckets": dict(zip(
+                    [f"<={bound}ms" for bound in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}ms"],
+                    stats.buckets
+                )),
+            })
+        rows.sort(key=lambda row: row["count"], reverse=True)
+        return rows
+
+    def dump(self):
+        """Machine-readable snapshot of everything recorded so far"""
+        with self._lock:
+            runs = dict(self._runs)
+            violations = list(self._violations)
+        return {
+            "since": self.started_at.isoformat(timespec="seconds"),
+            "generated_at": datetime.now().isoformat(timespec="seconds"),
+            "budgets": dict(QUERY_BUDGETS),
+            "runs": runs,
+            "commands": self.rows(),
+            "budget_violations": violations,
+        }
+
+    def dump_json(self, path=None):
+        """Return the snapshot as JSON, also writing it to `path` if given"""
+        data = json.dumps(self.dump(), indent=2)
+        if path:
+            with open(path, "w") as handle:
+                handle.write(data)
+        return data
+
+    def reset(self):
+        """Forget all recorded numbers"""
+        with self._lock:
+            self._stats.clear()
+            self._runs.clear()
+            self._violations.clear()
+            self.started_at = datetime.now()
+
+# Global command metrics listener (passed to every MongoClient)
+command_metrics = CommandMetrics(enabled=_env_bool('PASSWORD_MANAGER_DB_METRICS', True),
+                                 count_bytes=_env_bool('PASSWORD_MANAGER_DB_METRICS_BYTES', False))
+
+def section(name):
+    """Shortcut for command_metrics.section(name)"""
+    return command_metrics.section(name)
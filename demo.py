@@ -3,26 +3,31 @@ import time
 import random
 import re
 import os
-import base64
+import functools
 import pyotp
-import qrcode
-import io
-from datetime import datetime, timedelta
-from pathlib import Path
+from datetime import datetime
 from streamlit_option_menu import option_menu  # pip install streamlit-option-menu
 from migrate_passwords import migrate_existing_passwords
 from clipboard_manager import clipboard_manager
+from db_instrumentation import section
+from two_factor_auth import verify_2fa_code
+from totp_service import totp_service
+from qr_provisioning import qr_images
+from static_assets import static_assets
 
 # Import MongoDB functionality
 from crud_operations import (
-    register_user, verify_user_credentials, save_password, 
-    get_password, get_all_passwords, update_password, delete_password,
+    register_user, verify_login, save_password, 
+    get_password, list_password_page, count_passwords, update_password, delete_password,
     is_valid_service_name, get_user_2fa_secret, update_user_2fa_secret,
-    set_user_2fa_enabled, is_2fa_enabled, complete_login  # Add complete_login here
+    set_user_2fa_enabled, is_2fa_enabled, complete_login,  # Add complete_login here
+    begin_2fa_login, redeem_2fa_ticket, clear_2fa_login,
+    login_lockout, record_login_failure, clear_login_failures,
+    otp_lockout, record_otp_failure, clear_otp_failures
 )
+from rate_limiter import LOGIN_POLICY, OTP_POLICY
 
 # Configuration
-MAX_ATTEMPTS = 2
 SESSION_TIMEOUT = 600  # 10 minutes in seconds
 ITEMS_PER_PAGE = 5  # Number of services to show per page
 
@@ -41,59 +46,68 @@ BACKGROUND_IMAGE_PATH = "assets/images/password.png"
 
 # Cache management functions
 def initialize_passwords():
-    """Initialize passwords in session state if not already present"""
+    """Initialize the services page cache in session state if not already present"""
     if 'passwords' not in st.session_state:
         st.session_state.passwords = []
     if 'passwords_loaded' not in st.session_state:
         st.session_state.passwords_loaded = False
+    if 'services_count' not in st.session_state:
+        st.session_state.services_count = None
+    if 'services_cursor' not in st.session_state:
+        st.session_state.services_cursor = {}
 
 def refresh_passwords():
-    """Force refresh passwords from database"""
+    """Force refresh the current page of services (metadata only) from database"""
     if st.session_state.authenticated and st.session_state.current_user:
-        st.session_state.passwords = get_all_passwords()
+        cursor = dict(st.session_state.services_cursor)
+        limit = cursor.pop('limit', ITEMS_PER_PAGE)
+        st.session_state.passwords = list_password_page(limit, **cursor)
         st.session_state.passwords_loaded = True
 
 def get_passwords_cached():
-    """Get passwords from cache or database if not loaded"""
+    """Get the current page of services from cache or database if not loaded"""
     initialize_passwords()
     
-    if not st.session_state.passwords_loaded or not st.session_state.passwords:
+    if not st.session_state.passwords_loaded:
         refresh_passwords()
     
     return st.session_state.passwords
 
+def get_services_count_cached():
+    """Get the number of saved services from cache or database if not loaded"""
+    initialize_passwords()
+    
+    if st.session_state.services_count is None and st.session_state.current_user:
+        st.session_state.services_count = count_passwords()
+    
+    return st.session_state.services_count or 0
+
+def go_to_services_page(page_num, cursor):
+    """Point the services pager at another page; it is fetched on next access"""
+    initialize_passwords()
+    st.session_state.current_page_num = page_num
+    st.session_state.services_cursor = cursor
+    st.session_state.passwords_loaded = False
+
 def invalidate_passwords_cache():
     """Mark passwords cache as invalid (to be refreshed on next access)"""
+    initialize_passwords()
     st.session_state.passwords_loaded = False
+    st.session_state.services_count = None
 
-# Function to convert image to base64
-def img_to_base64(img_path):
-    if not Path(img_path).exists():
+# Browser URL for an image (served from static/, published once per process)
+def asset_url(img_path):
+    url = static_assets.url(img_path)
+    if url is None:
         st.error(f"Error: Image not found at {img_path}. Please check the path.")
-        return None
-    try:
-        img_bytes = Path(img_path).read_bytes()
-        encoded = base64.b64encode(img_bytes).decode()
-        return encoded
-    except Exception as e:
-        st.error(f"Error encoding image {img_path}: {e}")
-        return None
+    return url
 
-# Function to generate QR code
-def generate_qr_code(uri):
-    """Generate QR code from URI"""
-    img = qrcode.make(uri)
-    buf = io.BytesIO()
-    img.save(buf, format='PNG')
-    return base64.b64encode(buf.getvalue()).decode()
-
-# Custom CSS for styling
-def inject_custom_css():
-    # Load background image
-    bg_b64 = img_to_base64(BACKGROUND_IMAGE_PATH)
-    bg_image_style = f"url('data:image/jpeg;base64,{bg_b64}')" if bg_b64 else "linear-gradient(135deg, #1A1A2E 0%, #16213E 50%, #0F3460 100%)"
+# Custom CSS for styling, built once per background URL
+@functools.lru_cache(maxsize=4)
+def build_custom_css(bg_url):
+    bg_image_style = f"url('{bg_url}')" if bg_url else "linear-gradient(135deg, #1A1A2E 0%, #16213E 50%, #0F3460 100%)"
     
-    st.markdown(f"""
+    return f"""
     <style>
     @import url('https://fonts.googleapis.com/css2?family=Orbitron:wght@400;700&family=Montserrat:wght@400;600;700&display=swap');
 
@@ -530,7 +544,11 @@ def inject_custom_css():
         letter-spacing: 0.5rem;
     }}
     </style>
-    """, unsafe_allow_html=True)
+    """
+
+def inject_custom_css():
+    # Memoized CSS with a short image URL: the rerun payload no longer grows with the image
+    st.markdown(build_custom_css(asset_url(BACKGROUND_IMAGE_PATH)), unsafe_allow_html=True)
 
 def init_session_state():
     """Initializes necessary session state variables."""
@@ -556,8 +574,8 @@ def init_session_state():
         st.session_state.login_step = None
     if 'temp_username' not in st.session_state:
         st.session_state.temp_username = None
-    if 'temp_password' not in st.session_state:
-        st.session_state.temp_password = None
+    if 'preauth_ticket' not in st.session_state:
+        st.session_state.preauth_ticket = None
     if 'registered_users' not in st.session_state:
         st.session_state.registered_users = {"testuser": "testpass"}
     
@@ -568,10 +586,6 @@ def init_session_state():
         st.session_state.passwords_loaded = False
     if 'otp_attempts' not in st.session_state:
         st.session_state.otp_attempts = 0
-    if 'otp_locked' not in st.session_state:
-        st.session_state.otp_locked = False
-    if 'otp_lock_time' not in st.session_state:
-        st.session_state.otp_lock_time = None
 
 def check_session_timeout():
     if 'last_activity' in st.session_state and st.session_state.authenticated:
@@ -589,7 +603,7 @@ def check_session_timeout():
 
 def logout_user():
     # Clear all sensitive session data
-    sensitive_keys = ['temp_username', 'temp_password', 'passwords', 'generated_password']
+    sensitive_keys = ['temp_username', 'preauth_ticket', 'passwords', 'generated_password', 'user_profiles']
     for key in sensitive_keys:
         if key in st.session_state:
             del st.session_state[key]
@@ -637,9 +651,9 @@ def get_password_data(service):
 
 def list_services():
     try:
-        passwords = get_passwords_cached()  # Use cached passwords
+        total_services = get_services_count_cached()
         
-        if passwords:
+        if total_services:
             st.subheader("Your Saved Services")
             
             # Initialize pagination if not already set
@@ -647,31 +661,37 @@ def list_services():
                 st.session_state.current_page_num = 1
                 
             # Calculate total pages
-            total_pages = max(1, (len(passwords) + ITEMS_PER_PAGE - 1) // ITEMS_PER_PAGE)
+            total_pages = max(1, (total_services + ITEMS_PER_PAGE - 1) // ITEMS_PER_PAGE)
             
             # Ensure current page is within valid range
             if st.session_state.current_page_num > total_pages:
-                st.session_state.current_page_num = total_pages
-                
-            # Calculate start and end indices for current page
-            start_idx = (st.session_state.current_page_num - 1) * ITEMS_PER_PAGE
-            end_idx = min(start_idx + ITEMS_PER_PAGE, len(passwords))
+                last_page_size = total_services - (total_pages - 1) * ITEMS_PER_PAGE
+                go_to_services_page(total_pages, {'from_end': True, 'limit': last_page_size})
+            
+            # One bounded, index-backed query per page change
+            passwords = get_passwords_cached()
+            if not passwords and st.session_state.current_page_num != 1:
+                # Entries under the cursor were removed; restart from the first page
+                go_to_services_page(1, {})
+                passwords = get_passwords_cached()
             
             # Display services for current page
-            for i in range(start_idx, end_idx):
-                password_data = passwords[i]
+            for password_data in passwords:
+                last_updated = password_data['updated_at'].strftime("%Y-%m-%d %H:%M:%S") if password_data['updated_at'] else 'N/A'
                 st.markdown(f"""
                 <div class="service-card">
                     <h3>{password_data['service']}</h3>
                     <p><strong>Username:</strong> {password_data['username']}</p>
                     <p><strong>Password:</strong> ••••••••</p>
-                    <p class="timestamp"><strong>Last Updated:</strong> {password_data['timestamp']}</p>
+                    <p class="timestamp"><strong>Last Updated:</strong> {last_updated}</p>
                 </div>
                 """, unsafe_allow_html=True)
                 
-                # Add a reveal password button for each service
-                with st.expander("Show Password"):
-                    st.code(password_data['password'])
+                # Decrypt only the entry the user asks to see; nothing is cached
+                if st.button("👁️ Show Password", key=f"reveal_{password_data['service']}"):
+                    revealed = get_password(password_data['service'])
+                    if revealed:
+                        st.code(revealed['password'])
                     
             # Display pagination controls
             if total_pages > 1:
@@ -680,13 +700,14 @@ def list_services():
                 with col1:
                     if st.button("⏮️ First", disabled=st.session_state.current_page_num == 1, 
                                 use_container_width=True, key="first_page"):
-                        st.session_state.current_page_num = 1
+                        go_to_services_page(1, {})
                         st.rerun()
                 
                 with col2:
                     if st.button("◀️ Prev", disabled=st.session_state.current_page_num == 1, 
                                 use_container_width=True, key="prev_page"):
-                        st.session_state.current_page_num -= 1
+                        go_to_services_page(st.session_state.current_page_num - 1,
+                                            {'before': passwords[0]['service']})
                         st.rerun()
                 
                 with col3:
@@ -696,13 +717,16 @@ def list_services():
                 with col4:
                     if st.button("Next ▶️", disabled=st.session_state.current_page_num == total_pages, 
                                 use_container_width=True, key="next_page"):
-                        st.session_state.current_page_num += 1
+                        go_to_services_page(st.session_state.current_page_num + 1,
+                                            {'after': passwords[-1]['service']})
                         st.rerun()
                 
                 with col5:
                     if st.button("Last ⏭️", disabled=st.session_state.current_page_num == total_pages, 
                                 use_container_width=True, key="last_page"):
-                        st.session_state.current_page_num = total_pages
+                        # Size the last page so Prev from it stays on page boundaries
+                        last_page_size = total_services - (total_pages - 1) * ITEMS_PER_PAGE
+                        go_to_services_page(total_pages, {'from_end': True, 'limit': last_page_size})
                         st.rerun()
         else:
             st.info("You haven't saved any passwords yet.")
@@ -711,12 +735,12 @@ def list_services():
 
 def register_page():
     is_locked = st.session_state.get('account_locked', False)
-    logo_html = img_to_base64(LOGO_PATH1)
+    logo_url = asset_url(LOGO_PATH1)
     
     st.markdown('<div class="login-container">', unsafe_allow_html=True)
     st.markdown(f"""
         <div class="login-header">
-            {f"<img src='data:image/png;base64,{logo_html}' class='app-logo'>" if logo_html else "<h1 class='app-logo-fallback'>SentinelKey</h1>"}
+            {f"<img src='{logo_url}' class='app-logo'>" if logo_url else "<h1 class='app-logo-fallback'>SentinelKey</h1>"}
             <h1>Join SentinelKey</h1>
             <p>Secure your digital life. Start now!</p>
         </div>
@@ -748,23 +772,10 @@ def register_page():
 def show_2fa_verification():
     """Show 2FA verification page with rate limiting"""
     
-    # Check if OTP is rate limited
-    if check_otp_rate_limit():
-        remaining_time = int((st.session_state.otp_lock_time - datetime.now()).total_seconds())
-        st.error(f"Too many failed OTP attempts! Please try again in {remaining_time} seconds.")
-        
-        # Show countdown timer
-        countdown_placeholder = st.empty()
-        for i in range(remaining_time, 0, -1):
-            countdown_placeholder.info(f"⏳ Try again in {i} seconds...")
-            time.sleep(1)
-        countdown_placeholder.empty()
-        
-        # Reset after countdown
-        st.session_state.otp_locked = False
-        st.session_state.otp_attempts = 0
-        st.session_state.otp_lock_time = None
-        st.rerun()
+    # Check if OTP is rate limited (shared across tabs and processes)
+    if otp_lockout(st.session_state.temp_username):
+        # The lock page counts down in the browser instead of holding this script thread
+        st.switch_page("pages/Account_Locked.py")
         return
     
     st.markdown('<div class="login-container">', unsafe_allow_html=True)
@@ -776,8 +787,8 @@ def show_2fa_verification():
     """, unsafe_allow_html=True)
     
     # Show remaining attempts warning
-    remaining_attempts = 3 - st.session_state.otp_attempts
-    if remaining_attempts < 3:
+    remaining_attempts = OTP_POLICY.max_failures - st.session_state.otp_attempts
+    if remaining_attempts < OTP_POLICY.max_failures:
         st.warning(f"⚠️ {remaining_attempts} attempt(s) remaining before lockout")
     
     verification_code = st.text_input("6-digit verification code", placeholder="000000", key="2fa_code")
@@ -785,28 +796,23 @@ def show_2fa_verification():
     if st.button("Verify", use_container_width=True):
         if verification_code and len(verification_code) == 6:
             username = st.session_state.temp_username
-            password = st.session_state.temp_password
             secret = get_user_2fa_secret(username)
             
             if secret:
-                totp = pyotp.TOTP(secret)
-                if totp.verify(verification_code):
+                # Window-tolerant and single-use (a replayed code is rejected)
+                if verify_2fa_code(secret, verification_code):
                     # Reset OTP attempts on success
-                    st.session_state.otp_attempts = 0
+                    clear_otp_failures(username)
                     
-                    # Re-verify credentials before completing login
-                    if verify_user_credentials(username, password):
+                    # The pre-auth ticket stands in for a second password check
+                    if redeem_2fa_ticket(username):
                         complete_login(username)
                     else:
-                        st.error("Credentials verification failed during 2FA process.")
+                        clear_2fa_login()
+                        st.error("Your sign-in expired. Please log in again.")
                 else:
-                    # Increment failed attempt counter
-                    st.session_state.otp_attempts += 1
-                    
-                    if st.session_state.otp_attempts >= 3:
-                        # Lock OTP verification for 1 minute
-                        st.session_state.otp_locked = True
-                        st.session_state.otp_lock_time = datetime.now() + timedelta(minutes=1)
+                    # Increment the shared failed attempt counter
+                    if record_otp_failure(username).locked:
                         st.error("Too many failed OTP attempts! Account temporarily locked.")
                         time.sleep(1)
                         # Redirect to account locked page
@@ -819,52 +825,33 @@ def show_2fa_verification():
             st.error("Please enter a valid 6-digit code.")
     
     if st.button("Back to Login", use_container_width=True):
-        # Clear temporary credentials and reset OTP attempts
-        st.session_state.temp_username = None
-        st.session_state.temp_password = None
-        st.session_state.login_step = None
-        st.session_state.otp_attempts = 0
+        # Clear the pending login (failed codes stay counted server-side)
+        clear_2fa_login()
         st.rerun()
     
     st.markdown('</div>', unsafe_allow_html=True)
 
-def check_otp_rate_limit():
-    """
-    Check if OTP verification is rate limited
-    Returns True if limited, False otherwise
-    """
-    if st.session_state.get('otp_locked', False):
-        # Check if lock time has expired (1 minute lock)
-        if st.session_state.otp_lock_time and datetime.now() < st.session_state.otp_lock_time:
-            return True
-        else:
-            # Lock expired, reset
-            st.session_state.otp_locked = False
-            st.session_state.otp_attempts = 0
-            st.session_state.otp_lock_time = None
-            return False
-    return False
-
 def login_page():
-    is_locked = st.session_state.get('account_locked', False)
-    logo_html = img_to_base64(LOGO_PATH)
+    # A lock on this client holds across tabs and processes
+    is_locked = login_lockout() is not None
+    logo_url = asset_url(LOGO_PATH)
     
     # If account is locked, redirect to locked page
-    if is_locked and st.session_state.lock_time and st.session_state.lock_time > datetime.now():
-        st.switch_page("Account_Locked.py")
+    if is_locked:
+        st.switch_page("pages/Account_Locked.py")
         return
     
     st.markdown('<div class="login-container">', unsafe_allow_html=True)
     st.markdown(f"""
         <div class="login-header">
-            {f"<img src='data:image/png;base64,{logo_html}' class='app-logo'>" if logo_html else "<h1 class='app-logo-fallback'>SentinelKey</h1>"}
+            {f"<img src='{logo_url}' class='app-logo'>" if logo_url else "<h1 class='app-logo-fallback'>SentinelKey</h1>"}
             <h1>Welcome Back!</h1>
             <p style="color: green;">Access your secure password vault.</p>
         </div>
     """, unsafe_allow_html=True)
     
     if st.session_state.login_attempts > 0 and not is_locked:
-        remaining_attempts = MAX_ATTEMPTS - st.session_state.login_attempts
+        remaining_attempts = LOGIN_POLICY.max_failures - st.session_state.login_attempts
         st.warning(f"⚠️ Access denied. {remaining_attempts} Attempt(s) Remaining before account lock.")
     
     with st.form("login_form", clear_on_submit=False):
@@ -874,31 +861,34 @@ def login_page():
         if st.form_submit_button("Log In", use_container_width=True, disabled=is_locked):
             if not username or not password:
                 st.error("Please enter both username and password.")
-            elif verify_user_credentials(username, password):
-                # Check if 2FA is enabled for this user
-                if is_2fa_enabled(username):
-                    # Store credentials temporarily for 2FA verification
-                    st.session_state.temp_username = username
-                    st.session_state.temp_password = password
-                    st.session_state.login_step = '2fa_verification'
-                    # Redirect to 2FA verification page
-                    st.switch_page("pages/2fa_verification.py")
-                else:
-                    # Proceed with normal login
-                    complete_login(username)
+            elif login_lockout(username):
+                # Locked for this user from this client (e.g. in another tab)
+                st.switch_page("pages/Account_Locked.py")
             else:
-                # Failed login - increment attempt counter
-                st.session_state.login_attempts += 1
-                # Check if account should be locked
-                if st.session_state.login_attempts > MAX_ATTEMPTS:
-                    st.session_state.account_locked = True
-                    st.session_state.lock_time = datetime.now() + timedelta(minutes=1)
-                    st.error(f"Too many failed attempts! Account locked for 1 minute.")
-                    time.sleep(1)
-                    # Redirect to locked page
-                    st.switch_page("pages/Account_Locked.py")
-                else:
-                    st.error("Invalid username or password.")
+                # One authenticate() read returns the credential result and the 2FA state
+                verified, two_factor_enabled = verify_login(username, password)
+                if verified:
+                    clear_login_failures(username)
+                    # Check if 2FA is enabled for this user
+                    if two_factor_enabled:
+                        # Hold a signed pre-auth ticket (not the password) for 2FA verification
+                        begin_2fa_login(username)
+                        # Redirect to 2FA verification page
+                        st.switch_page("pages/2fa_verification.py")
+                    else:
+                        # Proceed with normal login
+                        complete_login(username)
+                elif verified is not None:  # None = shed under load, already reported
+                    # Failed login - increment the shared attempt counters
+                    status = record_login_failure(username)
+                    # Check if account should be locked
+                    if status.locked:
+                        st.error(f"Too many failed attempts! Account locked for {status.retry_after} seconds.")
+                        time.sleep(1)
+                        # Redirect to locked page
+                        st.switch_page("pages/Account_Locked.py")
+                    else:
+                        st.error("Invalid username or password.")
     st.markdown('</div>', unsafe_allow_html=True)
 
 def password_generator_section():
@@ -985,6 +975,7 @@ def update_password_section():
                 st.error("Please enter both the service name and the new password.")
             else:
                 if update_password(service, new_password):
+                    invalidate_passwords_cache()
                     st.success(f"Password for '{service}' updated successfully!")
                     st.rerun()
                 else:
@@ -1103,6 +1094,7 @@ def delete_password_section():
                 st.error("Please enter a service name.")
             else:
                 if delete_password(service):
+                    invalidate_passwords_cache()
                     st.success(f"Password for '{service}' deleted successfully!")
                     st.rerun()
                 else:
@@ -1137,18 +1129,14 @@ def show_2fa_management():
             update_user_2fa_secret(username, secret)
         
         # Generate provisioning URI
-        totp = pyotp.TOTP(secret)
-        provisioning_uri = totp.provisioning_uri(
-            name=username,
-            issuer_name="SentinelKey Password Manager"
-        )
+        provisioning_uri = totp_service.provisioning_uri(secret, username)
         
         # Display QR code
         st.subheader("Setup Instructions")
         st.write("1. Scan the QR code below with your authenticator app (Google Authenticator, Authy, etc.)")
         
-        qr_code_base64 = generate_qr_code(provisioning_uri)
-        st.image(f"data:image/png;base64,{qr_code_base64}", width=200)
+        # Rendered once per URI and cached (PNG bytes or SVG, no base64 round-trip)
+        st.image(qr_images.image(provisioning_uri), width=200)
         
         st.write("2. Or enter this secret key manually:")
         st.code(secret)
@@ -1159,7 +1147,7 @@ def show_2fa_management():
         
         if st.button("Verify and Enable 2FA"):
             if verification_code:
-                if totp.verify(verification_code):
+                if verify_2fa_code(secret, verification_code):
                     if set_user_2fa_enabled(username, True):
                         st.success("Two-factor authentication has been successfully enabled!")
                         st.rerun()
@@ -1205,12 +1193,19 @@ def main_app():
             st.session_state.authenticated = False
             st.session_state.current_user = None
             st.session_state.generated_password = ''
-            st.session_state.current_page_num = 1
+            go_to_services_page(1, {})
+            invalidate_passwords_cache()
             st.rerun()
     
     if not check_session_timeout():
         return
     
+    # Attribute DB commands issued while rendering this section
+    with section(selected):
+        render_section(selected)
+
+def render_section(selected):
+    """Render the main-menu section the user selected"""
     if selected == "Dashboard":
         st.markdown("""
         <div class="hero-text">
@@ -1412,9 +1407,7 @@ def main_app():
     if st.session_state.get('login_step') == '2fa_verification':
         # If user navigates away from 2FA page, clear temp credentials
         if not st.session_state.get('showing_2fa', False):
-            st.session_state.temp_username = None
-            st.session_state.temp_password = None
-            st.session_state.login_step = None
+            clear_2fa_login()
     
     # Check if account is locked and redirect to locked page
     if st.session_state.get('account_locked', False):
@@ -1470,11 +1463,13 @@ def main():
 
         # Check if we're in 2FA verification step
         if st.session_state.get('login_step') == '2fa_verification':
-            show_2fa_verification()
+            with section("2FA Verification"):
+                show_2fa_verification()
         else:
             # Show normal login/register page
             if st.session_state.current_page == "login":
-                login_page()
+                with section("Login"):
+                    login_page()
                 st.markdown('<div class="register-link">', unsafe_allow_html=True)
                 if st.button("Don't have an account? Register here", use_container_width=True, key="go_to_register"):
                     st.session_state.current_page = "register"
@@ -1,13 +1,65 @@
 # encryption.py
-from cryptography.fernet import Fernet
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet, MultiFernet, InvalidToken
 import os
 import streamlit as st
 import base64
+import hashlib
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from cipher_suites import CIPHER_SUITES, CIPHER_SUITES_BY_ID, FORMAT_AEAD, FORMAT_USER_KEY
+from data_keys import DataKeyManager, _env_int
+
+def _crypt_chunk(operation, chunk, manager=None):
+    """
+    Encrypt or decrypt one chunk of (index, value, owner) on a pool worker.
+    Returns (index, result, error) triples; errors are collected, never
+    rendered. Module level so process pools can pickle it (workers then use
+    their own encryption_manager, built from the same environment).
+    """
+    manager = manager or encryption_manager
+    function = manager._encrypt_value if operation == "encrypt" else manager._decrypt_value
+    results = []
+    for index, value, owner in chunk:
+        try:
+            results.append((index, function(value, owner), None))
+        except Exception as e:
+            results.append((index, None, str(e) or type(e).__name__))
+    return results
+
+# Ciphertext storage formats. Legacy rows hold the Fernet token as base64
+# text; binary rows hold a one-byte format tag followed by the raw
+# (base64-decoded) token, stored as BSON Binary / SQLite BLOB. AEAD
+# envelopes (tag FORMAT_AEAD) are described in cipher_suites.py.
+FORMAT_FERNET_RAW = 0x01
+FERNET_TOKEN_PREFIX = "gAAAAA"  # Base64 of the Fernet version byte 0x80
 
 class EncryptionManager:
     def __init__(self):
         self.key = self._get_encryption_key()
-        self.cipher_suite = Fernet(self.key)
+        # Retired keys stay usable for decryption until rotation has finished
+        self.old_keys = self._get_old_encryption_keys()
+        self.primary_suite = Fernet(self.key)
+        self.cipher_suite = MultiFernet([self.primary_suite] + [Fernet(key) for key in self.old_keys])
+        # "binary" (default) or "text" to keep writing legacy base64 tokens
+        self.storage_format = os.environ.get('PASSWORD_MANAGER_CIPHERTEXT_FORMAT', 'binary').strip().lower()
+        # Cipher for new ciphertexts: a suite from cipher_suites, or "fernet"
+        self.cipher_name = os.environ.get('PASSWORD_MANAGER_CIPHER_SUITE', 'aes-256-gcm').strip().lower()
+        if self.cipher_name != "fernet" and self.cipher_name not in CIPHER_SUITES:
+            st.error(f"Unknown cipher suite '{self.cipher_name}', using Fernet")
+            self.cipher_name = "fernet"
+        self._aead_suites = {}  # suite_id -> [suite per key, primary first]
+        # Per-user data keys wrapped by the master key (AEAD suites only)
+        self.use_data_keys = os.environ.get('PASSWORD_MANAGER_USER_DATA_KEYS', '1').strip().lower() in ("1", "true", "yes", "on")
+        self.data_keys = DataKeyManager(self)
+        # Worker pool for encrypt_many/decrypt_many: "thread" (default) or "process"
+        self.pool_kind = os.environ.get('PASSWORD_MANAGER_CRYPTO_POOL', 'thread').strip().lower()
+        self.pool_workers = max(1, _env_int('PASSWORD_MANAGER_CRYPTO_WORKERS', os.cpu_count() or 1))
+        self.chunk_size = max(1, _env_int('PASSWORD_MANAGER_CRYPTO_CHUNK_SIZE', 256))
+        self._executor = None
+        self._executor_pid = None
+        self._executor_lock = threading.Lock()
     
     def _get_encryption_key(self):
         """Get encryption key from environment variable with fallback"""
@@ -32,26 +84,216 @@ class EncryptionManager:
         st.warning("Using default encryption key for development. Not secure for production!")
         default_key = base64.urlsafe_b64decode("RFUyV2NHaV8yYnpGb2s3MFhwaGRzcXd5cjJfTUNJYlNqLU5mX1dmNVpzWT0=")
         return default_key
+
+    def _get_old_encryption_keys(self):
+        """Get retired keys (comma-separated, same encoding as the main key)"""
+        keys = []
+        for value in os.environ.get('PASSWORD_MANAGER_OLD_ENCRYPTION_KEYS', '').split(','):
+            if value.strip():
+                try:
+                    keys.append(base64.urlsafe_b64decode(value.strip()))
+                except:
+                    st.error("Invalid old encryption key in environment variable")
+        return keys
+
+    def key_fingerprint(self):
+        """Short, non-secret identifier of the current primary key"""
+        return hashlib.sha256(self.key).hexdigest()[:16] if self.key else None
     
-    def encrypt_password(self, password):
-        """Encrypt a password"""
+    def encrypt_password(self, password, username=None):
+        """Encrypt a password (with the owner's data key when username is given)"""
         if not password or self.key is None:
             return None
         try:
-            return self.cipher_suite.encrypt(password.encode()).decode()
+            return self._encrypt_value(password, username)
         except Exception as e:
             st.error(f"Encryption error: {str(e)}")
             return None
     
-    def decrypt_password(self, encrypted_password):
-        """Decrypt a password"""
+    def decrypt_password(self, encrypted_password, username=None):
+        """Decrypt a password (username is needed for data-key envelopes)"""
         if not encrypted_password or self.key is None:
             return None
         try:
-            return self.cipher_suite.decrypt(encrypted_password.encode()).decode()
+            return self._decrypt_value(encrypted_password, username)
         except Exception as e:
             st.error(f"Decryption error: {str(e)}")
             return None
 
+    def _encrypt_value(self, password, username=None):
+        """encrypt_password without UI reporting; raises on failure"""
+        if not password or self.key is None:
+            raise ValueError("Nothing to encrypt" if self.key is not None else "No encryption key")
+        if username and self._uses_data_keys():
+            return self.data_keys.seal(username, password.encode(), CIPHER_SUITES[self.cipher_name].suite_id)
+        return self.encrypt_bytes(password.encode())
+
+    def _decrypt_value(self, encrypted_password, username=None):
+        """decrypt_password without UI reporting; raises on failure"""
+        if not encrypted_password or self.key is None:
+            raise ValueError("Nothing to decrypt" if self.key is not None else "No encryption key")
+        if self._format_of(encrypted_password) == FORMAT_USER_KEY:
+            if not username:
+                raise ValueError("Owner is required to decrypt this entry")
+            return self.data_keys.open(username, bytes(encrypted_password)).decode()
+        return self.decrypt_bytes(encrypted_password).decode()
+
+    # --- batch operations ---
+    def encrypt_many(self, passwords, usernames=None):
+        """
+        Encrypt many passwords in chunks on the worker pool. `usernames` is
+        one owner for every item or a list aligned with `passwords`.
+        Returns (ciphertexts, errors): ciphertexts in input order, None where
+        errors[index] holds the message. Nothing is rendered to the UI.
+        """
+        return self._run_many("encrypt", passwords, usernames)
+
+    def decrypt_many(self, encrypted_passwords, usernames=None):
+        """
+        Decrypt many stored ciphertexts in chunks on the worker pool.
+        Same conventions as encrypt_many; plaintexts are str.
+        """
+        return self._run_many("decrypt", encrypted_passwords, usernames)
+
+    def _get_executor(self):
+        """Return this process's crypto pool, recreating it after a fork"""
+        with self._executor_lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                if self.pool_kind == "process":
+                    self._executor = ProcessPoolExecutor(max_workers=self.pool_workers)
+                else:
+                    self._executor = ThreadPoolExecutor(max_workers=self.pool_workers,
+                                                        thread_name_prefix="crypto")
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def _run_many(self, operation, values, usernames):
+        values = list(values)
+        owners = list(usernames) if isinstance(usernames, (list, tuple)) else [usernames] * len(values)
+        items = list(zip(range(len(values)), values, owners))
+        chunks = [items[start:start + self.chunk_size] for start in range(0, len(items), self.chunk_size)]
+        if len(chunks) <= 1 or self.pool_workers <= 1:
+            chunk_results = [_crypt_chunk(operation, chunk, self) for chunk in chunks]
+        elif self.pool_kind == "process":
+            chunk_results = self._get_executor().map(partial(_crypt_chunk, operation), chunks)
+        else:
+            if self._uses_data_keys():
+                # Unwrap each owner's key once up front instead of once per racing chunk
+                for owner in set(owners):
+                    if owner:
+                        self.data_keys.warm(owner, create=(operation == "encrypt"))
+            chunk_results = self._get_executor().map(partial(_crypt_chunk, operation, manager=self), chunks)
+        results = [None] * len(values)
+        errors = {}
+        for chunk_result in chunk_results:
+            for index, value, error in chunk_result:
+                if error is None:
+                    results[index] = value
+                else:
+                    errors[index] = error
+        return results, errors
+
+    def _writes_fernet(self):
+        return self.cipher_name == "fernet" or self.storage_format == "text"
+
+    def _uses_data_keys(self):
+        return self.use_data_keys and not self._writes_fernet()
+
+    @staticmethod
+    def _format_of(stored):
+        """Format tag of a binary ciphertext, or None for legacy text tokens"""
+        return None if isinstance(stored, str) else bytes(stored[:1])[0]
+
+    def _aead_suites_for(self, suite_id):
+        """Suite instances for every configured key (primary first), built once"""
+        suites = self._aead_suites.get(suite_id)
+        if suites is None:
+            if suite_id not in CIPHER_SUITES_BY_ID:
+                raise ValueError(f"Unknown cipher suite id {suite_id}")
+            suite_class = CIPHER_SUITES_BY_ID[suite_id]
+            suites = [suite_class(base64.urlsafe_b64decode(key)) for key in [self.key] + self.old_keys]
+            self._aead_suites[suite_id] = suites
+        return suites
+
+    def encrypt_bytes(self, plaintext):
+        """Stored ciphertext for plaintext bytes under the primary key"""
+        if self._writes_fernet():
+            return self._pack(self.cipher_suite.encrypt(plaintext))
+        return self._aead_suites_for(CIPHER_SUITES[self.cipher_name].suite_id)[0].seal(plaintext)
+
+    def decrypt_bytes(self, stored):
+        """Plaintext bytes of a stored ciphertext in any supported format"""
+        if not isinstance(stored, str) and bytes(stored[:1]) == bytes([FORMAT_AEAD]):
+            envelope = bytes(stored)
+            for suite in self._aead_suites_for(envelope[1]):
+                try:
+                    return suite.open(envelope)
+                except InvalidTag:
+                    continue
+            raise InvalidToken
+        return self.cipher_suite.decrypt(self._fernet_token(stored))
+
+    def _is_current(self, stored):
+        """True if stored is sealed by the configured cipher under the primary key"""
+        is_envelope = not isinstance(stored, str) and bytes(stored[:1]) == bytes([FORMAT_AEAD])
+        try:
+            if self._writes_fernet():
+                if is_envelope:
+                    return False
+                self.primary_suite.decrypt(self._fernet_token(stored))
+                return True
+            envelope = bytes(stored) if is_envelope else b""
+            if not is_envelope or envelope[1] != CIPHER_SUITES[self.cipher_name].suite_id:
+                return False
+            self._aead_suites_for(envelope[1])[0].open(envelope)
+            return True
+        except (InvalidToken, InvalidTag):
+            return False
+
+    def _fernet_token(self, stored):
+        """Fernet token bytes for a stored ciphertext in either format"""
+        if isinstance(stored, str):
+            return stored.encode()
+        stored = bytes(stored)  # bson.Binary / memoryview
+        if stored[:1] == bytes([FORMAT_FERNET_RAW]):
+            return base64.urlsafe_b64encode(stored[1:])
+        return stored  # Legacy token that was stored as bytes
+
+    def _pack(self, token):
+        """Storage representation of a Fernet token in the configured format"""
+        if self.storage_format == "text":
+            return token.decode()
+        return bytes([FORMAT_FERNET_RAW]) + base64.urlsafe_b64decode(token)
+
+    def rotate_ciphertext(self, stored, username=None):
+        """
+        Re-encrypt a stored ciphertext under the primary key and configured
+        cipher, or under the owner's data key when username is given and data
+        keys are enabled. Returns the new stored value, or None if it is
+        already current. Data-key envelopes are always current: master key
+        rotation only rewraps the data keys (DataKeyManager.rewrap_all).
+        Raises InvalidToken if no configured key can decrypt it.
+        """
+        if self._format_of(stored) == FORMAT_USER_KEY:
+            return None
+        if username and self._uses_data_keys():
+            return self.data_keys.seal(username, self.decrypt_bytes(stored), CIPHER_SUITES[self.cipher_name].suite_id)
+        if self._is_current(stored):
+            return None
+        return self.encrypt_bytes(self.decrypt_bytes(stored))
+
+    def to_binary_format(self, stored):
+        """
+        Repack a legacy text token into the binary format without
+        decrypting it. Returns None when `stored` is not a Fernet token.
+        """
+        if not isinstance(stored, str) or not stored.startswith(FERNET_TOKEN_PREFIX):
+            return None
+        try:
+            raw = base64.urlsafe_b64decode(stored.encode())
+        except Exception:
+            return None
+        return bytes([FORMAT_FERNET_RAW]) + raw
+
 # Global encryption manager instance
 encryption_manager = EncryptionManager()
\ No newline at end of file
@@ -0,0 +1,226 @@
+# key_rotation.py
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from encryption import encryption_manager
+from storage_backend import _env_int, _chunks
+
+class KeyRotationJob:
+    """
+    Re-encrypts every stored ciphertext under the current primary key and
+    cipher suite (which also migrates legacy Fernet rows).
+
+    Entries are streamed in primary-key (_id) order, re-encrypted in batches
+    on a worker pool and written back with one compare-and-swap bulk update
+    per batch, so concurrent edits are never overwritten. Progress is
+    checkpointed to a JSON file after every batch; a restarted job resumes
+    after the last written _id. Throughput is capped at max_ops_per_sec so
+    the job never starves live traffic.
+
+    Per-user data keys are rewrapped under the new master key first; rows
+    sealed with a data key are already current, so once every row has been
+    moved to data keys a master rotation writes only one key per user.
+
+    Old keys must stay in PASSWORD_MANAGER_OLD_ENCRYPTION_KEYS until the
+    job reports done. A pass that reaches the end with rows it could not
+    decrypt ends in state "done_with_failures", not done: those rows still
+    need an old key, and the next run rescans from the start to retry them.
+    """
+    MAX_FAILED_IDS = 100  # Reported in the checkpoint and status()
+
+    def __init__(self, batch_size=None, workers=None, max_ops_per_sec=None, checkpoint_path=None):
+        self.batch_size = batch_size or max(1, _env_int('PASSWORD_MANAGER_ROTATION_BATCH', 200))
+        self.workers = workers or max(1, _env_int('PASSWORD_MANAGER_ROTATION_WORKERS', 4))
+        self.max_ops_per_sec = (max_ops_per_sec if max_ops_per_sec is not None
+                                else _env_int('PASSWORD_MANAGER_ROTATION_MAX_OPS', 500))  # 0 = unthrottled
+        self.checkpoint_path = checkpoint_path or os.environ.get(
+            'PASSWORD_MANAGER_ROTATION_CHECKPOINT', "key_rotation_checkpoint.json"
+        )
+        self.rewrapped = 0
+        self.scanned = 0
+        self.rotated = 0
+        self.failed = 0
+        self.failed_ids = []
+        self.done = False
+        self.state = "idle"
+        self.last_error = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    # --- checkpoints ---
+    def load_checkpoint(self):
+        """Checkpoint for the current primary key, or None"""
+        try:
+            with open(self.checkpoint_path) as handle:
+                checkpoint = json.load(handle)
+        except (OSError, ValueError):
+            return None
+        if checkpoint.get("key_fingerprint") != encryption_manager.key_fingerprint():
+            return None  # Left over from a rotation to another key
+        return checkpoint
+
+    def _save_checkpoint(self, after, state="in_progress"):
+        checkpoint = {
+            "key_fingerprint": encryption_manager.key_fingerprint(),
+            "after": str(after) if after is not None else None,
+            "after_type": "objectid" if type(after).__name__ == "ObjectId" else "int",
+            "scanned": self.scanned,
+            "rotated": self.rotated,
+            "failed": self.failed,
+            "failed_ids": self.failed_ids,
+            "state": state,
+            "done": state == "done",
+            "updated_at": datetime.now().isoformat(timespec="seconds"),
+        }
+        temp_path = self.checkpoint_path + ".tmp"
+        with open(temp_path, "w") as handle:
+            json.dump(checkpoint, handle, indent=2)
+        os.replace(temp_path, self.checkpoint_path)  # Atomic, so a crash never leaves half a file
+
+    @staticmethod
+    def _restore_cursor(checkpoint):
+        after = checkpoint.get("after")
+        if after is None:
+            return None
+        if checkpoint.get("after_type") == "objectid":
+            from bson import ObjectId
+            return ObjectId(after)
+        return int(after)
+
+    # --- work ---
+    def _rotate_chunk(self, entries):
+        """Re-encrypt one slice of a batch; runs on a worker thread"""
+        replacements, failures = [], []
+        for entry in entries:
+            try:
+                rotated = encryption_manager.rotate_ciphertext(entry["password"], entry.get("username"))
+            except Exception:
+                failures.append(entry["_id"])
+                continue
+            if rotated is not None:
+                replacements.append((entry["_id"], entry["password"], rotated))
+        return replacements, failures
+
+    def run(self, manager=None, resume=True):
+        """Rotate every remaining entry; returns the number re-encrypted in this run"""
+        if manager is None:
+            # Imported lazily: database imports modules that import this one
+            from database import get_manager
+            manager = get_manager()
+        after = None
+        if resume:
+            checkpoint = self.load_checkpoint()
+            if checkpoint:
+                if checkpoint.get("done"):
+                    self.done = True
+                    self.state = "done"
+                    return 0
+                if checkpoint.get("state") != "done_with_failures":
+                    after = self._restore_cursor(checkpoint)
+                    self.scanned = checkpoint.get("scanned", 0)
+                    self.rotated = checkpoint.get("rotated", 0)
+                    self.failed = checkpoint.get("failed", 0)
+                    self.failed_ids = checkpoint.get("failed_ids", [])
+                # else: rescan from the start; current rows are skipped, failed ones retried
+        if after is None:
+            self.scanned = self.rotated = self.failed = 0
+            self.failed_ids = []
+        self.state = "in_progress"
+        self.rewrapped += encryption_manager.data_keys.rewrap_all(manager)
+        self._stop.clear()
+        rotated_now = 0
+        slice_size = max(1, -(-self.batch_size // self.workers))
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="key-rotation") as pool:
+            while not self._stop.is_set():
+                started = time.monotonic()
+                batch = manager.get_ciphertext_batch(self.batch_size, after=after)
+                if not batch:
+                    # Rows that no key could decrypt still need the old keys
+                    self.state = "done_with_failures" if self.failed else "done"
+                    self._save_checkpoint(after, self.state)
+                    self.done = self.state == "done"
+                    break
+                replacements = []
+                for chunk_replacements, failures in pool.map(self._rotate_chunk, _chunks(batch, slice_size)):
+                    replacements.extend(chunk_replacements)
+                    self.failed += len(failures)
+                    room = self.MAX_FAILED_IDS - len(self.failed_ids)
+                    self.failed_ids.extend(str(failed_id) for failed_id in failures[:max(0, room)])
+                changed = manager.replace_ciphertexts(replacements)
+                after = batch[-1]["_id"]
+                self.scanned += len(batch)
+                self.rotated += changed
+                rotated_now += changed
+                self._save_checkpoint(after)
+                if self.max_ops_per_sec > 0:
+                    # Spread the batch over at least len(batch) / max_ops seconds
+                    remaining = len(batch) / self.max_ops_per_sec - (time.monotonic() - started)
+                    if remaining > 0:
+                        self._stop.wait(remaining)
+        return rotated_now
+
+    def stop(self):
+        """Ask a running job to stop after the current batch"""
+        self._stop.set()
+
+    def start(self, resume=True):
+        """Run the job in a daemon thread; returns False if it is already running"""
+        with self._lock:
+            if self.is_running():
+                return False
+            self.done = False
+            self.state = "in_progress"
+            self.last_error = None
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, args=(resume,), name="key-rotation", daemon=True)
+            self._thread.start()
+            return True
+
+    def _run(self, resume):
+        try:
+            self.run(resume=resume)
+        except Exception as e:
+            # The checkpoint holds the last written batch; start() resumes from it
+            self.last_error = str(e)
+            print(f"key rotation failed: {e}")
+
+    def is_running(self):
+        return self._thread is not None and self._pid == os.getpid() and self._thread.is_alive()
+
+    def status(self):
+        """Progress snapshot for diagnostics pages"""
+        status = {
+            "key_fingerprint": encryption_manager.key_fingerprint(),
+            "old_keys": len(encryption_manager.old_keys),
+            "rewrapped_user_keys": self.rewrapped,
+            "scanned": self.scanned,
+            "rotated": self.rotated,
+            "failed": self.failed,
+            "failed_ids": self.failed_ids,
+            "state": self.state,
+            "done": self.done,
+            "running": self.is_running(),
+            "last_error": self.last_error,
+        }
+        if self.failed:
+            status["warning"] = (f"{self.failed} entries could not be decrypted with any configured key; "
+                                 "do not remove the old keys. Run the job again to retry them.")
+        return status
+
+    def _reset_after_fork(self):
+        """The rotation thread does not survive fork()"""
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+
+# Global key rotation job
+key_rotation_job = KeyRotationJob()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=key_rotation_job._reset_after_fork)
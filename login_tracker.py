@@ -0,0 +1,90 @@
+# login_tracker.py
+import atexit
+import os
+import threading
+from datetime import datetime
+from storage_backend import _env_int
+
+class LastLoginWriteBehind:
+    """
+    Write-behind buffer for users' last_login timestamps.
+    record() only updates an in-memory map; a daemon thread flushes the
+    latest timestamp per user as one batched write every few seconds and
+    once more at interpreter shutdown, so logins never wait on the database.
+    """
+    def __init__(self, flush_interval=None):
+        self.flush_interval = flush_interval or _env_int('PASSWORD_MANAGER_LAST_LOGIN_FLUSH_SECONDS', 5)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def record(self, username, when=None):
+        """Remember a successful login; returns immediately"""
+        when = when or datetime.now()
+        with self._lock:
+            previous = self._pending.get(username)
+            if previous is None or when > previous:
+                self._pending[username] = when
+        self._ensure_worker()
+
+    def pending_count(self):
+        """Number of users with an unflushed login"""
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self):
+        """Write all buffered timestamps now; returns how many were written"""
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return 0
+        try:
+            # Imported lazily: database imports modules that import this one
+            from database import get_manager
+            manager = get_manager()
+            if not manager.is_connected():
+                raise RuntimeError("database unavailable")
+            manager.update_last_logins(batch)
+            return len(batch)
+        except Exception as e:
+            # Put the batch back (keeping any newer logins) and retry next interval
+            with self._lock:
+                for username, when in batch.items():
+                    previous = self._pending.get(username)
+                    if previous is None or when > previous:
+                        self._pending[username] = when
+            print(f"last_login flush failed: {e}")
+            return 0
+
+    def _ensure_worker(self):
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="last-login-flusher", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def _reset_after_fork(self):
+        """The parent keeps (and flushes) its own buffer"""
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+
+# Global last-login write-behind buffer
+last_login_tracker = LastLoginWriteBehind()
+
+atexit.register(last_login_tracker.flush)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=last_login_tracker._reset_after_fork)
@@ -1,5 +1,5 @@
 # migrate_passwords.py
-from database import mongo_manager
+from database import get_manager
 from encryption import encryption_manager
 #from crud_operations import is_valid_service_name
 import streamlit as st
@@ -7,11 +7,7 @@ import streamlit as st
 def has_migration_been_run():
     """Check if migration has already been performed"""
     # Check if any passwords are already encrypted
-    collection = mongo_manager.db.passwords
-    encrypted_passwords = collection.count_documents({
-        "password": {"$regex": r"^gAAAA[A-Za-z0-9+/]+={0,2}$"}  # Fernet pattern
-    })
-    return encrypted_passwords > 0
+    return get_manager().has_encrypted_passwords()
 
 def migrate_existing_passwords():
     """Migrate existing plaintext passwords to encrypted format"""
@@ -21,31 +17,31 @@ def migrate_existing_passwords():
     
     try:
         # Get all password entries
-        passwords_collection = mongo_manager.db.passwords
-        all_entries = list(passwords_collection.find({}))
+        manager = get_manager()
+        all_entries = manager.get_all_password_entries()
         
         migrated_count = 0
         failed_count = 0
         
-        for entry in all_entries:
-            current_password = entry.get('password', '')
-            
-            # Skip if already encrypted or empty
-            if not current_password or len(current_password) > 100:
+        # Skip if already encrypted (binary format or Fernet token) or empty
+        pending = [
+            entry for entry in all_entries
+            if entry.get('password') and isinstance(entry['password'], str) and len(entry['password']) <= 100
+        ]
+        
+        # Encrypt all candidates in parallel chunks; failures are counted, not shown per entry
+        encrypted, errors = encryption_manager.encrypt_many(
+            [entry['password'] for entry in pending],
+            [entry['username'] for entry in pending]
+        )
+        failed_count += len(errors)
+        
+        for entry, encrypted_password in zip(pending, encrypted):
+            if encrypted_password is None:
                 continue
-                
-            # Encrypt the password
-            encrypted_password = encryption_manager.encrypt_password(current_password)
-            if encrypted_password:
-                # Update the document with encrypted password
-                result = passwords_collection.update_one(
-                    {"_id": entry["_id"]},
-                    {"$set": {"password": encrypted_password}}
-                )
-                if result.modified_count > 0:
-                    migrated_count += 1
-                else:
-                    failed_count += 1
+            # Update the entry with encrypted password
+            if manager.set_encrypted_password(entry['username'], entry['service'], encrypted_password):
+                migrated_count += 1
             else:
                 failed_count += 1
         
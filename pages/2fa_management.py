@@ -1,18 +1,14 @@
 import streamlit as st
 import pyotp
-import qrcode
-import io
-import base64
 from crud_operations import get_user_2fa_secret, update_user_2fa_secret, set_user_2fa_enabled, is_2fa_enabled
 from two_factor_auth import verify_2fa_code
+from totp_service import totp_service
+from qr_provisioning import qr_images
 
 def generate_qr_code(uri):
-    """Generate QR code from URI"""
+    """QR code image for a provisioning URI (cached per URI)"""
     try:
-        img = qrcode.make(uri)
-        buf = io.BytesIO()
-        img.save(buf, format='PNG')
-        return base64.b64encode(buf.getvalue()).decode()
+        return qr_images.image(uri)
     except Exception as e:
         st.error(f"Error generating QR code: {e}")
         return None
@@ -49,9 +45,8 @@ def show_2fa_management():
         
         # Validate secret format
         try:
-            # Test if secret is valid by creating a TOTP object
-            test_totp = pyotp.TOTP(secret)
-            test_totp.now()  # This will raise an exception if secret is invalid
+            # Test if secret is valid (raises for an invalid secret)
+            totp_service.now(secret)
         except Exception as e:
             st.error(f"Invalid 2FA secret format. Generating new one...")
             secret = pyotp.random_base32()
@@ -60,19 +55,15 @@ def show_2fa_management():
                 return
         
         # Generate provisioning URI
-        totp = pyotp.TOTP(secret)
-        provisioning_uri = totp.provisioning_uri(
-            name=username,
-            issuer_name="SentinelKey Password Manager"
-        )
+        provisioning_uri = totp_service.provisioning_uri(secret, username)
         
         # Display QR code
         st.subheader("Setup Instructions")
         st.write("1. Scan the QR code below with your authenticator app (Google Authenticator, Authy, etc.)")
         
-        qr_code_base64 = generate_qr_code(provisioning_uri)
-        if qr_code_base64:
-            st.image(f"data:image/png;base64,{qr_code_base64}", width=200)
+        qr_code_image = generate_qr_code(provisioning_uri)
+        if qr_code_image:
+            st.image(qr_code_image, width=200)
         else:
             st.error("Failed to generate QR code. Please use manual setup.")
         
@@ -93,7 +84,7 @@ def show_2fa_management():
             if st.button("Verify and Enable 2FA", type="primary"):
                 if verification_code and len(verification_code.strip()) == 6:
                     # Use the improved verification with time window
-                    if verify_2fa_code(secret, verification_code.strip(), window=1):
+                    if verify_2fa_code(secret, verification_code.strip()):
                         if set_user_2fa_enabled(username, True):
                             st.success("Two-factor authentication has been successfully enabled!")
                             st.rerun()
@@ -118,7 +109,7 @@ def show_2fa_management():
             st.write("**Debug Information:**")
             st.write(f"Username: {username}")
             st.write(f"Secret length: {len(secret)}")
-            st.write(f"Current TOTP: {totp.now()}")
+            st.write(f"Current TOTP: {totp_service.now(secret)}")
             st.write(f"2FA enabled in DB: {is_enabled}")
 
 # Run the 2FA management page
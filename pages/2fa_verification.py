@@ -1,9 +1,12 @@
 # pages/2fa_verification.py
 import streamlit as st
-import pyotp
 import time
-from datetime import datetime, timedelta
-from crud_operations import get_user_2fa_secret, verify_user_credentials, complete_login
+from crud_operations import (
+    get_user_2fa_secret, complete_login, redeem_2fa_ticket, clear_2fa_login, has_pending_2fa_login,
+    otp_lockout, record_otp_failure, clear_otp_failures
+)
+from rate_limiter import OTP_POLICY
+from two_factor_auth import verify_2fa_code as check_totp_code
 
 # Custom CSS for 2FA page
 st.markdown("""
@@ -44,44 +47,32 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-def check_otp_rate_limit():
-    """Check if OTP verification is rate limited"""
-    if 'otp_attempts' not in st.session_state:
-        st.session_state.otp_attempts = 0
-    if 'otp_lock_time' not in st.session_state:
-        st.session_state.otp_lock_time = None
-    
-    if st.session_state.otp_lock_time and datetime.now() < st.session_state.otp_lock_time:
-        remaining_time = int((st.session_state.otp_lock_time - datetime.now()).total_seconds())
-        st.error(f"Too many failed attempts! Please try again in {remaining_time} seconds.")
-        return True
-    return False
-
 def verify_2fa_code():
     """Verify the 2FA code entered by the user"""
-    if check_otp_rate_limit():
+    username = st.session_state.temp_username
+    # Shared lockout: holds across tabs and worker processes
+    lock = otp_lockout(username)
+    if lock:
+        st.error(f"Too many failed attempts! Please try again in {lock.retry_after} seconds.")
         return False
     
     # Get the 2FA secret for the user
-    username = st.session_state.temp_username
-    password = st.session_state.temp_password
     secret = get_user_2fa_secret(username)
     
     if not secret:
         st.error("2FA is not properly configured for your account.")
         return False
     
-    # Verify the code
-    totp = pyotp.TOTP(secret)
+    # Verify the code (window-tolerant and single-use)
     verification_code = st.session_state.get('verification_code', '')
     
     if verification_code and len(verification_code) == 6:
-        if totp.verify(verification_code):
+        if check_totp_code(secret, verification_code):
             # Reset OTP attempts on success
-            st.session_state.otp_attempts = 0
+            clear_otp_failures(username)
             
-            # Re-verify credentials before completing login
-            if verify_user_credentials(username, password):
+            # Redeem the pre-auth ticket minted by the password check (no second bcrypt)
+            if redeem_2fa_ticket(username):
                 # COMPLETE LOGIN FUNCTION WILL SET st.session_state.authenticated = True
                 # AND st.session_state.current_user = username
                 complete_login(username)
@@ -92,34 +83,28 @@ def verify_2fa_code():
                 # and display it on the target page (demo.py)
                 st.success("Verification successful! Redirecting to dashboard...")
                 
-                # Clear temporary credentials used for 2FA
-                st.session_state.temp_username = None
-                st.session_state.temp_password = None
-                st.session_state.login_step = None
+                # Clear the pending 2FA login
+                clear_2fa_login()
                 
                 # Switch page immediately. No time.sleep()
                 st.switch_page("demo.py")
                 return True
             else:
-                st.error("Credentials verification failed during 2FA process. Please re-login.")
-                # Clear temporary credentials if re-verification fails
-                st.session_state.temp_username = None
-                st.session_state.temp_password = None
-                st.session_state.login_step = None
+                st.error("Your sign-in expired or was already used. Please re-login.")
+                # Clear the pending login if the ticket is no longer valid
+                clear_2fa_login()
                 st.rerun() # Rerun to go back to initial state or login
                 return False
         else:
-            # Increment failed attempt counter
-            st.session_state.otp_attempts += 1
+            # Increment the shared failed attempt counter
+            status = record_otp_failure(username)
             
-            if st.session_state.otp_attempts >= 3:
-                    # Lock OTP verification for 1 minute and redirect to account locked page
-                    st.session_state.lock_time = datetime.now() + timedelta(minutes=1)
-                    st.session_state.account_locked = True
+            if status.locked:
+                    # Locked (lock_time mirrored into session state); redirect to account locked page
                     st.switch_page("pages/Account_Locked.py")
                     st.stop() # Stop execution to ensure redirection
             else:
-                st.error(f"Invalid verification code. {3 - st.session_state.otp_attempts} attempt(s) remaining.")
+                st.error(f"Invalid verification code. {status.remaining} attempt(s) remaining.")
                 return False
     else:
         st.error("Please enter a valid 6-digit code.")
@@ -137,8 +122,8 @@ def show_2fa_verification_page():
     """, unsafe_allow_html=True)
     
     # Show remaining attempts warning
-    remaining_attempts = 3 - st.session_state.get('otp_attempts', 0)
-    if remaining_attempts < 3:
+    remaining_attempts = OTP_POLICY.max_failures - st.session_state.get('otp_attempts', 0)
+    if remaining_attempts < OTP_POLICY.max_failures:
         st.warning(f"⚠️ {remaining_attempts} attempt(s) remaining")
     
     # Verification code input
@@ -158,11 +143,8 @@ def show_2fa_verification_page():
     
     with col2:
         if st.button("Back to Login", use_container_width=True):
-            # Clear temporary credentials
-            st.session_state.temp_username = None
-            st.session_state.temp_password = None
-            st.session_state.login_step = None
-            st.session_state.otp_attempts = 0
+            # Clear the pending login (failed codes stay counted server-side)
+            clear_2fa_login()
             st.switch_page("demo.py") # Go back to the main login page
     
     # Show timer for code validity
@@ -183,7 +165,7 @@ def show_2fa_verification_page():
     st.markdown('</div>', unsafe_allow_html=True)
 
 # Main execution
-if 'temp_username' not in st.session_state or 'temp_password' not in st.session_state:
+if not has_pending_2fa_login():
     st.error("No pending verification found. Please login first.")
     if st.button("Go to Login"):
         st.switch_page("demo.py")
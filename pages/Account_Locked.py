@@ -1,9 +1,12 @@
 import streamlit as st
+import streamlit.components.v1 as components
 import time
 from datetime import datetime
 import base64
 from pathlib import Path
 
+BACK_TO_LOGIN_LABEL = "Back to login"
+
 def inject_locked_css():
     st.markdown(f"""
     <style>
@@ -60,6 +63,42 @@ def inject_locked_css():
     </style>
     """, unsafe_allow_html=True)
 
+def start_countdown(remaining_ms):
+    """
+    Run the lock-screen countdown text in the browser. The script (in a
+    hidden component iframe) updates the .lock-timer element once a second;
+    the server is not contacted for it. The deadline is taken relative to
+    the browser clock, so client/server clock skew does not matter.
+    At the deadline it clicks the page's "Back to login" button: that click
+    is the only server contact, and its rerun takes the expiry branch in
+    main(). (The component sandbox does not allow navigating the parent
+    page directly, and a server-side wait would hold a script thread.)
+    """
+    components.html(f"""
+    <script>
+    const deadline = Date.now() + {int(remaining_ms)};
+    const page = window.parent;
+    function tick() {{
+        const left = Math.max(0, Math.ceil((deadline - Date.now()) / 1000));
+        const timer = page.document.querySelector('.lock-timer');
+        if (timer) {{
+            timer.textContent = String(Math.floor(left / 60)).padStart(2, '0') + ':' + String(left % 60).padStart(2, '0');
+        }}
+        if (left <= 0) {{
+            clearInterval(handle);
+            // Half a second of slack so the server-side lock has expired too
+            setTimeout(() => {{
+                const button = Array.from(page.document.querySelectorAll('button'))
+                    .find(b => b.innerText.trim() === {BACK_TO_LOGIN_LABEL!r});
+                if (button) button.click();
+            }}, 500);
+        }}
+    }}
+    const handle = setInterval(tick, 1000);
+    tick();
+    </script>
+    """, height=0)
+
 def main():
     inject_locked_css()
     
@@ -93,9 +132,11 @@ def main():
     </div>
     """.format(minutes, seconds), unsafe_allow_html=True)
     
-    # Automatically update the page every second
-    time.sleep(1)
-    st.rerun()
+    # Clicking early just re-renders the lock screen; the countdown clicks it at the deadline
+    st.button(BACK_TO_LOGIN_LABEL, use_container_width=True, key="lock_back_to_login")
+    
+    # The browser counts down; the server comes back once, at the deadline
+    start_countdown(remaining_time.total_seconds() * 1000)
 
 if __name__ == "__main__":
     st.set_page_config(
@@ -1,6 +1,17 @@
 # pages/Admin.py
 import streamlit as st
-from database import mongo_manager
+from database import get_manager
+from async_database import get_async_manager, gather_blocking
+from db_instrumentation import command_metrics, section
+from db_indexes import verify_query_shapes
+from ciphertext_converter import ciphertext_converter
+from key_rotation import key_rotation_job
+from encryption import encryption_manager
+from password_hashing import password_hasher
+from rate_limiter import rate_limiter
+from totp_service import totp_service
+from qr_provisioning import qr_images
+from static_assets import static_assets
 from datetime import datetime, timedelta
 import pandas as pd
 import plotly.express as px
@@ -10,24 +21,31 @@ def get_database_statistics():
     stats = {}
     
     try:
+        # All queries are independent, so issue them concurrently
+        db = get_async_manager()
+        week_ago = datetime.now() - timedelta(days=7)
+        (total_users, admin_users, total_passwords,
+         storage_bytes, recent_logins) = gather_blocking(
+            db.call('count_users'),
+            db.call('count_users', admin_only=True),
+            db.call('count_all_passwords'),
+            db.call('storage_size_bytes'),
+            # Activity statistics (last 7 days)
+            db.call('count_users', logged_in_since=week_ago)
+        )
+        
         # User statistics
-        stats['total_users'] = mongo_manager.db.users.count_documents({})
-        stats['admin_users'] = mongo_manager.db.users.count_documents({"is_admin": True})
+        stats['total_users'] = total_users
+        stats['admin_users'] = admin_users
         stats['regular_users'] = stats['total_users'] - stats['admin_users']
         
         # Password statistics
-        stats['total_passwords'] = mongo_manager.db.passwords.count_documents({})
+        stats['total_passwords'] = total_passwords
         
         # Storage statistics
-        users_size = mongo_manager.db.command("collstats", "users")['size']
-        passwords_size = mongo_manager.db.command("collstats", "passwords")['size']
-        stats['total_storage_kb'] = (users_size + passwords_size) / 1024
+        stats['total_storage_kb'] = storage_bytes / 1024
         
-        # Activity statistics (last 7 days)
-        week_ago = datetime.now() - timedelta(days=7)
-        stats['recent_logins'] = mongo_manager.db.users.count_documents({
-            "last_login": {"$gte": week_ago}
-        })
+        stats['recent_logins'] = recent_logins
         
         # Password strength analysis (placeholder - would require actual analysis)
         stats['weak_passwords'] = 0  # This would require password strength checking
@@ -44,13 +62,7 @@ def show_user_management():
     
     # Get all users
     try:
-        users = list(mongo_manager.db.users.find({}, {
-            "username": 1, 
-            "created_at": 1, 
-            "last_login": 1, 
-            "is_admin": 1,
-            "two_factor_enabled": 1
-        }).sort("created_at", -1))
+        users = get_manager().list_users()
         
         if users:
             # Convert to DataFrame for better display
@@ -104,9 +116,7 @@ def show_user_management():
             with col3:
                 if st.button("🧹 Find Inactive Users", use_container_width=True):
                     inactive_threshold = datetime.now() - timedelta(days=30)
-                    inactive_users = mongo_manager.db.users.count_documents({
-                        "last_login": {"$lt": inactive_threshold}
-                    })
+                    inactive_users = get_manager().count_users(logged_in_before=inactive_threshold)
                     st.info(f"🔍 {inactive_users} users inactive for 30+ days")
         
         else:
@@ -163,14 +173,25 @@ def show_database_statistics():
     
     health_col1, health_col2 = st.columns(2)
     
+    if get_manager().name == "mongodb" and st.button("🗂️ Verify Index Coverage", use_container_width=True):
+        try:
+            results = verify_query_shapes(get_manager().db)
+            failing = [result for result in results if not result['ok']]
+            if failing:
+                st.error(f"❌ {len(failing)} query shape(s) fall back to a collection scan")
+            else:
+                st.success("✅ All query shapes are index-backed")
+            st.dataframe(pd.DataFrame(results), use_container_width=True, hide_index=True)
+        except Exception as e:
+            st.error(f"Index verification failed: {str(e)}")
+    
     with health_col1:
         if st.button("🩺 Run Health Check", use_container_width=True):
             try:
                 # Simple health check
-                users_ok = mongo_manager.db.users.find_one() is not None
-                passwords_ok = mongo_manager.db.passwords.find_one() is not None
+                health = get_manager().health_check()
                 
-                if users_ok and passwords_ok:
+                if health['users'] and health['passwords']:
                     st.success("✅ Database connection healthy")
                 else:
                     st.warning("⚠️ Database collections may be empty")
@@ -182,15 +203,70 @@ def show_database_statistics():
         if st.button("📈 Performance Stats", use_container_width=True):
             try:
                 # Collection stats
-                users_stats = mongo_manager.db.command("collstats", "users")
-                passwords_stats = mongo_manager.db.command("collstats", "passwords")
+                counts = get_manager().collection_counts()
                 
-                st.info(f"📁 Users collection: {users_stats['count']} documents")
-                st.info(f"🔑 Passwords collection: {passwords_stats['count']} documents")
+                st.info(f"📁 Users collection: {counts['users']} documents")
+                st.info(f"🔑 Passwords collection: {counts['passwords']} documents")
                 
             except Exception as e:
                 st.error(f"Error getting performance stats: {str(e)}")
 
+def show_query_metrics():
+    """Display per-section DB command metrics collected by the command listener"""
+    st.subheader("📈 Query Metrics")
+    
+    if not command_metrics.enabled:
+        st.info("Command metrics are disabled (PASSWORD_MANAGER_DB_METRICS=0).")
+        return
+    
+    snapshot = command_metrics.dump()
+    st.caption(f"Collected since {snapshot['since']} by this server process")
+    if not command_metrics.count_bytes:
+        st.caption("Byte counts are off; set PASSWORD_MANAGER_DB_METRICS_BYTES=1 to record them (re-encodes every reply).")
+    
+    rows = snapshot['commands']
+    if rows:
+        df = pd.DataFrame([{k: v for k, v in row.items() if k != 'latency_buckets'} for row in rows])
+        st.dataframe(df, use_container_width=True, hide_index=True)
+        
+        # Totals per section
+        totals = df.groupby("section")[["count", "bytes_sent", "bytes_received"]].sum().reset_index()
+        totals["runs"] = totals["section"].map(snapshot['runs']).fillna(0).astype(int)
+        totals["budget"] = totals["section"].map(snapshot['budgets'])
+        st.markdown("**Per-section totals**")
+        st.dataframe(totals, use_container_width=True, hide_index=True)
+    else:
+        st.info("No database commands recorded yet.")
+    
+    violations = snapshot['budget_violations']
+    if violations:
+        st.warning(f"⚠️ {len(violations)} render(s) exceeded their query budget")
+        st.dataframe(pd.DataFrame(violations), use_container_width=True, hide_index=True)
+    
+    # bcrypt worker pool
+    hashing = password_hasher.status()
+    st.markdown("**Password hashing pool**")
+    hash_col1, hash_col2, hash_col3, hash_col4 = st.columns(4)
+    hash_col1.metric("Queue depth", hashing['queue_depth'], help=f"{hashing['running']}/{hashing['workers']} workers busy, queue limit {hashing['max_queue']}")
+    hash_col2.metric("Shed (try again)", hashing['rejected'])
+    hash_col3.metric("Hash p95", f"{hashing['hash_time']['p95_ms']} ms")
+    hash_col4.metric("Queue wait p95", f"{hashing['queue_wait']['p95_ms']} ms")
+    st.caption(f"bcrypt cost {hashing['rounds']} · {hashing['rehashed']} hash(es) upgraded on login this process")
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button(
+            label="📥 Download Metrics (JSON)",
+            data=command_metrics.dump_json(),
+            file_name="db_metrics.json",
+            mime="application/json",
+            use_container_width=True
+        )
+    with col2:
+        if st.button("🔄 Reset Metrics", use_container_width=True):
+            command_metrics.reset()
+            st.rerun()
+
 def main():
     st.set_page_config(
         page_title="Admin Panel - Password Manager",
@@ -211,15 +287,19 @@ def main():
         st.stop()
     
     # Admin navigation
-    admin_tabs = st.tabs(["📊 Database Statistics", "👥 User Management", "⚙️ System Settings"])
-    
-    with admin_tabs[0]:
-        show_database_statistics()
+    admin_tabs = st.tabs(["📊 Database Statistics", "👥 User Management", "📈 Query Metrics", "⚙️ System Settings"])
     
-    with admin_tabs[1]:
-        show_user_management()
+    with section("Admin"):
+        with admin_tabs[0]:
+            show_database_statistics()
+        
+        with admin_tabs[1]:
+            show_user_management()
     
     with admin_tabs[2]:
+        show_query_metrics()
+    
+    with admin_tabs[3]:
         st.subheader("⚙️ System Configuration")
         st.info("System settings panel coming soon...")
         
@@ -239,8 +319,40 @@ def main():
                     "Session Active": st.session_state.authenticated,
                     "Python Version": "3.x",  # You can add actual version check
                     "Streamlit Version": st.__version__,
-                    "Database Status": "Connected" if mongo_manager.is_connected() else "Disconnected"
+                    "Database Backend": get_manager().name,
+                    "Database Status": "Connected" if get_manager().is_connected() else "Disconnected",
+                    "Database Circuit": get_manager().breaker.status() if hasattr(get_manager(), 'breaker') else None,
+                    "Ciphertext Conversion": ciphertext_converter.status(),
+                    "Key Rotation": key_rotation_job.status(),
+                    "Data Key Cache": encryption_manager.data_keys.status(),
+                    "Password Hashing": password_hasher.status(),
+                    "Rate Limiter": rate_limiter.status(),
+                    "TOTP": totp_service.status(),
+                    "QR Codes": qr_images.status(),
+                    "Static Assets": static_assets.status()
                 })
+        
+        # Encryption key rotation
+        st.markdown("---")
+        st.subheader("🔐 Encryption Key Rotation")
+        st.caption("Re-encrypts every stored password under the current key. Keep the old keys configured until it is done.")
+        
+        rot_col1, rot_col2 = st.columns(2)
+        with rot_col1:
+            if st.button("🔁 Start / Resume Rotation", use_container_width=True):
+                if key_rotation_job.start():
+                    st.success("✅ Rotation started in the background")
+                else:
+                    st.info("Rotation is already running")
+        with rot_col2:
+            if st.button("⏹️ Pause Rotation", use_container_width=True):
+                key_rotation_job.stop()
+                st.info("Rotation will pause after the current batch")
+        
+        rotation_status = key_rotation_job.status()
+        if rotation_status.get("warning"):
+            st.warning(f"⚠️ {rotation_status['warning']}")
+        st.json(rotation_status)
     
     # Quick stats footer
     st.markdown("---")
@@ -1,37 +1,27 @@
 # pages/Create_Admin.py
 import streamlit as st
-from database import mongo_manager
-import bcrypt
-from datetime import datetime
+from database import get_manager
+from password_hashing import HashingOverloaded
+from crud_operations import invalidate_user_profile
 
 def create_admin_user():
     """Create admin user if it doesn't exist and show results in Streamlit"""
     
     # Initialize database connection
-    if not mongo_manager.connect():
+    if not get_manager().is_connected():
         st.error("❌ Failed to connect to database")
         return False
     
     # Check if admin already exists
-    if mongo_manager.db.users.find_one({"username": "admin"}):
+    if get_manager().get_user_profile("admin"):
         st.success("✅ Admin user already exists")
         return True
     
     # Create admin user with password "admin123"
     password = "admin123"
-    hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-    
-    result = mongo_manager.db.users.insert_one({
-        "username": "admin",
-        "password": hashed_password,
-        "created_at": datetime.now(),
-        "last_login": None,
-        "two_factor_secret": None,
-        "two_factor_enabled": False,
-        "is_admin": True
-    })
-    
-    if result.inserted_id:
+    
+    if get_manager().create_user("admin", password, is_admin=True):
+        invalidate_user_profile("admin")
         st.success("✅ Admin user created successfully!")
         
         # Display credentials in a nice box
@@ -69,13 +59,12 @@ def update_admin_password():
         return False
     
     # Initialize database connection
-    if not mongo_manager.connect():
+    if not get_manager().is_connected():
         st.error("❌ Failed to connect to database")
         return False
     
     # Check if admin exists
-    admin_user = mongo_manager.db.users.find_one({"username": "admin"})
-    if not admin_user:
+    if not get_manager().get_user_profile("admin"):
         st.error("❌ Admin user does not exist. Please create it first.")
         return False
     
@@ -103,20 +92,16 @@ def update_admin_password():
                 return False
                 
             # Verify current password
-            if not bcrypt.checkpw(current_password.encode('utf-8'), admin_user['password']):
-                st.error("Current password is incorrect.")
+            try:
+                if not get_manager().authenticate("admin", current_password):
+                    st.error("Current password is incorrect.")
+                    return False
+            except HashingOverloaded as e:
+                st.warning(f"⏳ {e}")
                 return False
                 
-            # Hash new password
-            hashed_password = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt())
-            
-            # Update password in database
-            result = mongo_manager.db.users.update_one(
-                {"username": "admin"},
-                {"$set": {"password": hashed_password}}
-            )
-            
-            if result.modified_count > 0:
+            # Hash and store the new password
+            if get_manager().update_user_password("admin", new_password):
                 st.success("✅ Admin password updated successfully!")
                 return True
             else:
@@ -216,8 +201,8 @@ def main():
         st.subheader("🔍 Current Status Check")
         
         if st.button("🔄 Check if Admin Exists", use_container_width=True):
-            if mongo_manager.connect():
-                admin_exists = mongo_manager.db.users.find_one({"username": "admin"})
+            if get_manager().is_connected():
+                admin_exists = get_manager().get_user_profile("admin")
                 if admin_exists:
                     st.success("✅ Admin account exists in database")
                     
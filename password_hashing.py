@@ -0,0 +1,197 @@
+# password_hashing.py
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import bcrypt
+from storage_backend import _env_int
+
+DEFAULT_ROUNDS = 12  # bcrypt's own default, used until the cost is calibrated
+MIN_ROUNDS = 10  # Calibration never goes below this, however slow the machine
+MAX_ROUNDS = 18
+DEFAULT_CONFIG_PATH = "password_hashing.json"
+
+def hash_rounds(hashed):
+    """Cost factor of a stored bcrypt hash ($2b$<rounds>$...), or None"""
+    if isinstance(hashed, str):
+        hashed = hashed.encode('utf-8')
+    try:
+        return int(bytes(hashed).split(b"$")[2])
+    except (IndexError, ValueError, TypeError):
+        return None
+
+def config_path():
+    return os.environ.get('PASSWORD_MANAGER_HASH_CONFIG', DEFAULT_CONFIG_PATH)
+
+def load_rounds():
+    """
+    Configured bcrypt cost: PASSWORD_MANAGER_BCRYPT_ROUNDS, else the value
+    written by scripts/calibrate_bcrypt.py, else DEFAULT_ROUNDS
+    """
+    rounds = _env_int('PASSWORD_MANAGER_BCRYPT_ROUNDS', 0)
+    if not rounds:
+        try:
+            with open(config_path()) as handle:
+                rounds = int(json.load(handle).get("rounds", 0))
+        except (OSError, ValueError, TypeError, AttributeError):
+            rounds = 0
+    return min(max(rounds, 4), 31) if rounds else DEFAULT_ROUNDS
+
+def calibrate_rounds(target_ms=250, min_rounds=MIN_ROUNDS, max_rounds=MAX_ROUNDS, samples=3):
+    """
+    Highest cost whose checkpw time on this machine stays within target_ms
+    (never below min_rounds). Each extra round doubles the time, so the
+    search stops at the first cost over target. Returns (rounds, timings)
+    where timings maps each measured cost to its best time in ms.
+    """
+    password = os.urandom(16).hex().encode()
+    chosen, timings = min_rounds, {}
+    for rounds in range(min_rounds, max_rounds + 1):
+        hashed = bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+        best = float("inf")
+        for _ in range(samples):
+            started = time.perf_counter()
+            bcrypt.checkpw(password, hashed)
+            best = min(best, (time.perf_counter() - started) * 1000)
+        timings[rounds] = round(best, 1)
+        if best > target_ms:
+            break
+        chosen = rounds
+    return chosen, timings
+
+def save_rounds(rounds, target_ms=None, timings=None, path=None):
+    """Write a calibrated cost to the hashing config file (atomically)"""
+    path = path or config_path()
+    config = {
+        "rounds": rounds,
+        "target_ms": target_ms,
+        "timings_ms": {str(r): ms for r, ms in (timings or {}).items()},
+        "calibrated_at": datetime.now().isoformat(timespec="seconds"),
+    }
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as handle:
+        json.dump(config, handle, indent=2)
+    os.replace(temp_path, path)
+
+class HashingOverloaded(Exception):
+    """Raised instead of queueing when the hashing pool is saturated"""
+    def __init__(self):
+        super().__init__("Too many sign-ins are being processed. Please try again shortly.")
+
+class _Latency:
+    """Count/avg/max plus a p95 over the most recent samples (milliseconds)"""
+    def __init__(self, window=500):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        self.recent.append(value)
+
+    def summary(self):
+        recent = sorted(self.recent)
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total / self.count, 1) if self.count else 0.0,
+            "p95_ms": round(recent[min(len(recent) - 1, int(len(recent) * 0.95))], 1) if recent else 0.0,
+            "max_ms": round(self.max, 1),
+        }
+
+class PasswordHasher:
+    """
+    Runs bcrypt on a dedicated, bounded worker pool.
+
+    bcrypt releases the GIL, so a burst of logins hashes in parallel on the
+    workers instead of serializing on the Streamlit script threads. At most
+    `workers + max_queue` operations are admitted; beyond that calls fail
+    fast with HashingOverloaded so callers can shed load ("try again
+    shortly") instead of piling up behind a long queue.
+
+    New hashes use the configured cost (load_rounds); hashes made with any
+    other cost are upgraded on the next successful login (needs_rehash).
+    """
+    def __init__(self, workers=None, max_queue=None, rounds=None):
+        self.rounds = rounds or load_rounds()
+        self.workers = workers or max(1, _env_int('PASSWORD_MANAGER_HASH_WORKERS', os.cpu_count() or 1))
+        self.max_queue = max_queue if max_queue is not None else max(0, _env_int('PASSWORD_MANAGER_HASH_QUEUE', 32))
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._admitted = 0  # Queued + running
+        self._running = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self.wait_latency = _Latency()
+        self.hash_latency = _Latency()
+
+    def _get_executor(self):
+        """Return this process's executor, recreating it after a fork"""
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+            self._pid = os.getpid()
+            self._admitted = 0
+            self._running = 0
+        return self._executor
+
+    def _run(self, function, *args):
+        with self._lock:
+            executor = self._get_executor()
+            if self._admitted >= self.workers + self.max_queue:
+                self.rejected += 1
+                raise HashingOverloaded()
+            self._admitted += 1
+        submitted = time.perf_counter()
+
+        def task():
+            started = time.perf_counter()
+            with self._lock:
+                self._running += 1
+            try:
+                return function(*args)
+            finally:
+                finished = time.perf_counter()
+                with self._lock:
+                    self._running -= 1
+                    self._admitted -= 1
+                    self.wait_latency.observe((started - submitted) * 1000)
+                    self.hash_latency.observe((finished - started) * 1000)
+
+        return executor.submit(task).result()
+
+    def hash(self, password, rounds=None):
+        """bcrypt hash of a str password at the configured (or given) cost"""
+        return self._run(bcrypt.hashpw, password.encode('utf-8'), bcrypt.gensalt(rounds or self.rounds))
+
+    def check(self, password, hashed):
+        """Check a str password against a stored bcrypt hash"""
+        return self._run(bcrypt.checkpw, password.encode('utf-8'), hashed)
+
+    def needs_rehash(self, hashed):
+        """True if a stored hash was made with a different cost than configured"""
+        rounds = hash_rounds(hashed)
+        return rounds is not None and rounds != self.rounds
+
+    def status(self):
+        """Queue depth and latency snapshot for diagnostics pages"""
+        with self._lock:
+            return {
+                "rounds": self.rounds,
+                "rehashed": self.rehashed,
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "running": self._running,
+                "queue_depth": self._admitted - self._running,
+                "rejected": self.rejected,
+                "queue_wait": self.wait_latency.summary(),
+                "hash_time": self.hash_latency.summary(),
+            }
+
+# Global bcrypt worker pool
+password_hasher = PasswordHasher()
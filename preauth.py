@@ -0,0 +1,99 @@
+# preauth.py
+import base64
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from cipher_suites import derive_key
+from encryption import encryption_manager
+from storage_backend import _env_int
+
+class PreAuthTickets:
+    """
+    Signed, short-lived tickets for the gap between the password check and
+    the 2FA code.
+
+    After bcrypt succeeds the login page keeps a ticket instead of the
+    plaintext password; the 2FA page redeems it after TOTP verification, so
+    the password is hashed once per login. A ticket is HMAC-signed with a
+    key derived from the master key, names one user, expires after
+    ttl seconds and can be redeemed only once in this process.
+    """
+    def __init__(self, ttl=None):
+        self.ttl = ttl or max(1, _env_int('PASSWORD_MANAGER_PREAUTH_TTL_SECONDS', 300))
+        self._key = None
+        self._redeemed = {}  # nonce -> expiry, kept until the ticket would have expired anyway
+        self._lock = threading.Lock()
+
+    def _signing_key(self):
+        if self._key is None:
+            if encryption_manager.key:
+                master = base64.urlsafe_b64decode(encryption_manager.key)
+                self._key = derive_key(master, b"password-manager/preauth-ticket")
+            else:
+                self._key = os.urandom(32)  # No master key: tickets only live as long as this process
+        return self._key
+
+    def _sign(self, payload):
+        return hmac.new(self._signing_key(), payload, hashlib.sha256).digest()
+
+    @staticmethod
+    def _b64(data):
+        return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+    @staticmethod
+    def _unb64(text):
+        return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+    def issue(self, username, step="2fa"):
+        """Mint a ticket for a user whose password has just been verified"""
+        payload = json.dumps({
+            "u": username,
+            "s": step,
+            "exp": int(time.time()) + self.ttl,
+            "n": self._b64(os.urandom(12)),
+        }, separators=(",", ":")).encode()
+        return f"{self._b64(payload)}.{self._b64(self._sign(payload))}"
+
+    def _claims(self, ticket, username, step):
+        """Decoded claims of a valid, unexpired ticket for username, or None"""
+        try:
+            encoded_payload, encoded_signature = ticket.split(".", 1)
+            payload = self._unb64(encoded_payload)
+            if not hmac.compare_digest(self._sign(payload), self._unb64(encoded_signature)):
+                return None
+            claims = json.loads(payload)
+        except (AttributeError, ValueError, TypeError):
+            return None
+        if claims.get("u") != username or claims.get("s") != step:
+            return None
+        if claims.get("exp", 0) <= time.time():
+            return None
+        return claims
+
+    def is_valid(self, ticket, username, step="2fa"):
+        """True if the ticket could still be redeemed (does not consume it)"""
+        claims = self._claims(ticket, username, step)
+        if claims is None:
+            return False
+        with self._lock:
+            return claims["n"] not in self._redeemed
+
+    def redeem(self, ticket, username, step="2fa"):
+        """Consume the ticket; True exactly once for a valid ticket"""
+        claims = self._claims(ticket, username, step)
+        if claims is None:
+            return False
+        now = time.time()
+        with self._lock:
+            for nonce in [n for n, expires in self._redeemed.items() if expires <= now]:
+                del self._redeemed[nonce]
+            if claims["n"] in self._redeemed:
+                return False
+            self._redeemed[claims["n"]] = claims["exp"]
+        return True
+
+# Global pre-auth ticket issuer
+preauth_tickets = PreAuthTickets()
@@ -0,0 +1,79 @@
+# qr_provisioning.py
+import base64
+import io
+import os
+import threading
+from collections import OrderedDict
+import qrcode
+import qrcode.image.svg
+from storage_backend import _env_int
+
+class QRCodeImages:
+    """
+    Renders provisioning URIs as QR codes, once per URI.
+
+    Images are kept in a bounded LRU keyed by (uri, format), so reruns of
+    the 2FA setup screen reuse the encoded bytes. "png" rasterizes with
+    Pillow; "svg" builds a small vector path without Pillow. Both are
+    returned in a form st.image() takes directly, with no base64 round-trip.
+    """
+    FORMATS = ("png", "svg")
+
+    def __init__(self, image_format=None, max_size=None, box_size=10, border=4):
+        image_format = (image_format or os.environ.get('PASSWORD_MANAGER_QR_FORMAT', 'png')).strip().lower()
+        self.image_format = image_format if image_format in self.FORMATS else "png"
+        self.max_size = max_size or max(1, _env_int('PASSWORD_MANAGER_QR_CACHE_SIZE', 256))
+        self.box_size = box_size
+        self.border = border
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _render(self, uri, image_format):
+        qr = qrcode.QRCode(
+            error_correction=qrcode.constants.ERROR_CORRECT_L,
+            box_size=self.box_size,
+            border=self.border,
+        )
+        qr.add_data(uri)
+        qr.make(fit=True)
+        buffer = io.BytesIO()
+        if image_format == "svg":
+            qr.make_image(image_factory=qrcode.image.svg.SvgPathImage).save(buffer)
+            svg = buffer.getvalue().decode("utf-8")
+            return svg[svg.find("<svg"):]  # Drop the XML declaration so st.image detects SVG
+        qr.make_image(fill_color="black", back_color="white").save(buffer, format="PNG")
+        return buffer.getvalue()
+
+    def image(self, uri, image_format=None):
+        """QR code for uri: PNG bytes, or an SVG document string for format "svg\""""
+        image_format = image_format or self.image_format
+        key = (uri, image_format)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return cached
+        self.misses += 1
+        rendered = self._render(uri, image_format)
+        with self._lock:
+            self._cache[key] = rendered
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+        return rendered
+
+    def png_base64(self, uri):
+        """Base64 PNG, for callers that embed a data: URI themselves"""
+        return base64.b64encode(self.image(uri, "png")).decode()
+
+    def status(self):
+        """Cache snapshot for diagnostics pages"""
+        with self._lock:
+            size = len(self._cache)
+        return {"format": self.image_format, "cached_images": size, "max_size": self.max_size,
+                "hits": self.hits, "misses": self.misses}
+
+# Global QR code renderer
+qr_images = QRCodeImages()
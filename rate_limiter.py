@@ -0,0 +1,259 @@
+# rate_limiter.py
+import math
+import os
+import threading
+import time
+from datetime import datetime
+from storage_backend import _env_int, _env_bool
+
+class LimitPolicy:
+    """
+    max_failures within window_seconds (counted from the first failure)
+    lock the key for lock_seconds; the counter starts over once the
+    window or the lock has passed.
+    """
+    def __init__(self, name, max_failures, window_seconds, lock_seconds):
+        self.name = name
+        self.max_failures = max(1, max_failures)
+        self.window_seconds = max(1, window_seconds)
+        self.lock_seconds = max(1, lock_seconds)
+
+    def key(self, *parts):
+        return f"{self.name}:" + "|".join(str(part) for part in parts)
+
+# Wrong password for one user from one client (the old per-session counter)
+LOGIN_POLICY = LimitPolicy(
+    "login",
+    _env_int('PASSWORD_MANAGER_LOGIN_MAX_FAILURES', 3),
+    _env_int('PASSWORD_MANAGER_LOGIN_WINDOW_SECONDS', 900),
+    _env_int('PASSWORD_MANAGER_LOGIN_LOCK_SECONDS', 60),
+)
+# Wrong passwords from one client across all usernames
+CLIENT_POLICY = LimitPolicy(
+    "login-client",
+    _env_int('PASSWORD_MANAGER_CLIENT_MAX_FAILURES', 20),
+    _env_int('PASSWORD_MANAGER_CLIENT_WINDOW_SECONDS', 900),
+    _env_int('PASSWORD_MANAGER_CLIENT_LOCK_SECONDS', 300),
+)
+# Wrong 2FA codes for one user from one client
+OTP_POLICY = LimitPolicy(
+    "otp",
+    _env_int('PASSWORD_MANAGER_OTP_MAX_FAILURES', 3),
+    _env_int('PASSWORD_MANAGER_OTP_WINDOW_SECONDS', 900),
+    _env_int('PASSWORD_MANAGER_OTP_LOCK_SECONDS', 60),
+)
+
+UNKNOWN_CLIENT = "unknown"
+
+def client_id():
+    """
+    Best-effort address of the browser behind the current session.
+    X-Forwarded-For is only trusted with PASSWORD_MANAGER_TRUST_FORWARDED_FOR=1
+    (i.e. behind a proxy that sets it).
+    """
+    import streamlit as st
+    context = getattr(st, "context", None)
+    if context is None:
+        return UNKNOWN_CLIENT
+    if _env_bool('PASSWORD_MANAGER_TRUST_FORWARDED_FOR', False):
+        try:
+            forwarded = context.headers.get("X-Forwarded-For")
+        except Exception:
+            forwarded = None
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    try:
+        return getattr(context, "ip_address", None) or UNKNOWN_CLIENT
+    except Exception:
+        return UNKNOWN_CLIENT
+
+def client_key():
+    """
+    Key part for per-client counters: the client address, or this browser
+    session when the address is unknown (no st.context on older Streamlit,
+    no address on localhost). A lock earned by an unidentified client must
+    never apply to every client using the same username.
+    """
+    client = client_id()
+    if client != UNKNOWN_CLIENT:
+        return client
+    import streamlit as st
+    session = st.session_state.get('rate_limit_session')
+    if session is None:
+        session = st.session_state['rate_limit_session'] = os.urandom(12).hex()
+    return f"session:{session}"
+
+def is_identified(client):
+    """True if a client_key() names a client address rather than a session"""
+    return not client.startswith("session:")
+
+class LimitStatus:
+    """Failure count and lock deadline for one key"""
+    __slots__ = ("failures", "locked_until", "max_failures")
+
+    def __init__(self, record, policy):
+        record = record or {}
+        self.failures = record.get("failures", 0)
+        self.locked_until = record.get("locked_until")  # Epoch seconds or None
+        self.max_failures = policy.max_failures
+
+    @property
+    def locked(self):
+        return self.locked_until is not None and self.locked_until > time.time()
+
+    @property
+    def retry_after(self):
+        """Whole seconds until the lock ends (0 if not locked)"""
+        return max(0, math.ceil(self.locked_until - time.time())) if self.locked else 0
+
+    @property
+    def remaining(self):
+        """Failures left before the key locks"""
+        return max(0, self.max_failures - self.failures)
+
+    @property
+    def lock_deadline(self):
+        """Lock end as a local datetime (what the lock screen counts down to)"""
+        return datetime.fromtimestamp(self.locked_until) if self.locked_until else None
+
+def apply_failure(record, now, max_failures, window_seconds, lock_seconds):
+    """New {failures, locked_until, expires_at} after one more failure"""
+    live = record is not None and record["expires_at"] > now
+    failures = record["failures"] + 1 if live else 1
+    locked_until = record.get("locked_until") if live else None
+    expires_at = record["expires_at"] if live else now + window_seconds
+    if failures >= max_failures:
+        # The record (and with it the count) ends with the lock
+        locked_until = now + lock_seconds
+        expires_at = locked_until
+    return {"failures": failures, "locked_until": locked_until, "expires_at": expires_at}
+
+class MemoryLimitStore:
+    """
+    In-process store with the same rate-limit methods as the storage
+    backends. Used when the shared store is disabled or unreachable.
+    """
+    def __init__(self, prune_interval=60):
+        self._records = {}
+        self._lock = threading.Lock()
+        self._prune_interval = prune_interval
+        self._pruned_at = time.time()
+
+    def _prune(self, now):
+        if now - self._pruned_at >= self._prune_interval:
+            for key in [k for k, record in self._records.items() if record["expires_at"] <= now]:
+                del self._records[key]
+            self._pruned_at = now
+
+    def get_rate_limit(self, key):
+        now = time.time()
+        with self._lock:
+            record = self._records.get(key)
+            return dict(record) if record and record["expires_at"] > now else None
+
+    def hit_rate_limit(self, key, max_failures, window_seconds, lock_seconds):
+        now = time.time()
+        with self._lock:
+            self._prune(now)
+            record = apply_failure(self._records.get(key), now, max_failures, window_seconds, lock_seconds)
+            self._records[key] = record
+            return dict(record)
+
+    def clear_rate_limit(self, key):
+        with self._lock:
+            self._records.pop(key, None)
+
+class RateLimiter:
+    """
+    Failure counters and lockouts shared by every session and process.
+
+    Counters live in the storage backend (a TTL collection on MongoDB, a
+    table on SQLite), addressed by key, so a new tab or another replica
+    sees the same lock. Each process also keeps a small read cache: a
+    known lock is trusted until its deadline and a clean check is reused
+    for cache_ms, so rendering the login page rarely touches the database.
+    If the backend is unreachable the limiter falls back to an in-process
+    store rather than failing open.
+    """
+    def __init__(self, shared=None, cache_ms=None):
+        self.shared = shared if shared is not None else _env_bool('PASSWORD_MANAGER_RATE_LIMIT_SHARED', True)
+        self.cache_ms = cache_ms if cache_ms is not None else max(0, _env_int('PASSWORD_MANAGER_RATE_LIMIT_CACHE_MS', 1000))
+        self.local = MemoryLimitStore()
+        self._cache = {}  # key -> (record, valid_until)
+        self._lock = threading.Lock()
+        self.fallbacks = 0
+
+    def _call(self, method, *args):
+        """Run a store method on the shared backend, or locally if unavailable"""
+        if self.shared:
+            try:
+                # Imported lazily: database imports modules that import this one
+                from database import get_manager
+                return getattr(get_manager(), method)(*args)
+            except Exception as e:
+                print(f"rate limiter: shared store failed, using in-process counters: {e}")
+            self.fallbacks += 1
+        return getattr(self.local, method)(*args)
+
+    def _remember(self, key, record):
+        now = time.time()
+        if record and record.get("locked_until") and record["locked_until"] > now:
+            valid_until = record["locked_until"]  # Locks only end early through reset()
+        else:
+            valid_until = now + self.cache_ms / 1000
+        with self._lock:
+            if len(self._cache) > 10000:
+                self._cache = {k: v for k, v in self._cache.items() if v[1] > now}
+            self._cache[key] = (record, valid_until)
+
+    def check(self, policy, *parts):
+        """Current LimitStatus for the key (does not count as a failure)"""
+        key = policy.key(*parts)
+        with self._lock:
+            cached = self._cache.get(key)
+        if cached is not None and cached[1] > time.time():
+            return LimitStatus(cached[0], policy)
+        record = self._call("get_rate_limit", key)
+        self._remember(key, record)
+        return LimitStatus(record, policy)
+
+    def hit(self, policy, *parts):
+        """Count one failure; returns the LimitStatus after it"""
+        key = policy.key(*parts)
+        record = self._call("hit_rate_limit", key, policy.max_failures,
+                            policy.window_seconds, policy.lock_seconds)
+        self._remember(key, record)
+        return LimitStatus(record, policy)
+
+    def reset(self, policy, *parts):
+        """Forget the key's failures (after a success)"""
+        key = policy.key(*parts)
+        with self._lock:
+            self._cache.pop(key, None)
+        self._call("clear_rate_limit", key)
+
+    def status(self):
+        """Settings snapshot for diagnostics pages"""
+        with self._lock:
+            cached = len(self._cache)
+        return {
+            "shared": self.shared,
+            "cache_ms": self.cache_ms,
+            "cached_keys": cached,
+            "fallbacks": self.fallbacks,
+            "policies": {
+                policy.name: f"{policy.max_failures} failures / {policy.window_seconds}s -> {policy.lock_seconds}s lock"
+                for policy in (LOGIN_POLICY, CLIENT_POLICY, OTP_POLICY)
+            },
+        }
+
+    def _reset_after_fork(self):
+        """Locks held by other threads at fork() would never be released"""
+        self._lock = threading.Lock()
+        self.local._lock = threading.Lock()
+
+# Global rate limiter
+rate_limiter = RateLimiter()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=rate_limiter._reset_after_fork)
@@ -1,20 +1,42 @@
 #scripts/backup_database.py
-from database import mongo_manager
+from database import get_manager
 from datetime import datetime
 import subprocess
+import sqlite3
 import os
 
+def backup_sqlite_database(manager, backup_dir):
+    """Copy the SQLite database with the online backup API (safe while in use)"""
+    target_path = os.path.join(backup_dir, os.path.basename(manager.path))
+    try:
+        source = sqlite3.connect(manager.path)
+        target = sqlite3.connect(target_path)
+        with target:
+            source.backup(target)
+        target.close()
+        source.close()
+        print(f"✅ Backup created: {target_path}")
+        return True
+    except Exception as e:
+        print(f"❌ Backup error: {str(e)}")
+        return False
+
 def backup_database():
     """Create a MongoDB backup"""
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     backup_dir = f"backups/{timestamp}"
     os.makedirs(backup_dir, exist_ok=True)
     
+    manager = get_manager()
+    if manager.name == "sqlite":
+        return backup_sqlite_database(manager, backup_dir)
+    
     try:
         # Use mongodump for proper backup
         result = subprocess.run([
             "mongodump",
-            "--uri", "mongodb://localhost:27017/password_manager",
+            "--uri", manager.connection_string,
+            "--db", manager.database_name,
             "--out", backup_dir
         ], capture_output=True, text=True)
         
@@ -0,0 +1,71 @@
+#scripts/benchmark_ciphers.py
+import argparse
+import secrets
+import string
+import sys
+import os
+import time
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from cipher_suites import CIPHER_SUITES
+from encryption import EncryptionManager
+
+def _timed(function, items):
+    """Run function over items; returns (results, seconds)"""
+    started = time.perf_counter()
+    results = [function(item) for item in items]
+    return results, time.perf_counter() - started
+
+def benchmark_suite(name, entries, bulk_payload, rounds):
+    """Per-entry and bulk throughput plus ciphertext size for one cipher suite"""
+    manager = EncryptionManager()
+    manager.storage_format = "binary"
+    manager.cipher_name = name
+
+    best = {"encrypt": float("inf"), "decrypt": float("inf"), "bulk_encrypt": float("inf"), "bulk_decrypt": float("inf")}
+    for _ in range(rounds):
+        ciphertexts, seconds = _timed(manager.encrypt_password, entries)
+        best["encrypt"] = min(best["encrypt"], seconds)
+        _, seconds = _timed(manager.decrypt_password, ciphertexts)
+        best["decrypt"] = min(best["decrypt"], seconds)
+        (blob,), seconds = _timed(manager.encrypt_bytes, [bulk_payload])
+        best["bulk_encrypt"] = min(best["bulk_encrypt"], seconds)
+        _, seconds = _timed(manager.decrypt_bytes, [blob])
+        best["bulk_decrypt"] = min(best["bulk_decrypt"], seconds)
+
+    plaintext_bytes = sum(len(entry.encode()) for entry in entries)
+    megabytes = len(bulk_payload) / (1024 * 1024)
+    return {
+        "suite": name,
+        "encrypt_ops_s": len(entries) / best["encrypt"],
+        "decrypt_ops_s": len(entries) / best["decrypt"],
+        "bulk_encrypt_mb_s": megabytes / best["bulk_encrypt"],
+        "bulk_decrypt_mb_s": megabytes / best["bulk_decrypt"],
+        "avg_entry_bytes": sum(len(c) for c in ciphertexts) / len(ciphertexts),
+        "entry_overhead_bytes": (sum(len(c) for c in ciphertexts) - plaintext_bytes) / len(ciphertexts),
+        "bulk_overhead_pct": (len(blob) - len(bulk_payload)) / len(bulk_payload) * 100,
+    }
+
+def run_benchmark(entries=10000, entry_length=16, bulk_mb=4, rounds=3):
+    """Compare every registered cipher suite against Fernet"""
+    alphabet = string.ascii_letters + string.digits + string.punctuation
+    samples = [''.join(secrets.choice(alphabet) for _ in range(entry_length)) for _ in range(entries)]
+    bulk_payload = os.urandom(bulk_mb * 1024 * 1024)
+
+    print(f"{entries} entries of {entry_length} chars, {bulk_mb} MiB bulk payload, best of {rounds}")
+    print(f"{'suite':<20}{'enc ops/s':>12}{'dec ops/s':>12}{'bulk enc MB/s':>15}{'bulk dec MB/s':>15}"
+          f"{'bytes/entry':>13}{'overhead':>10}{'bulk ovh %':>12}")
+    for name in ["fernet"] + list(CIPHER_SUITES):
+        result = benchmark_suite(name, samples, bulk_payload, rounds)
+        print(f"{result['suite']:<20}{result['encrypt_ops_s']:>12,.0f}{result['decrypt_ops_s']:>12,.0f}"
+              f"{result['bulk_encrypt_mb_s']:>15,.1f}{result['bulk_decrypt_mb_s']:>15,.1f}"
+              f"{result['avg_entry_bytes']:>13.1f}{result['entry_overhead_bytes']:>10.1f}"
+              f"{result['bulk_overhead_pct']:>12.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark cipher suites for stored passwords")
+    parser.add_argument("--entries", type=int, default=10000, help="number of per-entry operations")
+    parser.add_argument("--length", type=int, default=16, help="characters per password")
+    parser.add_argument("--bulk-mb", type=int, default=4, help="bulk payload size in MiB")
+    parser.add_argument("--rounds", type=int, default=3, help="repetitions (best is reported)")
+    args = parser.parse_args()
+    run_benchmark(args.entries, args.length, args.bulk_mb, args.rounds)
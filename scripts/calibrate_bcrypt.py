@@ -0,0 +1,35 @@
+#scripts/calibrate_bcrypt.py
+import argparse
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from password_hashing import MIN_ROUNDS, MAX_ROUNDS, calibrate_rounds, config_path, load_rounds, save_rounds
+
+def calibrate(target_ms=250, min_rounds=MIN_ROUNDS, max_rounds=MAX_ROUNDS, samples=3, write=True):
+    """Measure bcrypt on this machine and (optionally) store the chosen cost"""
+    current = load_rounds()
+    print(f"Target verify latency: {target_ms} ms (cost {min_rounds}-{max_rounds}, best of {samples})")
+    rounds, timings = calibrate_rounds(target_ms, min_rounds, max_rounds, samples)
+    for cost, ms in timings.items():
+        marker = "  <- chosen" if cost == rounds else ""
+        print(f"  cost {cost:>2}: {ms:>9.1f} ms{marker}")
+    if timings[rounds] > target_ms:
+        print(f"⚠️ Even cost {rounds} exceeds the target on this machine; keeping the minimum")
+    if write:
+        save_rounds(rounds, target_ms, timings)
+        print(f"✅ Wrote cost {rounds} to {config_path()} (was {current})")
+        if os.environ.get('PASSWORD_MANAGER_BCRYPT_ROUNDS'):
+            print("⚠️ PASSWORD_MANAGER_BCRYPT_ROUNDS is set and overrides the config file")
+        if rounds != current:
+            print("Existing hashes are upgraded to the new cost on each user's next login")
+    return rounds
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pick the bcrypt cost that hits a target verify latency")
+    parser.add_argument("--target-ms", type=float, default=250, help="target time for one password check")
+    parser.add_argument("--min-rounds", type=int, default=MIN_ROUNDS, help="lowest acceptable cost")
+    parser.add_argument("--max-rounds", type=int, default=MAX_ROUNDS, help="highest cost to try")
+    parser.add_argument("--samples", type=int, default=3, help="measurements per cost (best is used)")
+    parser.add_argument("--dry-run", action="store_true", help="print the result without writing the config")
+    args = parser.parse_args()
+    calibrate(args.target_ms, args.min_rounds, args.max_rounds, args.samples, write=not args.dry_run)
@@ -0,0 +1,27 @@
+#scripts/convert_ciphertexts.py
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from database import get_manager
+from ciphertext_converter import ciphertext_converter
+
+def convert_ciphertexts():
+    """Rewrite every legacy text ciphertext into the binary storage format"""
+    manager = get_manager()
+    if not manager.is_connected():
+        print("❌ Database is not available")
+        return False
+    
+    try:
+        converted = ciphertext_converter.run(manager)
+    except Exception as e:
+        print(f"❌ Conversion failed: {e}")
+        return False
+    
+    print(f"✅ Converted {converted} ciphertext(s) to the binary format")
+    if ciphertext_converter.skipped:
+        print(f"⚠️ Skipped {ciphertext_converter.skipped} value(s) that are not Fernet tokens")
+    return True
+
+if __name__ == "__main__":
+    sys.exit(0 if convert_ciphertexts() else 1)
@@ -2,35 +2,23 @@
 import sys
 import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from database import mongo_manager
-import bcrypt
-from datetime import datetime
+from database import get_manager
 
 def setup_initial_admin():
     """Create initial admin user if no users exist"""
-    if not mongo_manager.connect():
+    if not get_manager().is_connected():
         print("Failed to connect to database")
         return False
     
     # Check if any users exist
-    if mongo_manager.db.users.count_documents({}) > 0:
+    if get_manager().users_exist():
         print("Users already exist in database")
         return True
     
     # Create admin user
     password = "admin123"  # Change this in production!
-    hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
     
-    result = mongo_manager.db.users.insert_one({
-        "username": "admin",
-        "password": hashed_password,
-        "created_at": datetime.now(),
-        "last_login": None,
-        "two_factor_secret": None,
-        "two_factor_enabled": False
-    })
-    
-    if result.inserted_id:
+    if get_manager().create_user("admin", password, is_admin=True):
         print(f"Admin user created successfully!")
         print(f"Username: admin")
         print(f"Password: admin123")  # Warn user to change this
@@ -0,0 +1,42 @@
+#scripts/rotate_encryption_key.py
+import argparse
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from database import get_manager
+from encryption import encryption_manager
+from key_rotation import KeyRotationJob
+
+def rotate_encryption_key(restart=False, max_ops_per_sec=None, workers=None):
+    """Re-encrypt every stored password under PASSWORD_MANAGER_ENCRYPTION_KEY"""
+    manager = get_manager()
+    if not manager.is_connected():
+        print("❌ Database is not available")
+        return False
+    if not encryption_manager.old_keys:
+        print("⚠️ No PASSWORD_MANAGER_OLD_ENCRYPTION_KEYS configured; entries under other keys will fail")
+    
+    job = KeyRotationJob(max_ops_per_sec=max_ops_per_sec, workers=workers)
+    try:
+        rotated = job.run(manager, resume=not restart)
+    except Exception as e:
+        print(f"❌ Rotation stopped: {e} (run again to resume from the checkpoint)")
+        return False
+    
+    print(f"✅ Rewrapped {job.rewrapped} user data keys")
+    print(f"✅ Re-encrypted {rotated} entries in this run ({job.rotated} total, {job.scanned} scanned)")
+    if job.failed:
+        print(f"❌ {job.failed} entries could not be decrypted with any configured key")
+        print(f"   Failed ids (first {len(job.failed_ids)}): {', '.join(job.failed_ids)}")
+        print("   Do not remove the old keys; run again to retry these entries")
+        return False
+    print("✅ Rotation complete; old keys can now be removed")
+    return True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-encrypt stored passwords under the current key")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and start from the beginning")
+    parser.add_argument("--max-ops", type=int, default=None, help="maximum entries per second (0 = unthrottled)")
+    parser.add_argument("--workers", type=int, default=None, help="encryption worker threads")
+    args = parser.parse_args()
+    sys.exit(0 if rotate_encryption_key(args.restart, args.max_ops, args.workers) else 1)
@@ -0,0 +1,39 @@
+#scripts/verify_indexes.py
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from database import get_manager
+from db_indexes import reconcile_indexes, verify_query_shapes
+
+def verify_indexes():
+    """Reconcile indexes and report any query shape that needs a COLLSCAN"""
+    manager = get_manager()
+    if manager.name != "mongodb" or not manager.is_connected():
+        print("Index verification needs a connected MongoDB backend")
+        return False
+    
+    for collection, names in reconcile_indexes(manager.db).items():
+        if names:
+            print(f"✅ {collection}: created {', '.join(names)}")
+        else:
+            print(f"✅ {collection}: indexes up to date")
+    
+    failures = 0
+    for result in verify_query_shapes(manager.db):
+        if result["error"]:
+            status = f"❌ ERROR {result['error']}"
+        elif result["collscan"]:
+            status = "⚠️ COLLSCAN (expected)" if result["ok"] else "❌ COLLSCAN"
+        else:
+            status = "✅ indexed"
+        failures += not result["ok"]
+        print(f"{status} {result['collection']}: {result['name']} -> {result['stages']}")
+    
+    if failures:
+        print(f"❌ {failures} query shape(s) without index coverage")
+        return False
+    print("✅ All query shapes are index-backed")
+    return True
+
+if __name__ == "__main__":
+    sys.exit(0 if verify_indexes() else 1)
@@ -0,0 +1,699 @@
+# sqlite_backend.py
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+import streamlit as st
+from password_hashing import password_hasher, HashingOverloaded
+from encryption import encryption_manager
+from storage_backend import StorageBackend, PROFILE_FIELDS, _env_int, _chunks, _bulk_results
+from rate_limiter import apply_failure
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT NOT NULL,
+        password BLOB NOT NULL,
+        created_at TEXT,
+        last_login TEXT,
+        two_factor_secret TEXT,
+        two_factor_enabled INTEGER NOT NULL DEFAULT 0,
+        is_admin INTEGER NOT NULL DEFAULT 0,
+        data_key BLOB
+    )""",
+    """CREATE TABLE IF NOT EXISTS passwords (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT NOT NULL,
+        service TEXT NOT NULL,
+        service_username TEXT,
+        password BLOB,
+        created_at TEXT,
+        updated_at TEXT
+    )""",
+    """CREATE TABLE IF NOT EXISTS rate_limits (
+        key TEXT PRIMARY KEY,
+        failures INTEGER NOT NULL,
+        locked_until REAL,
+        expires_at REAL NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS used_codes (
+        key TEXT PRIMARY KEY,
+        expires_at REAL NOT NULL
+    )""",
+    # Same unique indexes as the MongoDB collections
+    "CREATE UNIQUE INDEX IF NOT EXISTS users_username ON users (username)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS passwords_username_service ON passwords (username, service)",
+    "CREATE INDEX IF NOT EXISTS users_last_login ON users (last_login)",
+    "CREATE INDEX IF NOT EXISTS users_created_at ON users (created_at)",
+    "CREATE INDEX IF NOT EXISTS users_is_admin ON users (is_admin)",
+    "CREATE INDEX IF NOT EXISTS rate_limits_expires_at ON rate_limits (expires_at)",
+    "CREATE INDEX IF NOT EXISTS used_codes_expires_at ON used_codes (expires_at)",
+]
+
+# Columns added after a table was first released: (table, column, type).
+# init_database() adds them to existing database files.
+ADDED_COLUMNS = [
+    ("users", "data_key", "BLOB"),
+]
+
+METADATA_COLUMNS = "service, service_username, created_at, updated_at"
+
+def _to_db_time(value):
+    """Store datetimes as ISO text so they sort and compare correctly"""
+    return value.isoformat(sep=' ') if value is not None else None
+
+def _from_db_time(value):
+    return datetime.fromisoformat(value) if value else None
+
+def _row_to_dict(row):
+    """Convert a sqlite3.Row into the same dict shape the MongoDB backend returns"""
+    record = dict(row)
+    record.pop("id", None)
+    for key in ("created_at", "updated_at", "last_login"):
+        if key in record:
+            record[key] = _from_db_time(record[key])
+    for key in ("two_factor_enabled", "is_admin"):
+        if key in record:
+            record[key] = bool(record[key])
+    return record
+
+class SQLiteManager(StorageBackend):
+    """
+    Embedded SQLite storage backend for single-node installs.
+    Uses WAL journaling so readers never block the writer, and one
+    connection per thread (sqlite3 connections are not shareable).
+    """
+    name = "sqlite"
+
+    def __init__(self, path=None):
+        super().__init__()
+        self.path = path or os.environ.get('PASSWORD_MANAGER_SQLITE_PATH', "password_manager.db")
+        self.busy_timeout_ms = _env_int('PASSWORD_MANAGER_SQLITE_BUSY_TIMEOUT_MS', 5000)
+        self._local = threading.local()
+        self._pid = None
+        self._lock = threading.Lock()
+        self._rate_limits_pruned_at = 0.0
+        self._used_codes_pruned_at = 0.0
+
+    def _connection(self):
+        """Return this thread's connection, opening it on first use"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def connect(self):
+        """Open the database file (created if missing)"""
+        with self._lock:
+            try:
+                self._connection().execute("SELECT 1")
+                self._pid = os.getpid()
+                self.connected = True
+                return True
+            except Exception as e:
+                st.error(f"Failed to open SQLite database: {str(e)}")
+                self.connected = False
+                return False
+
+    def disconnect(self):
+        """Close this thread's connection"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+        self.connected = False
+        self.initialized = False
+
+    def is_connected(self):
+        """Check if database is open from the current process"""
+        return self.connected and self._pid == os.getpid()
+
+    def init_database(self):
+        """
+        Initialize the database with proper tables and indexes
+        """
+        if not self.is_connected():
+            if not self.connect():
+                return False
+
+        if self.initialized:
+            return True
+
+        conn = self._connection()
+        with conn:
+            for statement in SCHEMA:
+                conn.execute(statement)
+            for table, column, column_type in ADDED_COLUMNS:
+                existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+                if column not in existing:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+        self.initialized = True
+        return True
+
+    def _query_one(self, sql, params=()):
+        row = self._connection().execute(sql, params).fetchone()
+        return _row_to_dict(row) if row else None
+
+    def _query_all(self, sql, params=()):
+        return [_row_to_dict(row) for row in self._connection().execute(sql, params).fetchall()]
+
+    def _execute(self, sql, params=()):
+        """Run a single write in its own transaction; returns the cursor"""
+        conn = self._connection()
+        with conn:
+            return conn.execute(sql, params)
+
+    # --- Users ---
+    def get_user(self, username):
+        """Get a full user record, or None"""
+        try:
+            return self._query_one("SELECT * FROM users WHERE username = ?", (username,))
+        except Exception as e:
+            st.error(f"Error retrieving user: {str(e)}")
+            return None
+
+    def get_user_profile(self, username):
+        """Get the user's profile (no hash, no data key), or None"""
+        try:
+            return self._query_one(f"SELECT {', '.join(PROFILE_FIELDS)} FROM users WHERE username = ?", (username,))
+        except Exception as e:
+            st.error(f"Error retrieving user: {str(e)}")
+            return None
+
+    def create_user(self, username, password, is_admin=False):
+        """
+        Create a new user with hashed password
+        """
+        try:
+            hashed_password = password_hasher.hash(password)
+            self._execute(
+                "INSERT INTO users (username, password, created_at, last_login, "
+                "two_factor_secret, two_factor_enabled, is_admin) VALUES (?, ?, ?, NULL, NULL, 0, ?)",
+                (username, hashed_password, _to_db_time(datetime.now()), int(is_admin))
+            )
+            return True
+        except sqlite3.IntegrityError:
+            st.error("Username already exists")
+            return False
+        except Exception as e:
+            st.error(f"Failed to create user: {str(e)}")
+            return False
+
+    def authenticate(self, username, password):
+        """
+        Verify user credentials; returns the user's profile or None
+        """
+        try:
+            user = self._query_one(
+                f"SELECT password, {', '.join(PROFILE_FIELDS)} FROM users WHERE username = ?", (username,)
+            )
+            # last_login is recorded by crud_operations.complete_login (write-behind)
+            if not (user and password_hasher.check(password, user['password'])):
+                return None
+            hashed = user.pop('password')
+            if password_hasher.needs_rehash(hashed):
+                self._rehash_password(username, password, hashed)
+            return user
+        except HashingOverloaded:
+            raise  # Not a failed login; callers ask the user to retry
+        except Exception as e:
+            st.error(f"Error verifying user: {str(e)}")
+            return None
+
+    def update_user_password(self, username, password):
+        """Replace a user's password hash"""
+        try:
+            hashed_password = password_hasher.hash(password)
+            cursor = self._execute("UPDATE users SET password = ? WHERE username = ?",
+                                   (hashed_password, username))
+            return cursor.rowcount > 0
+        except Exception as e:
+            st.error(f"Error updating password: {str(e)}")
+            return False
+
+    def replace_password_hash(self, username, old_hash, new_hash):
+        """Compare-and-set a user's password hash"""
+        cursor = self._execute("UPDATE users SET password = ? WHERE username = ? AND password = ?",
+                               (new_hash, username, old_hash))
+        return cursor.rowcount > 0
+
+    def update_last_login(self, username):
+        """Record a successful login"""
+        try:
+            cursor = self._execute("UPDATE users SET last_login = ? WHERE username = ?",
+                                   (_to_db_time(datetime.now()), username))
+            return cursor.rowcount > 0
+        except Exception as e:
+            st.error(f"Error updating login time: {str(e)}")
+            return False
+
+    def update_last_logins(self, timestamps):
+        """Apply buffered login times in one transaction, never moving backwards"""
+        conn = self._connection()
+        with conn:
+            conn.executemany(
+                "UPDATE users SET last_login = ? WHERE username = ? AND (last_login IS NULL OR last_login < ?)",
+                [(_to_db_time(when), username, _to_db_time(when)) for username, when in timestamps.items()]
+            )
+
+    def get_user_2fa_secret(self, username):
+        """Get user's 2FA secret"""
+        user = self.get_user_profile(username)
+        return user.get('two_factor_secret') if user else None
+
+    def get_user_data_key(self, username):
+        """Get the user's wrapped data key, or None"""
+        row = self._connection().execute("SELECT data_key FROM users WHERE username = ?", (username,)).fetchone()
+        return row[0] if row else None
+
+    def set_user_data_key(self, username, wrapped_key, expected=None):
+        """Compare-and-set the user's wrapped data key"""
+        # IS compares NULL like a value, so expected=None means "no key yet"
+        cursor = self._execute("UPDATE users SET data_key = ? WHERE username = ? AND data_key IS ?",
+                               (wrapped_key, username, expected))
+        return cursor.rowcount > 0
+
+    def get_user_data_keys_batch(self, limit, after=None):
+        """Stream wrapped data keys in username order (for master key rotation)"""
+        rows = self._connection().execute(
+            "SELECT username, data_key FROM users WHERE data_key IS NOT NULL AND username > ? "
+            "ORDER BY username LIMIT ?",
+            (after or "", limit)
+        ).fetchall()
+        return [{"username": row["username"], "data_key": row["data_key"]} for row in rows]
+
+    def get_rate_limit(self, key):
+        """Unexpired rate-limit record by key"""
+        row = self._connection().execute(
+            "SELECT failures, locked_until, expires_at FROM rate_limits WHERE key = ? AND expires_at > ?",
+            (key, time.time())
+        ).fetchone()
+        return dict(row) if row else None
+
+    def hit_rate_limit(self, key, max_failures, window_seconds, lock_seconds):
+        """Count a failure; BEGIN IMMEDIATE serializes concurrent hits across processes"""
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if now - self._rate_limits_pruned_at >= 60:
+                # No TTL in SQLite: drop expired counters at most once a minute
+                conn.execute("DELETE FROM rate_limits WHERE expires_at <= ?", (now,))
+                self._rate_limits_pruned_at = now
+            row = conn.execute("SELECT failures, locked_until, expires_at FROM rate_limits WHERE key = ?",
+                               (key,)).fetchone()
+            record = apply_failure(dict(row) if row else None, now, max_failures, window_seconds, lock_seconds)
+            conn.execute(
+                "INSERT INTO rate_limits (key, failures, locked_until, expires_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET failures = excluded.failures, "
+                "locked_until = excluded.locked_until, expires_at = excluded.expires_at",
+                (key, record["failures"], record["locked_until"], record["expires_at"])
+            )
+        return record
+
+    def clear_rate_limit(self, key):
+        """Delete a rate-limit record"""
+        self._execute("DELETE FROM rate_limits WHERE key = ?", (key,))
+
+    def claim_used_code(self, key, ttl_seconds):
+        """Insert-if-absent; an expired row for the key is taken over"""
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            if now - self._used_codes_pruned_at >= 60:
+                conn.execute("DELETE FROM used_codes WHERE expires_at <= ?", (now,))
+                self._used_codes_pruned_at = now
+            cursor = conn.execute(
+                "INSERT INTO used_codes (key, expires_at) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET expires_at = excluded.expires_at WHERE used_codes.expires_at <= ?",
+                (key, now + ttl_seconds, now)
+            )
+            return cursor.rowcount > 0
+
+    def update_user_2fa_secret(self, username, secret):
+        """Update user's 2FA secret"""
+        try:
+            cursor = self._execute("UPDATE users SET two_factor_secret = ? WHERE username = ?",
+                                   (secret, username))
+            return cursor.rowcount > 0
+        except Exception as e:
+            st.error(f"Error updating 2FA secret: {str(e)}")
+            return False
+
+    def set_user_2fa_enabled(self, username, enabled: bool):
+        """Set user's 2FA enabled status"""
+        try:
+            cursor = self._execute("UPDATE users SET two_factor_enabled = ? WHERE username = ?",
+                                   (int(enabled), username))
+            return cursor.rowcount > 0
+        except Exception as e:
+            st.error(f"Error updating 2FA status: {str(e)}")
+            return False
+
+    def is_2fa_enabled(self, username):
+        """Check if 2FA is enabled for user"""
+        user = self.get_user_profile(username)
+        return user.get('two_factor_enabled', False) if user else False
+
+    def list_users(self):
+        """List users (without secrets), newest first"""
+        try:
+            return self._query_all(
+                "SELECT username, created_at, last_login, is_admin, two_factor_enabled "
+                "FROM users ORDER BY created_at DESC"
+            )
+        except Exception as e:
+            st.error(f"Error listing users: {str(e)}")
+            return []
+
+    def count_users(self, admin_only=False, logged_in_since=None, logged_in_before=None):
+        """Count users, optionally filtered by admin flag or last login"""
+        clauses, params = [], []
+        if admin_only:
+            clauses.append("is_admin = 1")
+        if logged_in_since is not None:
+            clauses.append("last_login >= ?")
+            params.append(_to_db_time(logged_in_since))
+        if logged_in_before is not None:
+            clauses.append("last_login < ?")
+            params.append(_to_db_time(logged_in_before))
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        try:
+            return self._connection().execute(f"SELECT COUNT(*) FROM users{where}", params).fetchone()[0]
+        except Exception as e:
+            st.error(f"Error counting users: {str(e)}")
+            return 0
+
+    # --- Password entries ---
+    def create_password(self, username, service, service_username, password):
+        """
+        Insert a new encrypted password entry.
+        The unique (username, service) index rejects duplicates.
+        """
+        encrypted_password = encryption_manager.encrypt_password(password, username)
+        if not encrypted_password:
+            st.error("Failed to encrypt password")
+            return None
+
+        now = datetime.now()
+        try:
+            self._execute(
+                "INSERT INTO passwords (username, service, service_username, password, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (username, service, service_username, encrypted_password, _to_db_time(now), _to_db_time(now))
+            )
+        except sqlite3.IntegrityError:
+            st.error(f"Error: Service '{service}' already exists. Use update instead.")
+            return None
+        except Exception as e:
+            st.error(f"Error saving password: {str(e)}")
+            return None
+        return {
+            "username": username,
+            "service": service,
+            "service_username": service_username,
+            "password": encrypted_password,
+            "created_at": now,
+            "updated_at": now
+        }
+
+    def update_password(self, username, service, password, service_username=None):
+        """Re-encrypt an existing entry; returns the updated entry or None"""
+        encrypted_password = encryption_manager.encrypt_password(password, username)
+        if not encrypted_password:
+            st.error("Failed to encrypt password")
+            return None
+
+        try:
+            conn = self._connection()
+            with conn:
+                if service_username is None:
+                    cursor = conn.execute(
+                        "UPDATE passwords SET password = ?, updated_at = ? WHERE username = ? AND service = ?",
+                        (encrypted_password, _to_db_time(datetime.now()), username, service)
+                    )
+                else:
+                    cursor = conn.execute(
+                        "UPDATE passwords SET password = ?, service_username = ?, updated_at = ? "
+                        "WHERE username = ? AND service = ?",
+                        (encrypted_password, service_username, _to_db_time(datetime.now()), username, service)
+                    )
+                if cursor.rowcount == 0:
+                    return None
+            return self.get_password_entry(username, service)
+        except Exception as e:
+            st.error(f"Error updating password: {str(e)}")
+            return None
+
+    def upsert_password(self, username, service, service_username, password):
+        """Create or update an encrypted entry; returns the entry or None"""
+        encrypted_password = encryption_manager.encrypt_password(password, username)
+        if not encrypted_password:
+            st.error("Failed to encrypt password")
+            return None
+
+        now = _to_db_time(datetime.now())
+        try:
+            self._execute(
+                "INSERT INTO passwords (username, service, service_username, password, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (username, service) DO UPDATE SET "
+                "service_username = excluded.service_username, password = excluded.password, "
+                "updated_at = excluded.updated_at",
+                (username, service, service_username, encrypted_password, now, now)
+            )
+            return self.get_password_entry(username, service)
+        except Exception as e:
+            st.error(f"Error saving password: {str(e)}")
+            return None
+
+    def get_password_entry(self, username, service):
+        """Get a single stored entry (still encrypted)"""
+        try:
+            return self._query_one(
+                "SELECT * FROM passwords WHERE username = ? AND service = ?", (username, service)
+            )
+        except Exception as e:
+            st.error(f"Error retrieving password: {str(e)}")
+            return None
+
+    def get_user_passwords(self, username):
+        """Get all entries (encrypted) for a user, sorted by service"""
+        try:
+            return self._query_all(
+                "SELECT * FROM passwords WHERE username = ? ORDER BY service", (username,)
+            )
+        except Exception as e:
+            st.error(f"Error retrieving passwords: {str(e)}")
+            return []
+
+    def get_user_password_metadata(self, username):
+        """Get all entries for a user without their ciphertext, sorted by service"""
+        try:
+            return self._query_all(
+                f"SELECT {METADATA_COLUMNS} FROM passwords WHERE username = ? ORDER BY service", (username,)
+            )
+        except Exception as e:
+            st.error(f"Error retrieving services: {str(e)}")
+            return []
+
+    def get_password_page(self, username, limit, after=None, before=None, from_end=False):
+        """
+        Keyset-paginate a user's entries (metadata only) on the
+        (username, service) index. Entries come back in ascending order.
+        """
+        sql = f"SELECT {METADATA_COLUMNS} FROM passwords WHERE username = ?"
+        params = [username]
+        if after is not None:
+            sql += " AND service > ?"
+            params.append(after)
+        elif before is not None:
+            sql += " AND service < ?"
+            params.append(before)
+        descending = before is not None or (from_end and after is None)
+        sql += f" ORDER BY service {'DESC' if descending else 'ASC'} LIMIT ?"
+        params.append(limit)
+        try:
+            entries = self._query_all(sql, params)
+            if descending:
+                entries.reverse()
+            return entries
+        except Exception as e:
+            st.error(f"Error retrieving services: {str(e)}")
+            return []
+
+    def count_user_passwords(self, username):
+        """Count a user's entries (answered from the (username, service) index)"""
+        try:
+            return self._connection().execute(
+                "SELECT COUNT(*) FROM passwords WHERE username = ?", (username,)
+            ).fetchone()[0]
+        except Exception as e:
+            st.error(f"Error counting services: {str(e)}")
+            return 0
+
+    def delete_password(self, username, service):
+        """
+        Delete a password for a specific service
+        """
+        try:
+            cursor = self._execute("DELETE FROM passwords WHERE username = ? AND service = ?",
+                                   (username, service))
+            return cursor.rowcount > 0
+        except Exception as e:
+            st.error(f"Error deleting password: {str(e)}")
+            return False
+
+    def save_passwords_bulk(self, username, entries):
+        """
+        Upsert many encrypted entries for one user, one transaction per chunk
+        """
+        results = _bulk_results([entry.get("service") for entry in entries])
+        now = _to_db_time(datetime.now())
+        conn = self._connection()
+        for chunk in _chunks(self._encrypt_bulk(username, entries, results), self.bulk_chunk_size):
+            try:
+                with conn:
+                    services = [entry["service"] for _, entry, _ in chunk]
+                    placeholders = ", ".join("?" * len(services))
+                    existing = {
+                        row[0] for row in conn.execute(
+                            f"SELECT service FROM passwords WHERE username = ? AND service IN ({placeholders})",
+                            [username] + services
+                        )
+                    }
+                    conn.executemany(
+                        "INSERT INTO passwords (username, service, service_username, password, created_at, updated_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?) "
+                        "ON CONFLICT (username, service) DO UPDATE SET "
+                        "service_username = excluded.service_username, password = excluded.password, "
+                        "updated_at = excluded.updated_at",
+                        [(username, entry["service"], entry.get("service_username"), ciphertext, now, now)
+                         for _, entry, ciphertext in chunk]
+                    )
+            except Exception as e:
+                for index, _, _ in chunk:
+                    results[index]["error"] = str(e)
+                continue
+            for index, entry, _ in chunk:
+                results[index]["status"] = "updated" if entry["service"] in existing else "created"
+        return results
+
+    def delete_passwords_bulk(self, username, services):
+        """
+        Delete many services for one user, one transaction per chunk
+        """
+        results = _bulk_results(services)
+        conn = self._connection()
+        for chunk in _chunks(list(enumerate(services)), self.bulk_chunk_size):
+            try:
+                with conn:
+                    names = [service for _, service in chunk]
+                    placeholders = ", ".join("?" * len(names))
+                    existing = {
+                        row[0] for row in conn.execute(
+                            f"SELECT service FROM passwords WHERE username = ? AND service IN ({placeholders})",
+                            [username] + names
+                        )
+                    }
+                    conn.execute(
+                        f"DELETE FROM passwords WHERE username = ? AND service IN ({placeholders})",
+                        [username] + names
+                    )
+            except Exception as e:
+                for index, _ in chunk:
+                    results[index]["error"] = str(e)
+                continue
+            for index, service in chunk:
+                results[index]["status"] = "deleted" if service in existing else "not_found"
+        return results
+
+    # --- Maintenance and statistics ---
+    def get_all_password_entries(self):
+        """Get every stored entry across all users"""
+        try:
+            return self._query_all("SELECT * FROM passwords")
+        except Exception as e:
+            st.error(f"Error retrieving passwords: {str(e)}")
+            return []
+
+    def set_encrypted_password(self, username, service, encrypted_password):
+        """Overwrite an entry's stored ciphertext as-is"""
+        try:
+            cursor = self._execute("UPDATE passwords SET password = ? WHERE username = ? AND service = ?",
+                                   (encrypted_password, username, service))
+            return cursor.rowcount > 0
+        except Exception as e:
+            st.error(f"Error updating password: {str(e)}")
+            return False
+
+    def has_encrypted_passwords(self):
+        """Check whether any entry already holds a Fernet token"""
+        row = self._connection().execute(
+            "SELECT 1 FROM passwords WHERE password LIKE 'gAAAA%' OR typeof(password) = 'blob' LIMIT 1"
+        ).fetchone()
+        return row is not None
+
+    def get_ciphertext_batch(self, limit, after=None, text_only=False):
+        """Stream ciphertexts in rowid order for background converters"""
+        sql = "SELECT id, username, password FROM passwords WHERE id > ?"
+        if text_only:
+            # GLOB is case-sensitive, unlike LIKE
+            sql += " AND typeof(password) = 'text' AND password GLOB 'gAAAAA*'"
+        rows = self._connection().execute(sql + " ORDER BY id LIMIT ?", (after or 0, limit)).fetchall()
+        return [{"_id": row["id"], "username": row["username"], "password": row["password"]} for row in rows]
+
+    def replace_ciphertexts(self, replacements):
+        """Compare-and-swap ciphertexts in one transaction"""
+        if not replacements:
+            return 0
+        conn = self._connection()
+        with conn:
+            before = conn.total_changes
+            conn.executemany(
+                "UPDATE passwords SET password = ? WHERE id = ? AND password = ?",
+                [(new, _id, old) for _id, old, new in replacements]
+            )
+            return conn.total_changes - before
+
+    def count_all_passwords(self):
+        """Count entries across all users"""
+        try:
+            return self._connection().execute("SELECT COUNT(*) FROM passwords").fetchone()[0]
+        except Exception as e:
+            st.error(f"Error counting passwords: {str(e)}")
+            return 0
+
+    def storage_size_bytes(self):
+        """Size of the database file in use (pages in use times page size)"""
+        conn = self._connection()
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        return (page_count - freelist) * page_size
+
+    def collection_counts(self):
+        """Row counts per table"""
+        conn = self._connection()
+        return {
+            "users": conn.execute("SELECT COUNT(*) FROM users").fetchone()[0],
+            "passwords": conn.execute("SELECT COUNT(*) FROM passwords").fetchone()[0]
+        }
+
+    def health_check(self):
+        """Return {'users': bool, 'passwords': bool}, True when readable and non-empty"""
+        conn = self._connection()
+        return {
+            "users": conn.execute("SELECT 1 FROM users LIMIT 1").fetchone() is not None,
+            "passwords": conn.execute("SELECT 1 FROM passwords LIMIT 1").fetchone() is not None
+        }
+
+# Global SQLite manager instance
+sqlite_manager = SQLiteManager()
@@ -0,0 +1,94 @@
+# static_assets.py
+import base64
+import hashlib
+import mimetypes
+import os
+import shutil
+import threading
+from pathlib import Path
+
+APP_DIR = Path(__file__).resolve().parent
+STATIC_DIR = APP_DIR / "static"  # Streamlit serves <main script dir>/static/ at app/static/
+STATIC_URL = "app/static"
+
+def _digest(path):
+    return hashlib.sha256(path.read_bytes()).hexdigest()[:12]
+
+class StaticAssets:
+    """
+    Serves images under assets/ through Streamlit's static file server.
+
+    The first time an image is asked for, it is copied into static/ (if
+    missing or changed) and a versioned URL is returned:
+    app/static/<name>?v=<content hash>. Tornado sends a long max-age for
+    versioned URLs, so the browser downloads each image once and reruns
+    only carry the short URL. URLs are memoized per process.
+
+    Without server.enableStaticServing (or if static/ is not writable) the
+    image falls back to a data: URI, built once and memoized as well.
+    """
+    def __init__(self, static_dir=None, enabled=None):
+        self.static_dir = Path(static_dir) if static_dir else STATIC_DIR
+        self.enabled = enabled
+        self._urls = {}
+        self._lock = threading.Lock()
+        self.published = 0
+        self.inlined = 0
+
+    def serving_enabled(self):
+        """server.enableStaticServing from .streamlit/config.toml"""
+        if self.enabled is None:
+            try:
+                import streamlit as st
+                self.enabled = bool(st.get_option("server.enableStaticServing"))
+            except Exception:
+                self.enabled = False
+        return self.enabled
+
+    def _publish(self, source):
+        """Copy source into static/ unless an identical copy is there; returns its URL"""
+        digest = _digest(source)
+        target = self.static_dir / source.name
+        if not target.is_file() or _digest(target) != digest:
+            self.static_dir.mkdir(exist_ok=True)
+            temp_path = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+            shutil.copyfile(source, temp_path)
+            os.replace(temp_path, target)  # Other workers never see a partial file
+            self.published += 1
+        return f"{STATIC_URL}/{target.name}?v={digest}"
+
+    def _inline(self, source):
+        mime = mimetypes.guess_type(source.name)[0] or "application/octet-stream"
+        self.inlined += 1
+        return f"data:{mime};base64,{base64.b64encode(source.read_bytes()).decode()}"
+
+    def url(self, path):
+        """Browser URL for an image (relative to the app directory), or None if it is missing"""
+        with self._lock:
+            if path in self._urls:
+                return self._urls[path]
+        source = Path(path) if Path(path).is_absolute() else APP_DIR / path
+        url = None
+        if source.is_file():
+            if self.serving_enabled():
+                try:
+                    url = self._publish(source)
+                except OSError as e:
+                    print(f"static assets: could not publish {source.name}, inlining it: {e}")
+            if url is None:
+                url = self._inline(source)
+        with self._lock:
+            self._urls[path] = url
+        return url
+
+    def status(self):
+        """Snapshot for diagnostics pages"""
+        with self._lock:
+            urls = dict(self._urls)
+        return {"static_serving": self.serving_enabled(), "static_dir": str(self.static_dir),
+                "published": self.published, "inlined": self.inlined,
+                "assets": {path: "data: URI" if url and url.startswith("data:") else url
+                           for path, url in urls.items()}}
+
+# Global static asset registry
+static_assets = StaticAssets()
@@ -0,0 +1,332 @@
+# storage_backend.py
+import os
+from encryption import encryption_manager
+
+def _env_int(name, default):
+    """Read an integer setting from the environment with fallback"""
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+def _env_bool(name, default):
+    """Read a boolean setting from the environment with fallback"""
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+# A user's profile: the user record without the password hash or wrapped data key
+PROFILE_FIELDS = ("username", "created_at", "last_login", "two_factor_secret", "two_factor_enabled", "is_admin")
+
+def _chunks(items, size):
+    """Yield successive lists of at most `size` items"""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def _bulk_results(keys):
+    """Blank per-item result records for a bulk operation, in input order"""
+    return [{"service": key, "status": "error", "error": None} for key in keys]
+
+class StorageBackend:
+    """
+    Interface shared by every storage backend (MongoDB, SQLite).
+
+    Users are dicts with the keys username, password (bcrypt hash),
+    created_at, last_login, two_factor_secret, two_factor_enabled,
+    is_admin and data_key (the user's wrapped data-encryption key).
+    Password entries are dicts with username, service, service_username,
+    password (ciphertext), created_at and updated_at.
+    Methods report failures through st.error() and return a falsy value,
+    matching the rest of the app.
+    """
+    name = "base"
+
+    def __init__(self):
+        self.connected = False  # Track connection status
+        self.initialized = False  # Tables/collections and indexes verified
+        # Maximum operations sent to the server per bulk request
+        self.bulk_chunk_size = max(1, _env_int('PASSWORD_MANAGER_BULK_CHUNK_SIZE', 500))
+
+    # --- Connection lifecycle ---
+    def connect(self):
+        """Open (or reuse) the backend connection"""
+        raise NotImplementedError
+
+    def disconnect(self):
+        """Close the backend connection"""
+        raise NotImplementedError
+
+    def is_connected(self):
+        """Check if the backend is connected from the current process"""
+        return self.connected
+
+    def init_database(self):
+        """Create the schema and indexes if needed"""
+        raise NotImplementedError
+
+    # --- Users ---
+    def get_user(self, username):
+        """Get a full user record, or None"""
+        raise NotImplementedError
+
+    def get_user_profile(self, username):
+        """Get the user's profile (PROFILE_FIELDS only), or None"""
+        raise NotImplementedError
+
+    def create_user(self, username, password, is_admin=False):
+        """Create a new user with hashed password"""
+        raise NotImplementedError
+
+    def authenticate(self, username, password):
+        """
+        Verify credentials with a single user read. Returns the user's
+        profile if the password matches, else None. Raises
+        HashingOverloaded when the hashing pool sheds the check.
+        """
+        raise NotImplementedError
+
+    def verify_user(self, username, password):
+        """Verify user credentials"""
+        return self.authenticate(username, password) is not None
+
+    def update_user_password(self, username, password):
+        """Replace a user's password hash"""
+        raise NotImplementedError
+
+    def replace_password_hash(self, username, old_hash, new_hash):
+        """
+        Swap a user's password hash only if it still equals old_hash, so a
+        concurrent password change is never overwritten. Returns True if
+        it was written. Raises on failure.
+        """
+        raise NotImplementedError
+
+    def _rehash_password(self, username, password, old_hash):
+        """
+        After a successful check, re-hash a password stored with a stale
+        bcrypt cost. Best effort: on failure (or a saturated hashing pool)
+        the old hash stays valid and the upgrade is retried next login.
+        """
+        # Imported lazily: password_hashing imports this module
+        from password_hashing import password_hasher
+        try:
+            if self.replace_password_hash(username, old_hash, password_hasher.hash(password)):
+                password_hasher.rehashed += 1
+        except Exception as e:
+            print(f"bcrypt rehash skipped for {username}: {e}")
+
+    def update_last_login(self, username):
+        """Record a successful login"""
+        raise NotImplementedError
+
+    def update_last_logins(self, timestamps):
+        """
+        Apply buffered {username: datetime} login times in one batch,
+        never moving a last_login backwards. Raises on failure (used by
+        the background flusher in login_tracker).
+        """
+        raise NotImplementedError
+
+    def get_user_2fa_secret(self, username):
+        """Get user's 2FA secret"""
+        raise NotImplementedError
+
+    def update_user_2fa_secret(self, username, secret):
+        """Update user's 2FA secret"""
+        raise NotImplementedError
+
+    def set_user_2fa_enabled(self, username, enabled: bool):
+        """Set user's 2FA enabled status"""
+        raise NotImplementedError
+
+    def is_2fa_enabled(self, username):
+        """Check if 2FA is enabled for user"""
+        raise NotImplementedError
+
+    def get_user_data_key(self, username):
+        """Get the user's wrapped data key, or None. Raises on failure."""
+        raise NotImplementedError
+
+    def set_user_data_key(self, username, wrapped_key, expected=None):
+        """
+        Store a wrapped data key only if the current value equals `expected`
+        (None = no key yet). Returns True if it was written.
+        """
+        raise NotImplementedError
+
+    def get_user_data_keys_batch(self, limit, after=None):
+        """
+        Up to `limit` {'username', 'data_key'} dicts for users that have a
+        data key, in username order after `after`. Raises on failure.
+        """
+        raise NotImplementedError
+
+    def list_users(self):
+        """List users (without secrets), newest first"""
+        raise NotImplementedError
+
+    # --- Rate limits (see rate_limiter.py) ---
+    def get_rate_limit(self, key):
+        """
+        Unexpired {failures, locked_until, expires_at} record for a
+        rate-limit key (times in epoch seconds), or None. Raises on failure.
+        """
+        raise NotImplementedError
+
+    def hit_rate_limit(self, key, max_failures, window_seconds, lock_seconds):
+        """
+        Atomically count one failure for the key (see
+        rate_limiter.apply_failure) and return the updated record.
+        Raises on failure.
+        """
+        raise NotImplementedError
+
+    def clear_rate_limit(self, key):
+        """Delete the key's record. Raises on failure."""
+        raise NotImplementedError
+
+    def claim_used_code(self, key, ttl_seconds):
+        """
+        Record a one-time code (see totp_service.py) as used for
+        ttl_seconds. Returns True for the first claim, False if the key
+        is already claimed and unexpired. Raises on failure.
+        """
+        raise NotImplementedError
+
+    def count_users(self, admin_only=False, logged_in_since=None, logged_in_before=None):
+        """Count users, optionally filtered by admin flag or last login"""
+        raise NotImplementedError
+
+    def users_exist(self):
+        """Check whether any user account exists"""
+        return self.count_users() > 0
+
+    # --- Password entries ---
+    def create_password(self, username, service, service_username, password):
+        """Insert a new encrypted entry; returns the stored entry or None"""
+        raise NotImplementedError
+
+    def update_password(self, username, service, password, service_username=None):
+        """Re-encrypt an existing entry; returns the updated entry or None"""
+        raise NotImplementedError
+
+    def upsert_password(self, username, service, service_username, password):
+        """Create or update an encrypted entry; returns the entry or None"""
+        raise NotImplementedError
+
+    def save_password(self, username, service, service_username, password):
+        """Save or update a password for a user with encryption"""
+        return self.upsert_password(username, service, service_username, password) is not None
+
+    def get_password_entry(self, username, service):
+        """Get a single stored entry (still encrypted)"""
+        raise NotImplementedError
+
+    def get_decrypted_password(self, username, service):
+        """Retrieve and decrypt a password"""
+        entry = self.get_password_entry(username, service)
+
+        if entry and 'password' in entry:
+            return encryption_manager.decrypt_password(entry['password'], username)
+        return None
+
+    def get_user_passwords(self, username):
+        """Get all entries (encrypted) for a user, sorted by service"""
+        raise NotImplementedError
+
+    def get_user_password_metadata(self, username):
+        """Get all entries for a user without their ciphertext, sorted by service"""
+        raise NotImplementedError
+
+    def get_password_page(self, username, limit, after=None, before=None, from_end=False):
+        """Keyset-paginate a user's entries (metadata only) by service name"""
+        raise NotImplementedError
+
+    def count_user_passwords(self, username):
+        """Count a user's entries"""
+        raise NotImplementedError
+
+    def delete_password(self, username, service):
+        """Delete a password for a specific service"""
+        raise NotImplementedError
+
+    def save_passwords_bulk(self, username, entries):
+        """
+        Create or update many entries for one user. `entries` are dicts with
+        service, service_username and password (plaintext). Returns one
+        result per entry, in input order: {'service', 'status', 'error'}
+        where status is 'created', 'updated' or 'error'.
+        """
+        raise NotImplementedError
+
+    def delete_passwords_bulk(self, username, services):
+        """
+        Delete many services for one user. Returns one result per service,
+        in input order, with status 'deleted', 'not_found' or 'error'.
+        """
+        raise NotImplementedError
+
+    def _encrypt_bulk(self, username, entries, results):
+        """
+        Encrypt every entry's password up front. Returns (index, entry,
+        ciphertext) for the ones that succeeded and marks the rest as
+        errors in `results`.
+        """
+        ciphertexts, errors = encryption_manager.encrypt_many(
+            [entry.get("password") for entry in entries], username
+        )
+        encrypted = []
+        for index, (entry, ciphertext) in enumerate(zip(entries, ciphertexts)):
+            if index in errors:
+                results[index]["error"] = f"Failed to encrypt password: {errors[index]}"
+            else:
+                encrypted.append((index, entry, ciphertext))
+        return encrypted
+
+    # --- Maintenance and statistics ---
+    def get_all_password_entries(self):
+        """Get every stored entry across all users"""
+        raise NotImplementedError
+
+    def set_encrypted_password(self, username, service, encrypted_password):
+        """Overwrite an entry's stored ciphertext as-is"""
+        raise NotImplementedError
+
+    def has_encrypted_passwords(self):
+        """Check whether any entry already holds a Fernet token (text or binary)"""
+        raise NotImplementedError
+
+    def get_ciphertext_batch(self, limit, after=None, text_only=False):
+        """
+        Stream stored ciphertexts in primary-key order: up to `limit`
+        {'_id', 'username', 'password'} dicts with _id greater than `after`.
+        text_only restricts it to legacy base64 Fernet tokens.
+        Raises on failure (used by background jobs).
+        """
+        raise NotImplementedError
+
+    def replace_ciphertexts(self, replacements):
+        """
+        Swap stored ciphertexts in one batch. `replacements` are
+        (_id, old, new) tuples; a row only changes if it still holds `old`,
+        so concurrent user updates win. Returns the number of rows changed.
+        Raises on failure.
+        """
+        raise NotImplementedError
+
+    def count_all_passwords(self):
+        """Count entries across all users"""
+        raise NotImplementedError
+
+    def storage_size_bytes(self):
+        """Approximate data size of users and passwords together"""
+        raise NotImplementedError
+
+    def collection_counts(self):
+        """Document/row counts per collection, e.g. {'users': 3, 'passwords': 40}"""
+        raise NotImplementedError
+
+    def health_check(self):
+        """Return {'users': bool, 'passwords': bool}, True when readable and non-empty"""
+        raise NotImplementedError
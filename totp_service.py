@@ -0,0 +1,128 @@
+# totp_service.py
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+import pyotp
+from storage_backend import _env_int, _env_bool
+
+class TOTPService:
+    """
+    Shared TOTP verification for login and 2FA setup.
+
+    pyotp.TOTP objects are cached per secret (bounded LRU), and the codes
+    valid in the current step (plus `window` steps either side for clock
+    drift) are computed once per step and kept as a code -> counter map,
+    so a check is one dict lookup. An accepted (secret, counter) pair is
+    claimed in a shared used-code set (a TTL collection / table in the
+    storage backend, mirrored in process), so a replayed code is rejected
+    in any session or worker process until it has left the window.
+    """
+    def __init__(self, window=None, max_size=None, shared=None):
+        self.window = window if window is not None else max(0, _env_int('PASSWORD_MANAGER_TOTP_WINDOW', 1))
+        self.max_size = max_size or max(1, _env_int('PASSWORD_MANAGER_TOTP_CACHE_SIZE', 1024))
+        self.shared = shared if shared is not None else _env_bool('PASSWORD_MANAGER_TOTP_SHARED_REPLAY', True)
+        self._entries = OrderedDict()  # secret -> [TOTP, step, {code: counter}]
+        self._used = {}  # claim key -> expiry (in-process mirror / fallback)
+        self._lock = threading.Lock()
+        self._pruned_at = time.time()
+        self.replays = 0
+
+    def _entry(self, secret):
+        """Cached [TOTP, step, codes] for a secret (lock held)"""
+        entry = self._entries.get(secret)
+        if entry is None:
+            entry = [pyotp.TOTP(secret), None, {}]
+            self._entries[secret] = entry
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        else:
+            self._entries.move_to_end(secret)
+        return entry
+
+    def totp(self, secret):
+        """Cached pyotp.TOTP for the secret"""
+        with self._lock:
+            return self._entry(secret)[0]
+
+    def _window_codes(self, secret, now):
+        """code -> counter for every step accepted at `now` (recomputed once per step)"""
+        with self._lock:
+            entry = self._entry(secret)
+            totp = entry[0]
+            step = int(now // totp.interval)  # Same counter as totp.timecode()
+            if entry[1] != step:
+                entry[2] = {totp.generate_otp(counter): counter
+                            for counter in range(step - self.window, step + self.window + 1)}
+                entry[1] = step
+            return entry[2], totp.interval
+
+    def now(self, secret):
+        """Current code for the secret (raises for an invalid secret)"""
+        return self.totp(secret).now()
+
+    def provisioning_uri(self, secret, username, issuer_name="SentinelKey Password Manager"):
+        """otpauth:// URI for authenticator apps"""
+        return self.totp(secret).provisioning_uri(name=username, issuer_name=issuer_name)
+
+    # --- replay protection ---
+    def _claim_key(self, secret, counter):
+        # The secret itself never leaves the process; only a digest names it
+        return f"totp:{hashlib.sha256(secret.encode()).hexdigest()[:32]}:{counter}"
+
+    def _claim(self, key, ttl):
+        """True if this is the first use of key within ttl seconds"""
+        now = time.time()
+        with self._lock:
+            if now - self._pruned_at >= 60:
+                self._used = {k: expiry for k, expiry in self._used.items() if expiry > now}
+                self._pruned_at = now
+            if self._used.get(key, 0) > now:
+                return False  # Fast path: already used in this process
+            self._used[key] = now + ttl
+        if self.shared:
+            try:
+                # Imported lazily: database imports modules that import this one
+                from database import get_manager
+                return get_manager().claim_used_code(key, ttl)
+            except Exception as e:
+                print(f"TOTP replay store unavailable, using in-process set: {e}")
+        return True
+
+    def verify(self, secret, code):
+        """
+        True if code is valid for the secret now and has not been accepted
+        before. Each accepted code is consumed.
+        """
+        code = str(code or "").strip()
+        if not secret or not code:
+            return False
+        now = time.time()
+        codes, interval = self._window_codes(secret, now)
+        counter = codes.get(code)
+        if counter is None:
+            return False
+        # Keep the claim until the counter has left the accepted window
+        ttl = (counter + self.window + 1) * interval - now + interval
+        if not self._claim(self._claim_key(secret, counter), max(ttl, interval)):
+            self.replays += 1
+            return False
+        return True
+
+    def status(self):
+        """Cache snapshot for diagnostics pages"""
+        with self._lock:
+            return {"cached_secrets": len(self._entries), "max_size": self.max_size, "window": self.window,
+                    "shared_replay_store": self.shared, "used_codes_in_process": len(self._used),
+                    "replays_rejected": self.replays}
+
+    def _reset_after_fork(self):
+        """Locks held by other threads at fork() would never be released"""
+        self._lock = threading.Lock()
+
+# Global TOTP service
+totp_service = TOTPService()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=totp_service._reset_after_fork)
@@ -1,7 +1,6 @@
 import pyotp
-import qrcode
-import base64
-from io import BytesIO
+from totp_service import totp_service
+from qr_provisioning import qr_images
 
 def generate_2fa_secret():
     """Generates a new TOTP secret key."""
@@ -9,37 +8,23 @@ def generate_2fa_secret():
 
 def get_provisioning_uri(username, secret, issuer_name="SentinelKey Password Manager"):
     """Generates the provisioning URI for TOTP."""
-    totp = pyotp.TOTP(secret)
-    return totp.provisioning_uri(name=username, issuer_name=issuer_name)
+    return totp_service.provisioning_uri(secret, username, issuer_name)
 
 def generate_qr_code_base64(provisioning_uri):
     """Generates a QR code from a provisioning URI and returns it as a base64 string."""
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=4,
-    )
-    qr.add_data(provisioning_uri)
-    qr.make(fit=True)
+    return qr_images.png_base64(provisioning_uri)
 
-    img = qr.make_image(fill_color="black", back_color="white")
-    buffered = BytesIO()
-    img.save(buffered, format="PNG")
-    return base64.b64encode(buffered.getvalue()).decode()
-
-def verify_2fa_code(secret, code, window=1):
+def verify_2fa_code(secret, code):
     """
-    Verifies a 2FA code against the secret with time window tolerance.
-    window=1 allows codes from 1 period before and after current time.
+    Verifies a 2FA code against the secret with time window tolerance
+    (PASSWORD_MANAGER_TOTP_WINDOW periods before and after, default 1).
+    A code is accepted only once: replays fail in every session and process.
     """
     if not secret or not code:
         return False
     
     try:
-        totp = pyotp.TOTP(secret)
-        # Use valid_window to allow for clock drift - checks current + previous + next time windows
-        return totp.verify(code, valid_window=window)
+        return totp_service.verify(secret, code)
     except Exception as e:
         print(f"2FA verification error: {e}")
         return False